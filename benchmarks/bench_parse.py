@@ -0,0 +1,71 @@
+"""Parse throughput of proxy pages: full pydantic validation vs. the fast path.
+
+uv run python -m benchmarks.bench_parse --count 50000
+"""
+
+import argparse
+import json
+import time
+from typing import List
+
+from cscs_storage_sync.models import PaginatedResponse, parse_page
+
+from .synthetic import make_page, make_resources
+
+
+def measure(fn, pages: List[bytes], count: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for payload in pages:
+            fn(payload)
+        best = min(best, time.perf_counter() - started)
+    return count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pending-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    mix = {"active": 1 - args.pending_ratio, "pending": args.pending_ratio}
+    resources = make_resources(args.count, mix)
+    size = args.page_size
+    pages = [
+        json.dumps(make_page(resources[i : i + size], i // size + 1, size, args.count)).encode()
+        for i in range(0, args.count, size)
+    ]
+
+    def full(content: bytes):
+        page = PaginatedResponse(**json.loads(content))
+        for res in page.resources:
+            _ = (res.target.targetItem.unixGid, res.permission, res.quotas)
+
+    def fast(content: bytes):
+        # Touch the fields the processor reads, so lazy validation is included.
+        page = parse_page(content)
+        for res in page.resources:
+            _ = (res.target.targetItem.unixGid, res.permission, res.quotas)
+
+    full_rate = measure(full, pages, args.count, args.repeat)
+    fast_rate = measure(fast, pages, args.count, args.repeat)
+    print(
+        json.dumps(
+            {
+                "resources": args.count,
+                "page_size": size,
+                "payload_bytes": sum(len(p) for p in pages),
+                "full_validation_per_second": round(full_rate),
+                "fast_path_per_second": round(fast_rate),
+                "speedup": round(fast_rate / full_rate, 2),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""End-to-end load simulation of the sync pipeline.
+
+Starts a fake storage proxy serving N synthetic resources, puts a fake `lfs` on
+PATH and syncs into a tmpfs storage root, then reports per-cycle wall time, HTTP
+requests, subprocess spawns, filesystem syscalls per resource and peak RSS as JSON.
+Each size runs in its own interpreter so peak RSS is not shared between sizes.
+
+    uv run python -m benchmarks.bench_sync --sizes 1000,10000,100000 --output bench.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Any, Dict, Iterator
+from unittest import mock
+
+from cscs_storage_sync.api_client import StorageProxyClient
+from cscs_storage_sync.filesystem import FilesystemDriver
+from cscs_storage_sync.processors import ResourceProcessor
+from cscs_storage_sync.quota import QuotaEngine
+from cscs_storage_sync.quota_backend import build_quota_backend
+from cscs_storage_sync.scheduler import SyncScheduler
+from cscs_storage_sync.state import StateStore
+
+from .fake_proxy import FakeStorageProxy
+from .synthetic import make_resources
+
+FAKE_LFS = '#!/bin/sh\necho "$*" >> "$LFS_LOG"\n'
+
+COUNTED_SYSCALLS = ("stat", "lstat", "mkdir", "chown", "chmod", "rename", "scandir")
+
+
+class SyscallCounter:
+    """Counts calls to os-level filesystem functions (pathlib goes through these)."""
+
+    def __init__(self):
+        self.counts = dict.fromkeys(COUNTED_SYSCALLS, 0)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def patch(self) -> Iterator[None]:
+        patches = []
+        for name in COUNTED_SYSCALLS:
+            original = getattr(os, name)
+            patches.append(mock.patch.object(os, name, self._wrap(name, original)))
+        for p in patches:
+            p.start()
+        try:
+            yield
+        finally:
+            for p in patches:
+                p.stop()
+
+    def _wrap(self, name, original):
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.counts[name] += 1
+            return original(*args, **kwargs)
+
+        return counted
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(COUNTED_SYSCALLS, 0)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parses 'active=0.9,pending=0.1' into a weight map."""
+    mix = {}
+    for part in value.split(","):
+        key, _, weight = part.partition("=")
+        mix[key.strip()] = float(weight or 1)
+    return mix
+
+
+def storage_base() -> str:
+    # tmpfs keeps the measurement about syscall counts rather than disk latency
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def run_size(size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(dir=storage_base(), prefix="cscs-bench-") as tmp:
+        work = Path(tmp)
+        bin_dir = work / "bin"
+        bin_dir.mkdir()
+        lfs = bin_dir / "lfs"
+        lfs.write_text(FAKE_LFS)
+        lfs.chmod(lfs.stat().st_mode | stat.S_IEXEC)
+        lfs_log = work / "lfs.log"
+        os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.environ["LFS_LOG"] = str(lfs_log)
+
+        with FakeStorageProxy([]) as proxy:
+            # Callbacks go to the same fake server so they are counted too.
+            proxy.resources = make_resources(
+                size,
+                parse_mix(args.status_mix),
+                parse_mix(args.target_mix),
+                seed=args.seed,
+                callback_base=f"{proxy.base_url}/callbacks",
+            )
+
+            config = {
+                "min_gid_allowed": 1000,
+                "archive_dir": str(work / "archive"),
+                "workers": args.workers,
+                "sync_interval_seconds": 3600,
+            }
+            client = StorageProxyClient(
+                proxy.url,
+                "proxy-token",
+                "waldur-token",
+                page_size=args.page_size,
+                max_parallel_pages=args.max_parallel_pages,
+            )
+            client.start_dispatcher(max_in_flight=args.callback_in_flight)
+            fs = FilesystemDriver(
+                str(work / "root"),
+                debug_mode=os.geteuid() != 0,
+                quota_backend=build_quota_backend(args.quota_backend),
+            )
+            state = StateStore(str(work / "state")) if args.state else None
+            quota_engine = QuotaEngine(fs) if args.quota_batching else None
+            processor = ResourceProcessor(
+                fs, client, config, state=state, quota_engine=quota_engine
+            )
+            scheduler = SyncScheduler(client, processor, config)
+
+            counter = SyscallCounter()
+            cycles = []
+            for cycle in range(args.cycles):
+                proxy.reset_counts()
+                counter.reset()
+                lfs_log.write_text("")
+
+                started = time.perf_counter()
+                with counter.patch():
+                    scheduler.run_full_cycle()
+                processed = time.perf_counter()
+                while client.dispatcher.pending():
+                    time.sleep(0.005)
+                drained = time.perf_counter()
+
+                syscalls = dict(counter.counts)
+                cycles.append(
+                    {
+                        "cycle": cycle + 1,
+                        "wall_seconds": round(processed - started, 4),
+                        "callback_drain_seconds": round(drained - processed, 4),
+                        "resources_per_second": round(size / (processed - started)),
+                        "http_requests": dict(proxy.counts),
+                        "subprocess_spawns": len(lfs_log.read_text().splitlines()),
+                        "syscalls": syscalls,
+                        "syscalls_per_resource": round(sum(syscalls.values()) / size, 3),
+                    }
+                )
+
+            client.close()
+            if state:
+                state.close()
+
+    return {
+        "resources": size,
+        "cycles": cycles,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--status-mix", default="active=0.97,pending=0.02,removing=0.01")
+    parser.add_argument("--target-mix", default="project=0.9,customer=0.08,tenant=0.02")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--max-parallel-pages", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--callback-in-flight", type=int, default=8)
+    parser.add_argument("--state", action="store_true", help="Enable the incremental state store")
+    parser.add_argument("--quota-batching", action="store_true")
+    parser.add_argument("--quota-backend", default="cli", choices=("cli", "llapi", "fake"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_size(args.single, args)))
+        return
+
+    # Forward everything except the size list and output to the per-size runs.
+    forwarded = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+            continue
+        if arg in ("--sizes", "--output"):
+            skip = True
+            continue
+        if arg.startswith(("--sizes=", "--output=")):
+            continue
+        forwarded.append(arg)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",") if s):
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_sync", "--single", str(size), *forwarded],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    try:
+        package_version = version("cscs-storage-sync")
+    except PackageNotFoundError:
+        package_version = "unknown"
+
+    report = {
+        "version": package_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("single", "output")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
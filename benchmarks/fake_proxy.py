@@ -0,0 +1,74 @@
+"""In-process stand-in for the Waldur storage proxy and Waldur callback endpoints."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from .synthetic import make_page
+
+
+class FakeStorageProxy:
+    """Serves a fixed resource list with page/page_size pagination.
+
+    GET /api/storage-resources/ returns pages; any POST (callbacks) returns 200.
+    Request counts are kept per method.
+    """
+
+    def __init__(self, resources: List[Dict[str, Any]]):
+        self.resources = resources
+        self.counts = {"GET": 0, "POST": 0}
+        self._lock = threading.Lock()
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, body: bytes):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                proxy._count("GET")
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                items = proxy.resources
+                if "status" in query:
+                    wanted = set(query["status"].split(","))
+                    items = [r for r in items if r["status"] in wanted]
+                page, size = int(query.get("page", 1)), int(query.get("page_size", 100))
+                chunk = items[(page - 1) * size : page * size]
+                self._reply(json.dumps(make_page(chunk, page, size, len(items))).encode())
+
+            def do_POST(self):
+                proxy._count("POST")
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                self._reply(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.url = f"{self.base_url}/api/storage-resources/"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _count(self, method: str):
+        with self._lock:
+            self.counts[method] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = {"GET": 0, "POST": 0}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
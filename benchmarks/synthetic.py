@@ -0,0 +1,92 @@
+"""Synthetic Waldur storage proxy payloads for benchmarks."""
+
+import random
+from typing import Any, Dict, List, Optional
+
+
+def make_resource(
+    index: int,
+    status: str = "active",
+    target_type: str = "project",
+    system: str = "capstor",
+    parent: Optional[str] = None,
+    callback_base: str = "https://waldur.example.com/api/marketplace-orders",
+) -> Dict[str, Any]:
+    item_id = f"res-{index:07d}"
+    target_item: Dict[str, Any] = {
+        "itemId": f"{target_type}-{index}",
+        "name": f"{target_type}{index}",
+    }
+    if target_type == "project":
+        target_item["unixGid"] = 10000 + index
+    else:
+        target_item["key"] = f"{target_type}{index}"
+
+    callback = f"{callback_base}/{item_id}"
+    return {
+        "itemId": item_id,
+        "status": status,
+        "mountPoint": {"default": f"/{system}/store/{target_type}{index}"},
+        "permission": {"permissionType": "octal", "value": "2770"},
+        "quotas": [
+            {"type": "space", "quota": 1.0, "unit": "TB", "enforcementType": "soft"},
+            {"type": "space", "quota": 1.5, "unit": "TB", "enforcementType": "hard"},
+            {"type": "inodes", "quota": 1000000, "unit": "", "enforcementType": "soft"},
+            {"type": "inodes", "quota": 1500000, "unit": "", "enforcementType": "hard"},
+        ],
+        "target": {"targetType": target_type, "targetItem": target_item},
+        "storageSystem": {"itemId": f"sys-{system}", "key": system, "name": system, "active": True},
+        "storageFileSystem": {
+            "itemId": "fs-lustre",
+            "key": "lustre",
+            "name": "Lustre",
+            "active": True,
+        },
+        "storageDataType": {"itemId": "dt-store", "key": "store", "name": "Store", "active": True},
+        "parentItemId": parent,
+        "approve_by_provider_url": f"{callback}/approve_by_provider/",
+        "set_state_done_url": f"{callback}/set_state_done/",
+        "set_state_erred_url": f"{callback}/set_state_erred/",
+        "update_resource_options_url": f"{callback}/update_resource_options/",
+        "set_backend_id_url": f"{callback}/set_backend_id/",
+    }
+
+
+def make_resources(
+    count: int,
+    status_mix: Optional[Dict[str, float]] = None,
+    target_mix: Optional[Dict[str, float]] = None,
+    seed: int = 0,
+    **kwargs: Any,
+) -> List[Dict[str, Any]]:
+    """Builds `count` resources with statuses and target types drawn from weighted mixes."""
+    status_mix = status_mix or {"active": 1.0}
+    target_mix = target_mix or {"project": 1.0}
+    rng = random.Random(seed)
+    statuses, status_weights = list(status_mix), list(status_mix.values())
+    targets, target_weights = list(target_mix), list(target_mix.values())
+    return [
+        make_resource(
+            i,
+            status=rng.choices(statuses, status_weights)[0],
+            target_type=rng.choices(targets, target_weights)[0],
+            **kwargs,
+        )
+        for i in range(count)
+    ]
+
+
+def make_page(
+    resources: List[Dict[str, Any]], page: int, page_size: int, total: int
+) -> Dict[str, Any]:
+    return {
+        "status": "success",
+        "resources": resources,
+        "pagination": {
+            "current": page,
+            "limit": page_size,
+            "offset": (page - 1) * page_size,
+            "pages": max(1, -(-total // page_size)),
+            "total": total,
+        },
+    }
@@ -1,16 +1,92 @@
 import logging
-from typing import List
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from tenacity import (
+    RetryCallState,
+    Retrying,
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
-from .models import PaginatedResponse, StorageResource
+from .callbacks import CallbackDispatcher, backoff_delay, is_retryable
+from .models import PaginatedResponse, Resource, parse_page, parse_resource, resource_to_raw
+from .throttle import AdaptivePageSize, CircuitBreaker, CircuitOpenError, retry_after_seconds
 
 logger = logging.getLogger(__name__)
 
 
+class IncompleteInventoryError(Exception):
+    """Raised when an inventory walk stops early; what was fetched is not the whole list."""
+
+    def __init__(self, fetched: int, total: Optional[int], cause: Exception):
+        expected = "an unknown number of" if total is None else f"{total}"
+        super().__init__(f"Fetched {fetched} of {expected} resources: {cause}")
+        self.fetched = fetched
+        self.total = total
+
+
+@dataclass
+class PollResult:
+    # False when the proxy reported no changes (304 or an empty delta)
+    changed: bool
+    # True when resources is the whole inventory rather than a delta
+    full: bool
+    resources: Iterable[Resource] = field(default_factory=list)
+
+
 class StorageProxyClient:
-    def __init__(self, base_url: str, proxy_token: str, waldur_token: str):
+    def __init__(
+        self,
+        base_url: str,
+        proxy_token: str,
+        waldur_token: str,
+        page_size: int = 100,
+        max_parallel_pages: int = 4,
+        timeout: float = 30.0,
+        delta_param: Optional[str] = None,
+        page_size_min: Optional[int] = None,
+        page_size_max: Optional[int] = None,
+        page_target_seconds: float = 2.0,
+        page_max_bytes: int = 8 * 1024 * 1024,
+        max_retries: int = 5,
+        max_retry_after: float = 300.0,
+        breaker_threshold: int = 5,
+        breaker_reset_seconds: float = 60.0,
+    ):
         self.base_url = base_url
+        self.max_parallel_pages = max(1, max_parallel_pages)
+        self.timeout = timeout
+        # Page size of the next walk; all pages of one walk use the same size.
+        self.pager = AdaptivePageSize(
+            page_size,
+            min_size=page_size_min,
+            max_size=page_size_max,
+            target_seconds=page_target_seconds,
+            max_bytes=page_max_bytes,
+        )
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_seconds)
+        self.max_retry_after = max_retry_after
+        self._retrying = Retrying(
+            retry=retry_if_exception(self._should_retry),
+            stop=stop_after_attempt(max(1, max_retries)),
+            wait=self._retry_wait,
+            reraise=True,
+        )
+        # Set from Retry-After: no request to the proxy before this (monotonic) time.
+        self._rate_lock = threading.Lock()
+        self._not_before = 0.0
         self.proxy_headers = {
             "Authorization": f"Bearer {proxy_token}",
             "User-Agent": "CSCS-Storage-Sync/0.1.0",
@@ -22,54 +98,407 @@ class StorageProxyClient:
             "Content-Type": "application/json",
         }
 
-    def fetch_all_resources(self, storage_system: str = None) -> List[StorageResource]:
-        all_resources = []
-        page = 1
-        page_size = 100
+        # One keep-alive pool shared by paging and callbacks. The pool must be at
+        # least as large as the page fan-out, otherwise connections get discarded.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(10, self.max_parallel_pages))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-        while True:
-            params = {"page": page, "page_size": page_size}
-            if storage_system:
-                params["storage_system"] = storage_system
+        self.dispatcher: Optional[CallbackDispatcher] = None
+        self._scope = threading.local()
 
-            try:
-                logger.debug(f"Fetching page {page}...")
-                resp = requests.get(self.base_url, headers=self.proxy_headers, params=params)
-                resp.raise_for_status()
+        # Conditional polling state, see poll()
+        self.delta_param = delta_param
+        self.inventory: Dict[str, Resource] = {}
+        self.last_walk_complete = False
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
+        self._since: Optional[str] = None
+
+    def start_dispatcher(
+        self, spool_dir: Optional[str] = None, max_in_flight: int = 4, max_attempts: int = 20
+    ) -> None:
+        """Switches send_callback to background delivery through a CallbackDispatcher."""
+        # Resolved on each call so wrappers installed later (e.g. metrics) apply.
+        self.dispatcher = CallbackDispatcher(
+            lambda url, data: self._post_callback(url, data),
+            spool_dir=spool_dir,
+            max_in_flight=max_in_flight,
+            max_attempts=max_attempts,
+        )
+        self.dispatcher.start()
+
+    def close(self, drain_timeout: float = 10.0) -> None:
+        if self.dispatcher:
+            self.dispatcher.stop(timeout=drain_timeout)
+        self.session.close()
+
+    @contextmanager
+    def callback_scope(self, key: str) -> Iterator[None]:
+        """Callbacks sent inside the scope are delivered in order relative to each other."""
+        previous = getattr(self._scope, "key", None)
+        self._scope.key = key
+        try:
+            yield
+        finally:
+            self._scope.key = previous
+
+    def _get_page(
+        self,
+        page: int,
+        storage_system: Optional[str],
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        page_size: Optional[int] = None,
+    ) -> requests.Response:
+        """GETs one page, retrying 429 (after Retry-After), 5xx and transport errors."""
+        query: Dict[str, Any] = {"page": page, "page_size": page_size or self.pager.size}
+        if storage_system:
+            query["storage_system"] = storage_system
+        if params:
+            query.update(params)
+
+        logger.debug(f"Fetching page {page}...")
+        return self._retrying(self._request, query, {**self.proxy_headers, **(headers or {})})
+
+    def _request(self, query: Dict[str, Any], headers: Dict[str, str]) -> requests.Response:
+        with self._rate_lock:
+            delay = self._not_before - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.breaker.before_request()
+
+        try:
+            resp = self.session.get(
+                self.base_url, headers=headers, params=query, timeout=self.timeout
+            )
+        except requests.Timeout:
+            self.breaker.record_failure()
+            self.pager.shrink()
+            raise
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        status = resp.status_code
+        if status == 429:
+            pause = retry_after_seconds(resp)
+            if pause is not None:
+                logger.warning(f"Proxy rate limit hit, pausing requests for {pause:.1f}s")
+                with self._rate_lock:
+                    self._not_before = max(self._not_before, time.monotonic() + pause)
+            raise requests.HTTPError(f"429 Too Many Requests: {resp.url}", response=resp)
+        if status >= 500:
+            self.breaker.record_failure()
+            # Large pages are the usual reason for proxy timeouts and 5xx.
+            self.pager.shrink()
+            raise requests.HTTPError(f"{status} Server Error: {resp.url}", response=resp)
+        self.breaker.record_success()
+        return resp
 
-                data = resp.json()
-                parsed = PaginatedResponse(**data)
+    def _should_retry(self, exc: BaseException) -> bool:
+        if isinstance(exc, CircuitOpenError):
+            return False
+        with self._rate_lock:
+            wait = self._not_before - time.monotonic()
+        if wait > self.max_retry_after:
+            logger.error(f"Proxy asked to wait {wait:.0f}s, longer than max_retry_after")
+            return False
+        return is_retryable(exc)
 
-                all_resources.extend(parsed.resources)
+    def _retry_wait(self, retry_state: RetryCallState) -> float:
+        # Requests themselves wait for Retry-After, see _request().
+        delay = backoff_delay(retry_state.attempt_number, 0.5, 30.0)
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        logger.warning(f"Proxy request failed ({error}), retrying")
+        return delay
 
-                # Check pagination
-                if not parsed.pagination:
-                    break
+    def _fetch_page(
+        self,
+        page: int,
+        storage_system: Optional[str],
+        params: Optional[Dict[str, Any]] = None,
+        page_size: Optional[int] = None,
+    ) -> PaginatedResponse:
+        started = time.monotonic()
+        resp = self._get_page(page, storage_system, params, page_size=page_size)
+        resp.raise_for_status()
+        return self._parse_timed(resp, started)
 
-                total_items = parsed.pagination.total
-                if len(all_resources) >= total_items:
-                    break
+    def _parse_timed(self, resp: requests.Response, started: float) -> PaginatedResponse:
+        parsed = self._parse_page(resp.content)
+        # Fetch plus parse time of the page sizes the next walk.
+        self.pager.observe(len(parsed.resources), time.monotonic() - started, len(resp.content))
+        return parsed
+
+    def _parse_page(self, content: bytes) -> PaginatedResponse:
+        return parse_page(content)
+
+    def iter_resources(
+        self, storage_system: Optional[str] = None, params: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Resource]:
+        """Yields resources page by page, in page order, as soon as each page is parsed.
+
+        After the first page reports the page count, up to ``max_parallel_pages``
+        further pages are fetched ahead of the consumer, so at most that many pages
+        are held in memory. Items that shift between pages are yielded only once.
+
+        Raises IncompleteInventoryError if a page cannot be fetched or parsed, so a
+        truncated walk is never mistaken for the whole inventory.
+        """
+        self.last_walk_complete = False
+        page_size = self.pager.size
+        try:
+            first = self._fetch_page(1, storage_system, params, page_size=page_size)
+        except Exception as e:
+            logger.error(f"Failed to fetch the first page: {e}")
+            raise IncompleteInventoryError(0, None, e) from e
+
+        yield from self._walk(first, storage_system, params, page_size)
+
+    def _walk(
+        self,
+        first: PaginatedResponse,
+        storage_system: Optional[str],
+        params: Optional[Dict[str, Any]],
+        page_size: int,
+    ) -> Iterator[Resource]:
+        """Yields the first page, then fetches and yields the remaining ones."""
+        self.last_walk_complete = False
+        seen = set()
+        yielded = 0
+
+        def unique(page: int, parsed: PaginatedResponse) -> Iterator[Resource]:
+            nonlocal yielded
+            for res in parsed.resources:
+                if res.itemId in seen:
+                    logger.debug(f"Duplicate resource {res.itemId} on page {page}, skipping.")
+                    continue
+                seen.add(res.itemId)
+                yielded += 1
+                yield res
+
+        total_items = first.pagination.total if first.pagination else 0
+        total_pages = first.pagination.pages if first.pagination else 1
+        has_more = bool(first.resources) and total_pages > 1
+        yield from unique(1, first)
+        del first
+        if not has_more:
+            self.last_walk_complete = True
+            return
+
+        pool = ThreadPoolExecutor(max_workers=self.max_parallel_pages, thread_name_prefix="page")
+        window: Deque[Tuple[int, "Future[PaginatedResponse]"]] = deque()
+        next_page = 2
+
+        def fill() -> None:
+            nonlocal next_page
+            while next_page <= total_pages and len(window) < self.max_parallel_pages:
+                future = pool.submit(self._fetch_page, next_page, storage_system, params, page_size)
+                window.append((next_page, future))
+                next_page += 1
+
+        try:
+            fill()
+            while window:
+                page, future = window.popleft()
+                try:
+                    parsed = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to fetch page {page}: {e}")
+                    raise IncompleteInventoryError(yielded, total_items, e) from e
+                fill()
 
-                if parsed.resources:
-                    page += 1
-                else:
-                    break
+                if parsed.pagination and parsed.pagination.total != total_items:
+                    logger.warning(
+                        f"Inventory changed during pagination: total {total_items} -> "
+                        f"{parsed.pagination.total} on page {page}"
+                    )
+                if page < total_pages and len(parsed.resources) < page_size:
+                    logger.warning(
+                        f"Short page {page}: got {len(parsed.resources)} of {page_size} resources"
+                    )
+                yield from unique(page, parsed)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
 
-            except requests.RequestException as e:
-                logger.error(f"API request failed: {e}")
-                break
-            except Exception as e:
-                logger.error(f"Parsing error: {e}")
-                break
+        if yielded < total_items:
+            logger.warning(f"Fetched {yielded} of {total_items} resources.")
+        # Fewer items than announced: the inventory shrank or shifted while paging.
+        self.last_walk_complete = yielded >= total_items
 
-        return all_resources
+    def fetch_all_resources(self, storage_system: Optional[str] = None) -> List[Resource]:
+        return list(self.iter_resources(storage_system))
 
-    def send_callback(self, url: str, data: dict = None):
+    # -- Conditional polling -----------------------------------------------------
+
+    def poll(self, storage_system: Optional[str] = None) -> PollResult:
+        """Fetches only what changed since the previous poll.
+
+        Uses the ``delta_param`` query parameter when the proxy supports it, and
+        otherwise a conditional request (If-None-Match / If-Modified-Since) on the
+        first page; the proxy is expected to compute its validators over the whole
+        filtered inventory. Results are merged into ``self.inventory``.
+        """
+        params: Dict[str, Any] = {}
+        headers: Dict[str, str] = {}
+        delta = bool(self.delta_param and self._since)
+        if delta and self.delta_param:
+            params[self.delta_param] = self._since
+        else:
+            if self._etag:
+                headers["If-None-Match"] = self._etag
+            if self._last_modified:
+                headers["If-Modified-Since"] = self._last_modified
+
+        requested_at = datetime.now(timezone.utc)
+        started = time.monotonic()
+        page_size = self.pager.size
+        try:
+            resp = self._get_page(1, storage_system, params, headers, page_size=page_size)
+            if resp.status_code == 304:
+                logger.info("Inventory not modified since last poll.")
+                return PollResult(changed=False, full=False, resources=[])
+            resp.raise_for_status()
+            first = self._parse_timed(resp, started)
+        except Exception as e:
+            logger.error(f"Failed to fetch the first page: {e}")
+            raise IncompleteInventoryError(0, None, e) from e
+
+        validators = (
+            resp.headers.get("ETag"),
+            resp.headers.get("Last-Modified"),
+            self._server_time(resp, requested_at),
+        )
+        stream = self._walk(first, storage_system, params, page_size)
+
+        if not delta:
+            return PollResult(
+                changed=True, full=True, resources=self._track_full(stream, validators)
+            )
+
+        # Deltas are small, so they are merged eagerly.
+        changes = list(stream)
+        for res in changes:
+            self._merge(res)
+        if self.last_walk_complete:
+            self._etag, self._last_modified, self._since = validators
+        logger.info(f"Delta poll returned {len(changes)} changed resources.")
+        return PollResult(changed=bool(changes), full=False, resources=changes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Polling validators, cached inventory and page size, for a warm restart."""
+        return {
+            "etag": self._etag,
+            "last_modified": self._last_modified,
+            "since": self._since,
+            "page_size": self.pager.size,
+            "inventory": [resource_to_raw(res) for res in list(self.inventory.values())],
+        }
+
+    def restore(self, data: Dict[str, Any]) -> None:
+        """Resumes conditional polling from a snapshot; an unchanged inventory is then
+        answered with 304 instead of being downloaded again."""
+        try:
+            inventory = {}
+            for raw in data.get("inventory", []):
+                res = parse_resource(raw)
+                inventory[res.itemId] = res
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Ignoring cached inventory: {e}")
+            return
+        self.inventory = inventory
+        self._etag = data.get("etag")
+        self._last_modified = data.get("last_modified")
+        self._since = data.get("since")
+        if data.get("page_size"):
+            self.pager.reset(data["page_size"])
+        logger.info(f"Restored cached inventory of {len(inventory)} resources")
+
+    def cached_inventory(self) -> List[Resource]:
+        return list(self.inventory.values())
+
+    def _merge(self, res: Resource) -> None:
+        if res.status == "removed":
+            self.inventory.pop(res.itemId, None)
+        else:
+            self.inventory[res.itemId] = res
+
+    def _track_full(
+        self, stream: Iterator[Resource], validators: Tuple[Optional[str], ...]
+    ) -> Iterator[Resource]:
+        seen = set()
+        for res in stream:
+            seen.add(res.itemId)
+            self._merge(res)
+            yield res
+
+        # Only a complete walk may drop cached items or advance the validators.
+        if self.last_walk_complete:
+            for item_id in set(self.inventory) - seen:
+                del self.inventory[item_id]
+            self._etag, self._last_modified, self._since = validators
+
+    @staticmethod
+    def _server_time(resp: requests.Response, fallback: datetime) -> str:
+        date = resp.headers.get("Date")
+        if date:
+            try:
+                return parsedate_to_datetime(date).isoformat()
+            except (TypeError, ValueError):
+                pass
+        return fallback.isoformat()
+
+    def _post_callback(self, url: str, data: Optional[Dict[str, Any]]) -> None:
+        resp = self.session.post(url, headers=self.waldur_headers, json=data, timeout=self.timeout)
+        resp.raise_for_status()
+
+    @retry(
+        retry=retry_if_exception(is_retryable),
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(multiplier=0.5, max=5),
+        reraise=True,
+    )
+    def _post_callback_with_retry(self, url: str, data: Optional[Dict[str, Any]]) -> None:
+        self._post_callback(url, data)
+
+    def post(self, url: str, data: Dict[str, Any]) -> None:
+        """POSTs to Waldur right away, with retries; raises when it fails."""
+        self._post_callback_with_retry(url, data)
+
+    def send_callback(self, url: str, data: Optional[Dict[str, Any]] = None) -> None:
         if not url:
             return
+
+        if self.dispatcher:
+            key = getattr(self._scope, "key", None) or url
+            self.dispatcher.submit(key, url, data)
+            return
+
         try:
             logger.info(f"Callback: {url} | Data: {data}")
-            resp = requests.post(url, headers=self.waldur_headers, json=data)
-            resp.raise_for_status()
+            self._post_callback_with_retry(url, data)
         except Exception as e:
             logger.error(f"Failed to send callback: {e}")
+
+
+def build_client(config: Dict[str, Any]) -> StorageProxyClient:
+    """Creates the proxy client from the agent configuration."""
+    page_size = config.get("page_size", 100)
+    return StorageProxyClient(
+        base_url=config["proxy_url"],
+        proxy_token=config["api_token"],
+        waldur_token=config["waldur_api_token"],
+        page_size=page_size,
+        max_parallel_pages=config.get("max_parallel_pages", 4),
+        delta_param=config.get("delta_param"),
+        page_size_min=config.get("page_size_min", page_size),
+        page_size_max=config.get("page_size_max", page_size),
+        page_target_seconds=config.get("page_target_seconds", 2.0),
+        page_max_bytes=config.get("page_max_bytes", 8 * 1024 * 1024),
+        max_retries=config.get("proxy_max_retries", 5),
+        max_retry_after=config.get("proxy_max_retry_after_seconds", 300),
+        breaker_threshold=config.get("proxy_breaker_threshold", 5),
+        breaker_reset_seconds=config.get("proxy_breaker_reset_seconds", 60),
+    )
@@ -0,0 +1,299 @@
+import errno
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from .filesystem import FilesystemDriver
+
+logger = logging.getLogger(__name__)
+
+# Journal states
+COPYING = "copying"
+DELETING = "deleting"
+DONE = "done"
+
+
+class ArchiveInterrupted(Exception):
+    """The engine was closed while an archive job was running; it resumes on restart."""
+
+
+class ArchiveEngine:
+    """Moves removed resources into the archive without blocking the sync loop.
+
+    When the archive lives on the same filesystem as the resource (same st_dev),
+    the directory is renamed atomically. Otherwise it is copied in the background
+    by ``copy_workers`` threads and deleted once the copy is complete. Progress is
+    kept in a journal per itemId under ``journal_dir``, so a restarted agent resumes
+    the job: files already present in the archive with the same size and mtime are
+    not copied again.
+
+    ``archive()`` returns True once the resource is fully archived, False while a
+    background job is still running; callers poll it on later cycles, and
+    ``on_complete(item_id)`` is called when a background job finishes.
+    """
+
+    def __init__(
+        self,
+        fs: FilesystemDriver,
+        archive_root: str,
+        journal_dir: Optional[str] = None,
+        max_jobs: int = 2,
+        copy_workers: int = 8,
+        on_complete: Optional[Callable[[str], None]] = None,
+    ):
+        self.fs = fs
+        self.on_complete = on_complete
+        self.archive_root = Path(archive_root)
+        self.journal_dir = Path(journal_dir) if journal_dir else self.archive_root / ".journal"
+        self.copy_workers = max(1, copy_workers)
+        self._jobs: Dict[str, "Future[None]"] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_jobs), thread_name_prefix="archive")
+
+    # -- Journal -----------------------------------------------------------------
+
+    def _journal_path(self, item_id: str) -> Path:
+        return self.journal_dir / f"{item_id}.json"
+
+    def _load_journal(self, item_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            journal: Dict[str, Any] = json.loads(self._journal_path(item_id).read_text())
+            return journal
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"Ignoring corrupt archive journal for {item_id}: {e}")
+            return None
+
+    def _write_journal(self, journal: Dict[str, Any]) -> None:
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        path = self._journal_path(journal["item_id"])
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(journal))
+        os.replace(tmp, path)
+
+    def _remove_journal(self, item_id: str) -> None:
+        try:
+            self._journal_path(item_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    # -- Public API --------------------------------------------------------------
+
+    def destination(self, full_path: Path, item_id: str) -> Path:
+        # Deterministic, so a retried or resumed job targets the same directory.
+        return self.archive_root / f"{full_path.name}_archived_{item_id}"
+
+    def in_progress(self, item_id: str) -> bool:
+        with self._lock:
+            if item_id in self._jobs:
+                return True
+        journal = self._load_journal(item_id)
+        return journal is not None and journal["state"] != DONE
+
+    def journaled(self, prefix: str = "") -> Dict[str, Path]:
+        """Source directory per job id starting with prefix that has a journal, i.e. is
+        running, waiting to be resumed, or finished but not yet collected by archive()."""
+        if not self.journal_dir.is_dir():
+            return {}
+        jobs = {}
+        for path in sorted(self.journal_dir.glob(f"{prefix}*.json")):
+            journal = self._load_journal(path.stem)
+            if journal is not None:
+                jobs[path.stem] = Path(journal["source"])
+        return jobs
+
+    def archive(self, rel_path: str, item_id: str) -> bool:
+        """Archives rel_path. Returns True when done, False while still in progress.
+
+        Raises the error of a failed background job once; the next call retries it.
+        """
+        with self._lock:
+            future = self._jobs.get(item_id)
+            if future is not None:
+                if not future.done():
+                    return False
+                del self._jobs[item_id]
+                future.result()
+                self._remove_journal(item_id)
+                return True
+
+        full_path = self.fs.resolve(rel_path)
+        journal = self._load_journal(item_id)
+        if journal is not None:
+            if journal["state"] == DONE:
+                self._remove_journal(item_id)
+                return True
+            self._submit(journal)
+            return False
+
+        dest = self.destination(full_path, item_id)
+        if not full_path.exists():
+            if not dest.exists():
+                logger.warning(f"Directory {full_path} not found, skipping archive.")
+            return True
+
+        logger.info(f"Archiving {full_path} -> {dest}")
+        if self.fs.dry_run:
+            return True
+
+        self.archive_root.mkdir(parents=True, exist_ok=True)
+        if os.stat(full_path).st_dev == os.stat(self.archive_root).st_dev:
+            try:
+                os.rename(full_path, dest)
+                self.fs.invalidate(full_path, tree=True)
+                return True
+            except OSError as e:
+                # Same device but different mounts (e.g. bind mounts) still gives EXDEV.
+                if e.errno != errno.EXDEV:
+                    raise
+
+        logger.info(f"{full_path} is on another filesystem than the archive, copying")
+        journal = {
+            "item_id": item_id,
+            "source": str(full_path),
+            "dest": str(dest),
+            "state": COPYING,
+            "files": 0,
+            "bytes": 0,
+            "started": time.time(),
+        }
+        self._write_journal(journal)
+        self._submit(journal)
+        return False
+
+    def resume(self) -> None:
+        """Restarts the unfinished jobs found in the journal directory."""
+        if not self.journal_dir.is_dir():
+            return
+        for path in sorted(self.journal_dir.glob("*.json")):
+            journal = self._load_journal(path.stem)
+            if journal and journal["state"] != DONE:
+                logger.info(f"Resuming archive of {journal['source']}")
+                self._submit(journal)
+
+    def close(self) -> None:
+        """Stops running jobs between files; their journals let them resume later."""
+        self._stopped.set()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    # -- Background copy ---------------------------------------------------------
+
+    def _submit(self, journal: Dict[str, Any]) -> None:
+        with self._lock:
+            if journal["item_id"] in self._jobs:
+                return
+            future = self._pool.submit(self._run, journal)
+            self._jobs[journal["item_id"]] = future
+        if self.on_complete:
+            # Called once the future is done, so archive() then reports the result.
+            future.add_done_callback(lambda f: self._notify(journal["item_id"], f))
+
+    def _notify(self, item_id: str, future: "Future[None]") -> None:
+        if future.cancelled() or isinstance(future.exception(), ArchiveInterrupted):
+            return
+        if self.on_complete:
+            self.on_complete(item_id)
+
+    def _run(self, journal: Dict[str, Any]) -> None:
+        source, dest = Path(journal["source"]), Path(journal["dest"])
+        try:
+            if journal["state"] == COPYING:
+                if source.exists():
+                    self._copy_tree(source, dest, journal)
+                journal["state"] = DELETING
+                self._write_journal(journal)
+
+            if source.exists():
+                shutil.rmtree(source)
+            self.fs.invalidate(source, tree=True)
+            journal["state"] = DONE
+            journal["finished"] = time.time()
+            self._write_journal(journal)
+            logger.info(
+                f"Archived {source} -> {dest} ({journal['files']} files, {journal['bytes']} bytes)"
+            )
+        except ArchiveInterrupted:
+            logger.info(f"Archive of {source} interrupted, will resume on restart")
+            raise
+        except Exception as e:
+            logger.error(f"Archive of {source} failed: {e}")
+            raise
+
+    def _copy_tree(self, source: Path, dest: Path, journal: Dict[str, Any]) -> None:
+        dirs = []
+        with ThreadPoolExecutor(self.copy_workers, thread_name_prefix="archive-copy") as pool:
+            for dirpath, dirnames, filenames in os.walk(source):
+                if self._stopped.is_set():
+                    raise ArchiveInterrupted(str(source))
+                src_dir = Path(dirpath)
+                dst_dir = dest / src_dir.relative_to(source)
+                dst_dir.mkdir(parents=True, exist_ok=True)
+                dirs.append((src_dir, dst_dir))
+
+                # os.walk lists symlinks to directories as directories; copy them as links.
+                names = list(filenames)
+                for name in list(dirnames):
+                    if (src_dir / name).is_symlink():
+                        dirnames.remove(name)
+                        names.append(name)
+
+                pairs = [(src_dir / n, dst_dir / n) for n in names]
+                for copied in pool.map(lambda pair: self._copy_file(*pair), pairs):
+                    if copied is not None:
+                        journal["files"] += 1
+                        journal["bytes"] += copied
+                self._write_journal(journal)
+
+        # Directory metadata last, since copying files into them updates their mtime.
+        for src_dir, dst_dir in reversed(dirs):
+            shutil.copystat(src_dir, dst_dir)
+            self._copy_owner(src_dir, dst_dir)
+
+    def _copy_file(self, src: Path, dst: Path) -> Optional[int]:
+        """Copies one file, symlink or empty special file. Returns bytes copied, or None
+        when the archive already holds an identical copy."""
+        if self._stopped.is_set():
+            raise ArchiveInterrupted(str(src))
+        st = os.lstat(src)
+        try:
+            existing = os.lstat(dst)
+            if (
+                stat.S_IFMT(existing.st_mode) == stat.S_IFMT(st.st_mode)
+                and existing.st_size == st.st_size
+                and int(existing.st_mtime) == int(st.st_mtime)
+            ):
+                return None
+            os.unlink(dst)
+        except FileNotFoundError:
+            pass
+
+        if stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), dst)
+        elif stat.S_ISREG(st.st_mode):
+            # Copy under a temporary name so a partial file is never taken as complete.
+            partial = dst.with_name(f".{dst.name}.partial")
+            shutil.copy2(src, partial)
+            os.replace(partial, dst)
+        else:
+            logger.warning(f"Skipping special file {src}")
+            return 0
+        self._copy_owner(src, dst)
+        return st.st_size
+
+    def _copy_owner(self, src: Path, dst: Path) -> None:
+        if self.fs.debug_mode:
+            return
+        st = os.lstat(src)
+        try:
+            os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+        except PermissionError as e:
+            logger.warning(f"Could not preserve ownership of {dst}: {e}")
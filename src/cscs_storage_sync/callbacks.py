@@ -0,0 +1,287 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying; any other 4xx means the request itself is wrong.
+RETRYABLE_STATUS = {408, 425, 429}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status >= 500 or status in RETRYABLE_STATUS
+    return isinstance(exc, requests.RequestException)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+
+class _Callback:
+    __slots__ = ("seq", "key", "url", "data", "attempts")
+
+    def __init__(
+        self, seq: int, key: str, url: str, data: Optional[Dict[str, Any]], attempts: int = 0
+    ):
+        self.seq = seq
+        self.key = key
+        self.url = url
+        self.data = data
+        self.attempts = attempts
+
+    @property
+    def identity(self) -> Tuple[str, str, str]:
+        return self.key, self.url, json.dumps(self.data, sort_keys=True)
+
+
+class CallbackDispatcher:
+    """Delivers Waldur callbacks in the background.
+
+    Callbacks are queued per key (the resource itemId) and delivered strictly in
+    submission order within a key, while different keys are delivered concurrently
+    with at most ``max_in_flight`` POSTs at a time. Failed deliveries are retried
+    with exponential backoff and jitter. When ``spool_dir`` is set, every queued
+    callback is also written to disk and re-queued on the next start.
+
+    A callback identical to one still queued for its key (same URL and payload) is
+    dropped: resources are processed again every cycle until Waldur moves them on.
+    Callbacks that failed ``max_attempts`` times, or with a non-retryable error,
+    are appended to ``dead_letter_path`` (default: ``<spool_dir>/dead_letter.jsonl``).
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, Optional[Dict[str, Any]]], None],
+        spool_dir: Optional[str] = None,
+        max_in_flight: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 300.0,
+        max_attempts: int = 20,
+        dead_letter_path: Optional[str] = None,
+    ):
+        self.send = send
+        self.max_in_flight = max(1, max_in_flight)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max(1, max_attempts)
+        self.spool_dir = Path(spool_dir) if spool_dir else None
+        if dead_letter_path:
+            self.dead_letter_path: Optional[Path] = Path(dead_letter_path)
+        else:
+            self.dead_letter_path = self.spool_dir / DEAD_LETTER_FILE if self.spool_dir else None
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Callback]] = {}
+        self._queued: Set[Tuple[str, str, str]] = set()
+        self._ready: Deque[str] = deque()
+        self._delayed: List[Tuple[float, int, str]] = []
+        self._in_flight: Set[str] = set()
+        self._tiebreak = itertools.count()
+        self._seq = itertools.count(1)
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+        if self.spool_dir:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+            self._load_spool(self.spool_dir)
+
+    # -- Spool -----------------------------------------------------------------
+
+    @staticmethod
+    def _spool_path(spool_dir: Path, seq: int) -> Path:
+        return spool_dir / f"{seq:020d}.json"
+
+    def _load_spool(self, spool_dir: Path) -> None:
+        entries = sorted(spool_dir.glob("*.json"))
+        last_seq = 0
+        for path in entries:
+            try:
+                record = json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                logger.error(f"Discarding unreadable spooled callback {path}: {e}")
+                path.unlink(missing_ok=True)
+                continue
+            cb = _Callback(
+                record["seq"],
+                record["key"],
+                record["url"],
+                record.get("data"),
+                attempts=record.get("attempts", 0),
+            )
+            last_seq = max(last_seq, cb.seq)
+            if cb.identity in self._queued:
+                path.unlink(missing_ok=True)
+                continue
+            self._enqueue(cb)
+        self._seq = itertools.count(last_seq + 1)
+        if entries:
+            logger.info(f"Recovered {len(entries)} undelivered callbacks from {spool_dir}")
+
+    def _write_spool(self, spool_dir: Path, cb: _Callback) -> None:
+        path = self._spool_path(spool_dir, cb.seq)
+        tmp = path.with_suffix(".tmp")
+        record = {
+            "seq": cb.seq,
+            "key": cb.key,
+            "url": cb.url,
+            "data": cb.data,
+            "attempts": cb.attempts,
+        }
+        tmp.write_text(json.dumps(record))
+        os.replace(tmp, path)
+
+    def _dead_letter(self, cb: _Callback, error: Exception) -> None:
+        logger.error(f"Giving up on callback {cb.url} after {cb.attempts} attempts: {error}")
+        if not self.dead_letter_path:
+            return
+        record = {
+            "key": cb.key,
+            "url": cb.url,
+            "data": cb.data,
+            "attempts": cb.attempts,
+            "error": str(error),
+            "failed_at": time.time(),
+        }
+        try:
+            with self.dead_letter_path.open("a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.error(f"Could not write dead letter {self.dead_letter_path}: {e}")
+
+    def _remove_spool(self, cb: _Callback) -> None:
+        if self.spool_dir:
+            self._spool_path(self.spool_dir, cb.seq).unlink(missing_ok=True)
+
+    # -- Queueing --------------------------------------------------------------
+
+    def _enqueue(self, cb: _Callback) -> None:
+        # Called with _cond held (or before the dispatcher thread exists).
+        queue = self._queues.setdefault(cb.key, deque())
+        queue.append(cb)
+        self._queued.add(cb.identity)
+        if len(queue) == 1 and cb.key not in self._in_flight:
+            self._ready.append(cb.key)
+
+    def submit(self, key: str, url: str, data: Optional[Dict[str, Any]] = None) -> bool:
+        """Queues a callback; False if an identical one is still queued for key."""
+        cb = _Callback(next(self._seq), key, url, data)
+        with self._cond:
+            if cb.identity in self._queued:
+                logger.debug(f"Callback {url} for {key} is already queued")
+                return False
+            # Spooled under the lock so a concurrent duplicate cannot be written too.
+            if self.spool_dir:
+                self._write_spool(self.spool_dir, cb)
+            self._enqueue(cb)
+            self._cond.notify_all()
+        return True
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    # -- Delivery --------------------------------------------------------------
+
+    def start(self) -> None:
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_in_flight, thread_name_prefix="callback"
+        )
+        self._thread = threading.Thread(
+            target=self._run, args=(self._pool,), name="callback-dispatcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Waits up to ``timeout`` seconds for queued callbacks, then stops.
+
+        Whatever is left stays in the spool for the next start.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            while self._queues and self._running:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+        if self._pool:
+            self._pool.shutdown(wait=True)
+        left = self.pending()
+        if left:
+            logger.warning(f"Stopping with {left} undelivered callbacks")
+
+    def _run(self, pool: ThreadPoolExecutor) -> None:
+        with self._cond:
+            while self._running:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, _, key = heapq.heappop(self._delayed)
+                    self._ready.append(key)
+
+                while self._ready and len(self._in_flight) < self.max_in_flight:
+                    key = self._ready.popleft()
+                    self._in_flight.add(key)
+                    pool.submit(self._deliver, self._queues[key][0])
+
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(timeout)
+
+    def _deliver(self, cb: _Callback) -> None:
+        retry_at = None
+        try:
+            logger.info(f"Callback: {cb.url} | Data: {cb.data}")
+            self.send(cb.url, cb.data)
+        except Exception as e:
+            cb.attempts += 1
+            if is_retryable(e) and cb.attempts < self.max_attempts:
+                delay = backoff_delay(cb.attempts, self.base_delay, self.max_delay)
+                logger.warning(
+                    f"Callback {cb.url} failed (attempt {cb.attempts}), retrying in "
+                    f"{delay:.1f}s: {e}"
+                )
+                retry_at = time.monotonic() + delay
+                if self.spool_dir:
+                    # Attempts survive a restart.
+                    self._write_spool(self.spool_dir, cb)
+            else:
+                self._dead_letter(cb, e)
+
+        with self._cond:
+            self._in_flight.discard(cb.key)
+            queue = self._queues[cb.key]
+            if retry_at is not None:
+                heapq.heappush(self._delayed, (retry_at, next(self._tiebreak), cb.key))
+            else:
+                queue.popleft()
+                self._queued.discard(cb.identity)
+                self._remove_spool(cb)
+                if queue:
+                    self._ready.append(cb.key)
+                else:
+                    del self._queues[cb.key]
+            self._cond.notify_all()
@@ -0,0 +1,315 @@
+"""Out-of-band change detection for managed directories.
+
+A change feed reports paths whose attributes changed or that were removed; the
+DriftIndex maps them back to the itemIds whose mountPoint they are (or contain),
+and the DriftWatcher hands those itemIds to the scheduler for re-enforcement.
+This replaces re-stat-ing every directory in each full reconciliation.
+"""
+
+import abc
+import logging
+import os
+import re
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .filesystem import DirAttrs, FilesystemDriver
+from .models import Resource
+
+logger = logging.getLogger(__name__)
+
+
+class Change(NamedTuple):
+    path: Path
+    # True when everything below path is affected too (rmdir or rename)
+    subtree: bool = False
+
+
+class DriftIndex:
+    """Managed directories of the resources seen in recent cycles, by path."""
+
+    def __init__(self, fs: FilesystemDriver):
+        self.fs = fs
+        self._lock = threading.Lock()
+        self._items: Dict[Path, str] = {}
+        self._paths: Dict[str, Path] = {}
+        self._resources: Dict[str, Resource] = {}
+        # Ancestors of managed paths, so removals elsewhere are ignored cheaply.
+        self._ancestors: Dict[Path, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def record(self, res: Resource) -> None:
+        """Remembers the latest desired state of a resource; removals are forgotten."""
+        path = res.mountPoint.get("default") if res.mountPoint else None
+        if res.status in ("removing", "removed") or not path:
+            self.forget(res.itemId)
+            return
+        full_path = self.fs.resolve(path)
+        with self._lock:
+            self._resources[res.itemId] = res
+            if self._paths.get(res.itemId) == full_path:
+                return
+            self._drop_path(res.itemId)
+            self._paths[res.itemId] = full_path
+            self._items[full_path] = res.itemId
+            for parent in full_path.parents:
+                self._ancestors[parent] = self._ancestors.get(parent, 0) + 1
+
+    def forget(self, item_id: str) -> None:
+        with self._lock:
+            self._resources.pop(item_id, None)
+            self._drop_path(item_id)
+
+    def _drop_path(self, item_id: str) -> None:
+        path = self._paths.pop(item_id, None)
+        if path is None:
+            return
+        if self._items.get(path) == item_id:
+            del self._items[path]
+        for parent in path.parents:
+            count = self._ancestors.get(parent, 0) - 1
+            if count > 0:
+                self._ancestors[parent] = count
+            else:
+                self._ancestors.pop(parent, None)
+
+    def paths(self) -> List[Tuple[Path, str]]:
+        with self._lock:
+            return list(self._items.items())
+
+    def items_for(self, change: Change) -> Set[str]:
+        """itemIds whose directory is change.path or, for subtree changes, below it."""
+        with self._lock:
+            found = set()
+            item_id = self._items.get(change.path)
+            if item_id:
+                found.add(item_id)
+            if change.subtree and change.path in self._ancestors:
+                found.update(i for p, i in self._items.items() if change.path in p.parents)
+            return found
+
+    def resources(self, item_ids: Iterable[str]) -> List[Resource]:
+        with self._lock:
+            return [self._resources[i] for i in item_ids if i in self._resources]
+
+
+class ChangeFeed(abc.ABC):
+    @abc.abstractmethod
+    def changes(self) -> List[Change]:
+        """Changes since the previous call."""
+
+
+class PollingFeed(ChangeFeed):
+    """Change feed for filesystems without a changelog: stats every managed path
+    on each poll and reports those whose owner, mode, inode or ctime changed."""
+
+    def __init__(self, index: DriftIndex):
+        self.index = index
+        self._last: Dict[Path, Optional[DirAttrs]] = {}
+
+    def changes(self) -> List[Change]:
+        changes = []
+        current: Dict[Path, Optional[DirAttrs]] = {}
+        for path, _ in self.index.paths():
+            try:
+                attrs: Optional[DirAttrs] = DirAttrs.from_stat(os.stat(path))
+            except FileNotFoundError:
+                attrs = None
+            current[path] = attrs
+            # Paths seen for the first time set the baseline.
+            if path in self._last and self._last[path] != attrs:
+                changes.append(Change(path))
+        self._last = current
+        return changes
+
+
+# <index> <type> <time> <date> <flags> key=value... with names after p=[] and sp=[]
+_RECORD = re.compile(r"^(\d+) (\d\d[A-Z]+) ")
+_FID_FIELD = re.compile(r"^(t|p|s|sp)=(\[[^\]]+\])$")
+
+
+class LustreChangelogFeed(ChangeFeed):
+    """Reads Lustre changelog records of the MDTs of a filesystem.
+
+    Needs a changelog user registered on each MDT (``lctl changelog_register``),
+    ideally with a mask limited to SATTR, RMDIR and RENME. Records are
+    acknowledged with ``lfs changelog_clear`` once turned into changes, so the
+    MDT can purge them and a restarted agent continues where it stopped.
+    """
+
+    # Record types that can change or remove a managed directory
+    TYPES = ("14SATTR", "07RMDIR", "08RENME")
+
+    def __init__(
+        self,
+        mount: Path,
+        mdts: List[str],
+        user: str,
+        max_records: int = 100_000,
+        run: Optional[Callable[[List[str]], str]] = None,
+    ):
+        self.mount = Path(mount)
+        self.mdts = mdts
+        self.user = user
+        self.max_records = max_records
+        self._run = run or self._run_lfs
+
+    @staticmethod
+    def _run_lfs(cmd: List[str]) -> str:
+        return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+
+    def changes(self) -> List[Change]:
+        changes: List[Change] = []
+        for mdt in self.mdts:
+            try:
+                changes.extend(self._read(mdt))
+            except (subprocess.CalledProcessError, OSError) as e:
+                logger.error(f"Reading changelog of {mdt} failed: {e}")
+        return changes
+
+    def _read(self, mdt: str) -> List[Change]:
+        output = self._run(["lfs", "changelog", mdt])
+        records = []
+        last = None
+        for line in output.splitlines():
+            match = _RECORD.match(line)
+            if not match:
+                continue
+            last = match.group(1)
+            if match.group(2) in self.TYPES:
+                records.append((match.group(2), line.split()[5:]))
+            if len(records) >= self.max_records:
+                break
+        if last is None:
+            return []
+
+        changes = self._to_changes(records)
+        self._run(["lfs", "changelog_clear", mdt, self.user, last])
+        return changes
+
+    def _to_changes(self, records: List[Tuple[str, List[str]]]) -> List[Change]:
+        paths: Dict[str, Optional[Path]] = {}
+
+        def resolve(fid: Optional[str], name: Optional[str] = None) -> Optional[Path]:
+            if not fid:
+                return None
+            if fid not in paths:
+                paths[fid] = self._fid2path(fid)
+            path = paths[fid]
+            if path is not None and name:
+                path = path / name
+            return path
+
+        changes = []
+        for kind, fields in records:
+            fids, names = self._parse_fields(fields)
+            if kind == "14SATTR":
+                path = resolve(fids.get("t"))
+                if path:
+                    changes.append(Change(path))
+                continue
+            # RMDIR: the removed directory has no FID path any more, its parent has.
+            # RENME: both the old (sp) and the new (p) location are affected.
+            for parent in ("sp", "p"):
+                if parent not in names:
+                    continue
+                path = resolve(fids.get(parent), names[parent])
+                if path:
+                    changes.append(Change(path, subtree=True))
+        return changes
+
+    @staticmethod
+    def _parse_fields(fields: List[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        fids: Dict[str, str] = {}
+        names: Dict[str, str] = {}
+        previous = None
+        for field in fields:
+            match = _FID_FIELD.match(field)
+            if match:
+                previous = match.group(1)
+                fids[previous] = match.group(2)
+            elif previous in ("p", "sp") and "=" not in field and previous not in names:
+                names[previous] = field
+        return fids, names
+
+    def _fid2path(self, fid: str) -> Optional[Path]:
+        try:
+            output = self._run(["lfs", "fid2path", str(self.mount), fid])
+        except (subprocess.CalledProcessError, OSError):
+            # Already removed again, or not a path we can see.
+            return None
+        line = output.splitlines()[0].strip() if output.strip() else ""
+        if not line:
+            return None
+        path = Path(line)
+        return path if path.is_absolute() else self.mount / path
+
+
+class DriftWatcher:
+    """Polls a change feed and reports the itemIds of changed managed directories."""
+
+    def __init__(
+        self,
+        feed: ChangeFeed,
+        index: DriftIndex,
+        on_drift: Callable[[Set[str]], None],
+        interval: float = 10.0,
+    ) -> None:
+        self.feed = feed
+        self.index = index
+        self.on_drift = on_drift
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def poll(self) -> Set[str]:
+        item_ids: Set[str] = set()
+        for change in self.feed.changes():
+            item_ids |= self.index.items_for(change)
+        if item_ids:
+            logger.info(f"Drift detected on {len(item_ids)} managed directories")
+            self.on_drift(item_ids)
+        return item_ids
+
+    def _loop(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Drift watcher error: {e}", exc_info=True)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="drift", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Does not wait: a poll in progress only reports to a stopping scheduler.
+        self._stopped.set()
+
+
+def build_drift_watcher(
+    config: Dict[str, Any],
+    fs: FilesystemDriver,
+    index: DriftIndex,
+    on_drift: Callable[[Set[str]], None],
+) -> Optional[DriftWatcher]:
+    """Creates the watcher selected by ``drift_feed`` ("changelog" or "poll")."""
+    kind = config.get("drift_feed")
+    if not kind:
+        return None
+    feed: ChangeFeed
+    if kind == "changelog":
+        feed = LustreChangelogFeed(
+            Path(config.get("drift_changelog_mount") or fs.root_path),
+            config.get("drift_changelog_mdts") or [],
+            config.get("drift_changelog_user", "cl1"),
+        )
+    elif kind == "poll":
+        feed = PollingFeed(index)
+    else:
+        raise ValueError(f"Unknown drift_feed: {kind}")
+    return DriftWatcher(feed, index, on_drift, interval=config.get("drift_poll_seconds", 10))
@@ -0,0 +1,171 @@
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, cast
+
+from .models import Resource
+from .workqueue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+class _Task:
+    __slots__ = ("resource", "path", "waiting", "children", "done")
+
+    def __init__(self, resource: Resource):
+        self.resource = resource
+        self.path = resource.mountPoint.get("default") or f"item:{resource.itemId}"
+        self.waiting = 0
+        self.children: List["_Task"] = []
+        self.done = False
+
+
+class OrderedExecutor:
+    """Runs a handler for many resources on a thread pool with ordering guarantees.
+
+    * Resources sharing a mount point run one after another, in arrival order.
+    * A resource whose parentItemId is part of the same batch runs after its parent.
+      Children seen before their parent are held back until the parent arrives or
+      the input is exhausted.
+
+    Resources whose turn has come wait in a WorkQueue, which hands them to the
+    workers by priority class and tenant. At most ``max_pending`` resources are
+    held in memory at once, so the input can be a lazily produced stream; it is also
+    how far ahead a lifecycle resource can overtake enforcement work. The itemIds
+    received are kept for the whole run (O(inventory) strings), since a child may
+    arrive long after its parent finished.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Resource], None],
+        workers: int,
+        max_pending: Optional[int] = None,
+        queue: Optional[WorkQueue] = None,
+    ):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending or self.workers * 4
+        # Used for a single run.
+        self.queue = queue
+
+    def run(self, resources: Iterable[Resource]) -> int:
+        cond = threading.Condition()
+        # Only unfinished tasks are indexed, bounded by max_pending.
+        last_by_path: Dict[str, _Task] = {}
+        by_item: Dict[str, _Task] = {}
+        # Every itemId received: a child of one of them need not wait for its parent.
+        seen: Set[str] = set()
+        orphans: Dict[str, List[_Task]] = {}
+        orphan_count = 0
+        outstanding = 0
+        # Tasks queued or running; the others wait on a dependency.
+        runnable = 0
+        count = 0
+
+        queue = self.queue if self.queue is not None else WorkQueue()
+
+        def execute(task: _Task) -> None:
+            nonlocal outstanding, runnable
+            try:
+                self.handler(task.resource)
+            except Exception as e:
+                logger.error(f"Unhandled error processing {task.resource.itemId}: {e}")
+            finally:
+                with cond:
+                    task.done = True
+                    if last_by_path.get(task.path) is task:
+                        del last_by_path[task.path]
+                    if by_item.get(task.resource.itemId) is task:
+                        del by_item[task.resource.itemId]
+                    for child in task.children:
+                        release(child)
+                    task.children = []
+                    outstanding -= 1
+                    runnable -= 1
+                    cond.notify_all()
+
+        def depend(task: _Task, dep: Optional[_Task]) -> None:
+            if dep is not None and not dep.done:
+                dep.children.append(task)
+                task.waiting += 1
+
+        def release(task: _Task) -> None:
+            # Called with cond held; the task runs once all dependencies are done.
+            nonlocal runnable
+            task.waiting -= 1
+            if task.waiting == 0:
+                runnable += 1
+                queue.put(task.resource, task)
+
+        def work() -> None:
+            # Tasks released after close() are still taken: the worker that
+            # released them is still running.
+            while True:
+                task = queue.get()
+                if task is None:
+                    return
+                execute(cast(_Task, task))
+
+        def release_orphans() -> None:
+            nonlocal orphan_count
+            for children in orphans.values():
+                for child in children:
+                    release(child)
+            orphans.clear()
+            orphan_count = 0
+
+        threads = [
+            threading.Thread(target=work, name=f"sync_{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for res in resources:
+                task = _Task(res)
+                # Hold the task until it is fully registered.
+                task.waiting = 1
+                with cond:
+                    while outstanding >= self.max_pending:
+                        if runnable == 0:
+                            # Everything pending waits, directly or behind another
+                            # task on its path, on parents not yet received.
+                            release_orphans()
+                        cond.wait()
+                    outstanding += 1
+                    count += 1
+
+                    depend(task, last_by_path.get(task.path))
+                    last_by_path[task.path] = task
+
+                    parent_id = res.parentItemId if res.parentItemId != res.itemId else None
+                    held_back = False
+                    if parent_id and parent_id not in seen:
+                        # Parent not received yet: keep the registration hold until
+                        # it arrives or the input is exhausted.
+                        orphans.setdefault(parent_id, []).append(task)
+                        orphan_count += 1
+                        held_back = True
+                    elif parent_id:
+                        depend(task, by_item.get(parent_id))
+
+                    seen.add(res.itemId)
+                    by_item[res.itemId] = task
+                    for child in orphans.pop(res.itemId, []):
+                        orphan_count -= 1
+                        depend(child, task)
+                        release(child)
+
+                    if not held_back:
+                        release(task)
+
+            with cond:
+                release_orphans()
+                while outstanding > 0:
+                    cond.wait()
+        finally:
+            queue.close()
+            for thread in threads:
+                thread.join()
+
+        return count
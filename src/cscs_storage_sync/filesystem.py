@@ -1,116 +1,276 @@
+import functools
 import logging
 import os
 import shutil
+import stat
 import subprocess
+import threading
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence, Set, Tuple
 
-from .models import QuotaItem
+from .models import Quota
+from .quota import GroupQuota, QuotaLimits, compute_quota_limits
+from .quota_backend import CliQuotaBackend, QuotaBackend
 
 logger = logging.getLogger(__name__)
 
+_RESOLVE_CACHE_SIZE = 500_000
+
+
+@functools.lru_cache(maxsize=64)
+def parse_mode(mode: str) -> int:
+    """Parses an octal permission string such as "775" or "2770"."""
+    return int(mode, 8)
+
+
+def mode_mask(mode: str) -> int:
+    """Bits a mode string specifies: setuid/setgid/sticky only when given, as in "2770"."""
+    return 0o7777 if len(mode) > 3 else 0o777
+
+
+class DirAttrs(NamedTuple):
+    uid: int
+    gid: int
+    mode: int  # permission bits, including setuid/setgid/sticky
+    ino: int
+    ctime_ns: int
+
+    @classmethod
+    def from_stat(cls, st: os.stat_result) -> "DirAttrs":
+        return cls(st.st_uid, st.st_gid, stat.S_IMODE(st.st_mode), st.st_ino, st.st_ctime_ns)
+
 
 class FilesystemDriver:
-    def __init__(self, root_path: str, dry_run: bool = False, debug_mode: bool = False):
+    def __init__(
+        self,
+        root_path: str,
+        dry_run: bool = False,
+        debug_mode: bool = False,
+        dir_scan_threshold: int = 16,
+        mount_prefix: Optional[str] = None,
+        quota_backend: Optional[QuotaBackend] = None,
+    ):
         self.root_path = Path(root_path)
+        # Leading mount point component that root_path already stands for, e.g.
+        # "capstor" when root_path is the capstor filesystem itself.
+        self.mount_prefix = mount_prefix.strip("/") if mount_prefix else None
         self.dry_run = dry_run
         self.debug_mode = debug_mode
+        # Lookups under one parent within a cycle before the parent is scanned (0 = never)
+        self.dir_scan_threshold = dir_scan_threshold
+        self.quota_backend = quota_backend or CliQuotaBackend()
 
-    def _run_cmd(self, cmd: List[str], check=True):
-        cmd_str = " ".join(cmd)
-        if self.dry_run:
-            logger.info(f"[DRY-RUN] Executing: {cmd_str}")
-            return
+        self._cache_lock = threading.Lock()
+        # path -> (attributes, generation of the scan that produced them, 0 for a stat)
+        self._dir_cache: Dict[Path, Tuple[DirAttrs, int]] = {}
+        self._generation = 0
+        self._scanning = False
+        self._parent_hits: Dict[Path, int] = {}
+        self._scanned: Set[Path] = set()
+        self._resolved: Dict[str, Path] = {}
+        self._mounts: Dict[str, Path] = {}
 
-        try:
-            logger.debug(f"Executing: {cmd_str}")
-            subprocess.run(cmd, check=check, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Command failed: {e.stderr}")
-            if check:
-                raise
+    def resolve(self, rel_path: str) -> Path:
+        # The same mount points come back every cycle; building Paths is not free.
+        full_path = self._resolved.get(rel_path)
+        if full_path is None:
+            if len(self._resolved) >= _RESOLVE_CACHE_SIZE:
+                self._resolved.clear()
+            full_path = self._resolved[rel_path] = self._resolve(rel_path)
+        return full_path
 
-    def ensure_directory(self, rel_path: str, gid: int, mode: str = "775"):
-        """Creates directory, sets ownership and permissions."""
+    def _resolve(self, rel_path: str) -> Path:
         # Remove leading slash to join correctly with root
-        clean_rel_path = rel_path.lstrip("/")
-        full_path = self.root_path / clean_rel_path
+        rel_path = rel_path.lstrip("/")
+        prefix = self.mount_prefix
+        if prefix and (rel_path == prefix or rel_path.startswith(prefix + "/")):
+            rel_path = rel_path[len(prefix) :].lstrip("/")
+        return self.root_path / rel_path
+
+    def filesystem_for(self, rel_path: str) -> Path:
+        """Returns the storage system directory (e.g. <root>/capstor) holding rel_path."""
+        if self.mount_prefix:
+            return self.root_path
+        first = rel_path.lstrip("/").split("/", 1)[0]
+        mount = self._mounts.get(first)
+        if mount is None:
+            mount = self._mounts[first] = self.root_path / first if first else self.root_path
+        return mount
+
+    # Single filesystem mutations, kept separate so they can be observed.
+
+    def _mkdir(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+
+    def _chown(self, path: Path, uid: int, gid: int) -> None:
+        os.chown(path, uid, gid)
+
+    def _chmod(self, path: Path, mode: int) -> None:
+        os.chmod(path, mode)
+
+    # Directory metadata cache. Every lookup is one os.stat (a round trip to the
+    # metadata server on Lustre); during a cycle, parents with many managed children
+    # are listed once with os.scandir and their subdirectories stat'ed in one pass.
+
+    def begin_cycle(self) -> None:
+        """Starts a cycle: directory scans made from now on are trusted until end_cycle."""
+        with self._cache_lock:
+            self._generation += 1
+            self._scanning = True
+            self._parent_hits.clear()
+            self._scanned.clear()
+
+    def end_cycle(self) -> None:
+        with self._cache_lock:
+            self._scanning = False
+            self._parent_hits.clear()
+            self._scanned.clear()
+
+    def _stat(self, path: Path) -> Optional[DirAttrs]:
+        try:
+            return DirAttrs.from_stat(os.stat(path))
+        except FileNotFoundError:
+            return None
+
+    def _scan(self, parent: Path) -> None:
+        """Caches the attributes of every subdirectory of parent."""
+        found = {}
+        try:
+            with os.scandir(parent) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        found[Path(entry.path)] = DirAttrs.from_stat(
+                            entry.stat(follow_symlinks=False)
+                        )
+        except OSError as e:
+            logger.debug(f"Could not scan {parent}: {e}")
+            return
+        with self._cache_lock:
+            for path, attrs in found.items():
+                self._dir_cache[path] = (attrs, self._generation)
+            self._scanned.add(parent)
+
+    def _lookup(self, path: Path) -> Optional[DirAttrs]:
+        """Returns the current attributes of path, or None if it does not exist."""
+        parent = path.parent
+        with self._cache_lock:
+            scan = False
+            if self._scanning and self.dir_scan_threshold:
+                hits = self._parent_hits.get(parent, 0) + 1
+                self._parent_hits[parent] = hits
+                scan = hits == self.dir_scan_threshold
+        if scan:
+            self._scan(parent)
+
+        with self._cache_lock:
+            cached = self._dir_cache.get(path)
+            if self._scanning and parent in self._scanned:
+                # Listed during this cycle: no entry means the directory is missing.
+                if cached is None:
+                    return None
+                if cached[1] == self._generation:
+                    return cached[0]
+
+        attrs = self._stat(path)
+        with self._cache_lock:
+            if attrs is None:
+                self._dir_cache.pop(path, None)
+            elif cached is None or cached[0] != attrs:
+                # A different inode or ctime means someone changed the directory.
+                self._dir_cache[path] = (attrs, 0)
+        return attrs
+
+    def invalidate(self, path: Path, tree: bool = False) -> None:
+        """Drops cached attributes of path, and of everything below it with tree."""
+        with self._cache_lock:
+            self._dir_cache.pop(path, None)
+            if tree:
+                for cached in [p for p in self._dir_cache if path in p.parents]:
+                    del self._dir_cache[cached]
+                self._scanned = {p for p in self._scanned if p != path and path not in p.parents}
+
+    def ensure_directory(self, rel_path: str, gid: int, mode: str = "775") -> None:
+        """Creates directory, sets ownership (root:gid) and permissions if they differ."""
+        full_path = self.resolve(rel_path)
+        mode_int = parse_mode(mode) if mode else None
+        mask = mode_mask(mode) if mode else 0o7777
+
+        attrs = self._lookup(full_path)
 
         # 1. Create Directory
-        if not full_path.exists():
+        if attrs is None:
             logger.info(f"Creating directory: {full_path}")
-            if not self.dry_run:
-                full_path.mkdir(parents=True, exist_ok=True)
+            if self.dry_run:
+                return
+            self._mkdir(full_path)
+            self.invalidate(full_path)
+            # A new directory gets the umask mode and the parent's group.
+            attrs = self._stat(full_path)
+            if attrs is None:
+                return
+
+        changed = False
 
         # 2. Set Ownership (root:gid)
         # 0 is root uid. gid comes from Waldur (or 0 for tenants)
-        current_stat = full_path.stat() if full_path.exists() else None
-
         if self.debug_mode:
             logger.debug(f"Debug mode: Skipping chown for {full_path}")
-        elif not self.dry_run and current_stat:
-            if current_stat.st_gid != gid:
-                logger.info(f"Chowning {full_path} to 0:{gid}")
-                os.chown(full_path, 0, gid)
-
-        # 3. Set Permissions
-        if mode:
-            mode_int = int(mode, 8)
-            if not self.dry_run and current_stat:
-                if (current_stat.st_mode & 0o777) != mode_int:
-                    logger.info(f"Chmoding {full_path} to {mode}")
-                    os.chmod(full_path, mode_int)
-
-    def set_lustre_quota(self, rel_path: str, gid: int, quotas: List[QuotaItem]):
+        elif attrs.uid != 0 or attrs.gid != gid:
+            logger.info(f"Chowning {full_path} to 0:{gid}")
+            if not self.dry_run:
+                self._chown(full_path, 0, gid)
+                changed = True
+
+        # 3. Set Permissions (including setgid/sticky bits, e.g. "2770")
+        if mode_int is not None and attrs.mode & mask != mode_int:
+            logger.info(f"Chmoding {full_path} to {mode}")
+            if not self.dry_run:
+                # A 3-digit mode keeps special bits, e.g. a setgid bit the parent passed on.
+                self._chmod(full_path, mode_int | (attrs.mode & ~mask))
+                changed = True
+
+        if changed:
+            self.invalidate(full_path)
+
+    def set_lustre_quota(self, rel_path: str, gid: int, quotas: Sequence[Quota]) -> None:
         """Applies quotas using lfs setquota."""
         if gid == 0:
             logger.warning("Skipping quota application for GID 0 (root).")
             return
 
-        block_soft = 0
-        block_hard = 0
-        inode_soft = 0
-        inode_hard = 0
-
-        for q in quotas:
-            val = float(q.quota)
-            if q.type == "space":
-                # Waldur sends TB, Lustre expects KB
-                kb_val = int(val * 1024 * 1024 * 1024)
-                if q.enforcementType == "soft":
-                    block_soft = kb_val
-                if q.enforcementType == "hard":
-                    block_hard = kb_val
-            elif q.type == "inodes":
-                if q.enforcementType == "soft":
-                    inode_soft = int(val)
-                if q.enforcementType == "hard":
-                    inode_hard = int(val)
-
-        full_path = self.root_path / rel_path.lstrip("/")
-
-        cmd = [
-            "lfs",
-            "setquota",
-            "-g",
-            str(gid),
-            "-b",
-            str(block_soft),
-            "-B",
-            str(block_hard),
-            "-i",
-            str(inode_soft),
-            "-I",
-            str(inode_hard),
-            str(full_path),
-        ]
-
+        full_path = self.resolve(rel_path)
         logger.info(f"Setting quota for GID {gid} on {full_path}")
-        self._run_cmd(cmd, check=False)
+        self.apply_quota_limits(full_path, gid, compute_quota_limits(quotas), check=False)
+
+    def apply_quota_limits(
+        self, full_path: Path, gid: int, limits: QuotaLimits, check: bool = False
+    ) -> None:
+        if self.dry_run:
+            logger.info(f"[DRY-RUN] Setting quota for GID {gid} on {full_path}: {limits}")
+            return
+        try:
+            self.quota_backend.set_group_limits(full_path, gid, limits)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Setting quota for GID {gid} on {full_path} failed: {e}")
+            if check:
+                raise
+
+    def read_group_quotas(
+        self, mount: Path, gids: Optional[Iterable[int]] = None
+    ) -> Dict[int, GroupQuota]:
+        """Reads limits and usage of the groups on a filesystem, at least of gids.
+
+        Returns an empty dict when the read fails.
+        """
+        try:
+            return self.quota_backend.read_group_quotas(mount, gids)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning(f"Bulk quota read failed for {mount}, assuming all differ: {e}")
+            return {}
 
-    def archive_directory(self, rel_path: str, archive_root: str):
+    def archive_directory(self, rel_path: str, archive_root: str) -> None:
         """Moves a directory to the archive location."""
-        full_path = self.root_path / rel_path.lstrip("/")
+        full_path = self.resolve(rel_path)
         if not full_path.exists():
             logger.warning(f"Directory {full_path} not found, skipping archive.")
             return
@@ -123,3 +283,4 @@ class FilesystemDriver:
         if not self.dry_run:
             Path(archive_root).mkdir(parents=True, exist_ok=True)
             shutil.move(str(full_path), str(archive_dest))
+            self.invalidate(full_path, tree=True)
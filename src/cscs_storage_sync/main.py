@@ -1,64 +1,187 @@
+import argparse
 import logging
 import os
+import signal
+import threading
 import time
+from pathlib import Path
+from types import FrameType
+from typing import Any, Dict, List, Optional
 
 import yaml
 
-from .api_client import StorageProxyClient
-from .filesystem import FilesystemDriver
-from .processors import ResourceProcessor
+from .metrics import MetricsServer, SyncMetrics
+from .pipeline import PipelineGroup, build_pipelines
+from .profiling import CYCLE_KINDS, CycleProfiler
+from .scheduler import TriggerServer
+from .sharding import ShardMembership
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger("CSCS-Sync")
 
+# Settings bound to sockets, credentials or on-disk locations at startup.
+RESTART_KEYS = (
+    "proxy_url",
+    "api_token",
+    "waldur_api_token",
+    "state_dir",
+    "trigger_socket",
+    "trigger_port",
+    "trigger_token",
+    "metrics_port",
+    "metrics_textfile",
+    "sharding",
+    "callback_async",
+    "callback_spool_dir",
+    "callback_max_in_flight",
+    "archive_jobs",
+    "drift_feed",
+    "profile_dir",
+)
+
 
-def load_config(path="config.yaml"):
+def load_config(path: str = "config.yaml") -> Dict[str, Any]:
     if not os.path.exists(path):
         raise FileNotFoundError(f"Config file not found: {path}")
     with open(path) as f:
-        return yaml.safe_load(f)
-
-
-def run_sync_loop():
-    config = load_config()
-
-    # Initialize components
-    client = StorageProxyClient(
-        base_url=config["proxy_url"],
-        proxy_token=config["api_token"],
-        waldur_token=config["waldur_api_token"],
+        config: Dict[str, Any] = yaml.safe_load(f)
+    return config
+
+
+def profile_dir(config: Dict[str, Any]) -> str:
+    """Where profiled cycles are written: ``profile_dir``, else <state_dir>/profiles."""
+    if config.get("profile_dir"):
+        return str(config["profile_dir"])
+    if config.get("state_dir"):
+        return os.path.join(config["state_dir"], "profiles")
+    return "/tmp/cscs-sync-profiles"
+
+
+def reload_config(
+    pipelines: PipelineGroup, current: Dict[str, Any], path: str = "config.yaml"
+) -> Dict[str, Any]:
+    """Re-reads the config on SIGHUP and applies it to the running pipelines.
+
+    Returns the config now in effect; on errors the current one is kept.
+    """
+    try:
+        config = load_config(path)
+    except (OSError, yaml.YAMLError) as e:
+        logger.error(f"Config reload failed, keeping the current config: {e}")
+        return current
+
+    for key in RESTART_KEYS:
+        if config.get(key) != current.get(key):
+            logger.warning(f"Changing {key} requires a restart, ignoring the new value")
+            if key in current:
+                config[key] = current[key]
+            else:
+                config.pop(key, None)
+    pipelines.reload(config)
+    logger.info("Configuration reloaded")
+    return config
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CSCS storage sync agent")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument(
+        "--profile-cycle",
+        nargs="?",
+        const="full",
+        choices=CYCLE_KINDS,
+        help="Profile the first cycle of this kind (default: full), see profile_dir",
     )
-    fs = FilesystemDriver(
-        config["storage_root"],
-        dry_run=config.get("dry_run", False),
-        debug_mode=config.get("debug_mode", False),
-    )
-    processor = ResourceProcessor(fs, client, config)
-
-    interval = config.get("sync_interval_seconds", 60)
+    return parser.parse_args(argv)
+
+
+def run_sync_loop(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    config = load_config(args.config)
+
+    shard = None
+    sharding = config.get("sharding") or {}
+    if sharding.get("lease_dir"):
+        shard = ShardMembership(
+            sharding["lease_dir"],
+            node=sharding.get("node"),
+            lease_seconds=sharding.get("lease_seconds", 120),
+        )
+
+    metrics = None
+    metrics_server = None
+    if config.get("metrics_port") or config.get("metrics_textfile"):
+        metrics = SyncMetrics()
+        if config.get("metrics_textfile"):
+            metrics.textfile = Path(config["metrics_textfile"])
+        if config.get("metrics_port"):
+            metrics_server = MetricsServer(metrics, config["metrics_port"])
+
+    # Costs nothing until a cycle is requested with --profile-cycle or SIGUSR1.
+    profiler = CycleProfiler(profile_dir(config))
+    if args.profile_cycle:
+        profiler.request(args.profile_cycle)
+
+    # One pipeline per storage system in system_mappings
+    pipelines = build_pipelines(config, shard=shard, metrics=metrics, profiler=profiler)
+
+    trigger = None
+    if config.get("trigger_socket") or config.get("trigger_port"):
+        trigger = TriggerServer(
+            pipelines,
+            port=config.get("trigger_port"),
+            socket_path=config.get("trigger_socket"),
+            token=config.get("trigger_token"),
+        )
 
     logger.info("Starting CSCS Storage Sync Agent")
     logger.info(f"Dry Run: {config.get('dry_run', False)}")
     logger.info(f"Debug Mode: {config.get('debug_mode', False)}")
 
-    while True:
-        try:
-            logger.info("Polling proxy...")
-            resources = client.fetch_all_resources()
-            logger.info(f"Fetched {len(resources)} resources.")
-
-            for res in resources:
-                processor.process(res)
-
-        except KeyboardInterrupt:
-            logger.info("Stopping...")
-            break
-        except Exception as e:
-            logger.error(f"Sync loop error: {e}", exc_info=True)
-
-        time.sleep(interval)
+    if shard:
+        shard.start()
+    if trigger:
+        trigger.start()
+    if metrics_server:
+        metrics_server.start()
+    # SIGHUP reloads the config, SIGUSR1 profiles the next full cycle,
+    # SIGTERM/SIGINT drain running cycles and stop.
+    reload_requested = threading.Event()
+    stop_requested = threading.Event()
+
+    def request_stop(signum: int, frame: Optional[FrameType]) -> None:
+        logger.info(f"Received {signal.Signals(signum).name}, draining and stopping...")
+        stop_requested.set()
+        pipelines.stop()
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.request("full"))
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    pipelines.start()
+    drain_deadline = None
+    try:
+        while not pipelines.wait(timeout=1.0):
+            if reload_requested.is_set() and not stop_requested.is_set():
+                reload_requested.clear()
+                config = reload_config(pipelines, config, args.config)
+            if stop_requested.is_set():
+                if drain_deadline is None:
+                    drain_deadline = time.monotonic() + config.get("shutdown_timeout_seconds", 300)
+                elif time.monotonic() >= drain_deadline:
+                    logger.warning("Shutdown timeout reached, stopping with work in flight")
+                    break
+    finally:
+        if trigger:
+            trigger.close()
+        if metrics_server:
+            metrics_server.close()
+        pipelines.close()
+        if shard:
+            shard.stop()
 
 
 if __name__ == "__main__":
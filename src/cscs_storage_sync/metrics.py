@@ -0,0 +1,365 @@
+import abc
+import functools
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        """Exposition lines of the metric's series."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts, strict=True):
+                cumulative += c
+                le = f'le="{_format_value(bound)}"'
+                labels = _format_labels(self.label_names, key, le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class SyncMetrics:
+    """Metrics of the sync agent, plus hooks that wrap its components.
+
+    The hooks replace methods on the given instances with timed/counted wrappers
+    that call the original and re-raise its exceptions unchanged.
+    """
+
+    def __init__(self) -> None:
+        self.cycle_duration = Histogram(
+            "cscs_sync_cycle_duration_seconds", "Wall time of sync cycles.", ["system", "kind"]
+        )
+        self.phase_duration = Histogram(
+            "cscs_sync_cycle_phase_seconds",
+            "Time spent per phase within a cycle (summed over workers).",
+            ["system", "phase"],
+        )
+        self.resources = Counter(
+            "cscs_sync_resources_total", "Resources processed, by status.", ["status"]
+        )
+        self.actions = Counter(
+            "cscs_sync_actions_total", "Filesystem and Waldur actions performed.", ["action"]
+        )
+        self.errors = Counter(
+            "cscs_sync_errors_total", "Errors by exception type and phase.", ["type", "phase"]
+        )
+        self.callback_latency = Histogram(
+            "cscs_sync_callback_seconds", "Latency of Waldur callback POSTs."
+        )
+        self.queue_wait = Histogram(
+            "cscs_sync_queue_wait_seconds",
+            "Time resources waited in the work queue, by priority class.",
+            ["priority"],
+        )
+        self.queue_deadline_misses = Counter(
+            "cscs_sync_queue_deadline_misses_total",
+            "Resources that waited longer than the deadline of their priority class.",
+            ["priority"],
+        )
+        self.last_cycle = Gauge(
+            "cscs_sync_last_cycle_timestamp_seconds",
+            "End time of the last cycle.",
+            ["system", "kind"],
+        )
+        self._metrics: List[_Metric] = [
+            self.cycle_duration,
+            self.phase_duration,
+            self.resources,
+            self.actions,
+            self.errors,
+            self.callback_latency,
+            self.queue_wait,
+            self.queue_deadline_misses,
+            self.last_cycle,
+        ]
+        self._phase_lock = threading.Lock()
+        # Per storage system: pipelines run their cycles concurrently.
+        self._phase_totals: Dict[str, Dict[str, float]] = {}
+        self.textfile: Optional[Path] = None
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: Optional[Path] = None) -> None:
+        """Writes the metrics for node_exporter's textfile collector, atomically."""
+        path = path or self.textfile
+        if not path:
+            return
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(self.render())
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(f"Failed to write metrics to {path}: {e}")
+
+    # -- Hooks -------------------------------------------------------------------
+
+    def _add_phase(self, system: str, phase: str, seconds: float) -> None:
+        with self._phase_lock:
+            totals = self._phase_totals.setdefault(system, {})
+            totals[phase] = totals.get(phase, 0.0) + seconds
+
+    def _wrap(
+        self,
+        obj: object,
+        name: str,
+        phase: Optional[str] = None,
+        action: Optional[str] = None,
+        on_success: Optional[Callable[[float], None]] = None,
+        error_phase: Optional[str] = None,
+        system: str = "",
+    ) -> None:
+        original = getattr(obj, name)
+        error_phase = error_phase or phase or action or name
+
+        @functools.wraps(original)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                result = original(*args, **kwargs)
+            except Exception as e:
+                self.errors.inc(type=type(e).__name__, phase=error_phase)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                if phase:
+                    self._add_phase(system, phase, elapsed)
+            if action:
+                self.actions.inc(action=action)
+            if on_success:
+                on_success(elapsed)
+            return result
+
+        setattr(obj, name, wrapper)
+
+    def instrument_client(self, client: Any, system: str = "") -> None:
+        self._wrap(client, "_get_page", phase="fetch", system=system)
+        self._wrap(client, "_parse_page", phase="parse", system=system)
+        self._wrap(
+            client,
+            "_post_callback",
+            phase="callback",
+            action="callback",
+            on_success=self.callback_latency.observe,
+            system=system,
+        )
+
+    def instrument_fs(self, fs: Any, system: str = "") -> None:
+        self._wrap(fs, "ensure_directory", phase="ensure_directory", system=system)
+        self._wrap(fs, "_mkdir", action="mkdir")
+        self._wrap(fs, "_chown", action="chown")
+        self._wrap(fs, "_chmod", action="chmod")
+        self._wrap(fs, "apply_quota_limits", phase="setquota", action="setquota", system=system)
+        self._wrap(fs, "read_group_quotas", phase="quota_read", action="quota_read", system=system)
+        self._wrap(fs, "archive_directory", phase="archive", action="archive", system=system)
+
+    def instrument_archive(self, engine: Any, system: str = "") -> None:
+        self._wrap(engine, "archive", phase="archive", system=system)
+        self._wrap(engine, "_copy_file", action="archive_copy")
+
+    def instrument_processor(self, processor: Any) -> None:
+        original = processor.process
+
+        @functools.wraps(original)
+        def process(resource: Any, *args: Any, **kwargs: Any) -> Any:
+            self.resources.inc(status=resource.status)
+            return original(resource, *args, **kwargs)
+
+        processor.process = process
+
+        original_dequeued = processor._dequeued
+
+        @functools.wraps(original_dequeued)
+        def dequeued(priority: str, waited: float, late: bool) -> None:
+            self.queue_wait.observe(waited, priority=priority)
+            if late:
+                self.queue_deadline_misses.inc(priority=priority)
+            original_dequeued(priority, waited, late)
+
+        processor._dequeued = dequeued
+        # process() swallows handler errors, so count them at the handlers.
+        for status in ("pending", "active", "removing", "updating"):
+            self._wrap(processor, f"_handle_{status}", error_phase=f"process_{status}")
+
+    def instrument_scheduler(self, scheduler: Any, system: str = "") -> None:
+        for kind in ("full", "lifecycle", "targeted", "drift"):
+            self._wrap_cycle(scheduler, f"run_{kind}_cycle", kind, system)
+
+    def _wrap_cycle(self, scheduler: Any, name: str, kind: str, system: str) -> None:
+        original = getattr(scheduler, name)
+
+        @functools.wraps(original)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with self._phase_lock:
+                self._phase_totals[system] = {}
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            except Exception as e:
+                self.errors.inc(type=type(e).__name__, phase=f"{kind}_cycle")
+                raise
+            finally:
+                self.cycle_duration.observe(time.perf_counter() - started, system=system, kind=kind)
+                with self._phase_lock:
+                    totals = self._phase_totals.pop(system, {})
+                for phase, seconds in totals.items():
+                    self.phase_duration.observe(seconds, system=system, phase=phase)
+                self.last_cycle.set(time.time(), system=system, kind=kind)
+                self.write_textfile()
+
+        setattr(scheduler, name, wrapper)
+
+
+class MetricsServer:
+    """Serves /metrics in the Prometheus text format on a local port."""
+
+    def __init__(self, metrics: SyncMetrics, port: int, host: str = "127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.address = f"http://{host}:{self.server.server_port}/metrics"
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="metrics", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+        logger.info(f"Serving metrics on {self.address}")
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
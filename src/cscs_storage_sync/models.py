@@ -1,6 +1,7 @@
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 from pydantic import BaseModel, Field
+from pydantic_core import from_json
 
 
 class QuotaItem(BaseModel):
@@ -79,3 +80,153 @@ class PaginatedResponse(BaseModel):
     # matches "resources": [...]
     resources: List[StorageResource] = Field(default_factory=list)
     pagination: Optional[PaginationInfo] = None
+
+
+# Statuses that trigger provisioning and callbacks; these are always fully validated.
+ACTIONABLE_STATUSES = frozenset({"pending", "updating", "removing"})
+
+
+def _str(value: Any) -> str:
+    if not isinstance(value, str):
+        raise TypeError(f"expected str, got {type(value).__name__}")
+    return value
+
+
+def _opt_int(value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise TypeError(f"expected int, got {type(value).__name__}")
+    return value
+
+
+def _number(value: Any) -> float:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise TypeError(f"expected number, got {type(value).__name__}")
+    return float(value)
+
+
+class SlimTargetItem:
+    __slots__ = ("itemId", "name", "key", "unixGid", "unixUid")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.itemId = _str(raw["itemId"])
+        self.name = _str(raw["name"])
+        key = raw.get("key")
+        self.key = _str(key) if key is not None else None
+        self.unixGid = _opt_int(raw.get("unixGid"))
+        self.unixUid = _opt_int(raw.get("unixUid"))
+
+
+class SlimTarget:
+    __slots__ = ("targetType", "targetItem")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.targetType = _str(raw["targetType"])
+        self.targetItem = SlimTargetItem(raw["targetItem"])
+
+
+class SlimPermission:
+    __slots__ = ("permissionType", "value")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.permissionType = _str(raw["permissionType"])
+        self.value = _str(raw["value"])
+
+
+class SlimQuota:
+    __slots__ = ("type", "quota", "unit", "enforcementType")
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.type = _str(raw["type"])
+        self.quota = _number(raw["quota"])
+        self.unit = _str(raw["unit"])
+        self.enforcementType = _str(raw["enforcementType"])
+
+
+class ResourceRecord:
+    """Slim view of a resource in a non-actionable state (e.g. 'active').
+
+    Holds only the fields periodic enforcement reads, as plain slotted objects with
+    the same attribute names as the pydantic models. Any other attribute triggers a
+    full StorageResource validation of the raw payload, once.
+    """
+
+    __slots__ = (
+        "itemId",
+        "status",
+        "mountPoint",
+        "parentItemId",
+        "target",
+        "permission",
+        "quotas",
+        "_raw",
+        "_full",
+    )
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.itemId = _str(raw["itemId"])
+        self.status = _str(raw["status"])
+        mount_point = raw["mountPoint"]
+        if not isinstance(mount_point, dict) or not all(
+            isinstance(v, str) for v in mount_point.values()
+        ):
+            raise TypeError("mountPoint must map to strings")
+        self.mountPoint: Dict[str, str] = mount_point
+        parent = raw.get("parentItemId")
+        self.parentItemId = _str(parent) if parent is not None else None
+        self.target = SlimTarget(raw["target"])
+        permission = raw.get("permission")
+        self.permission = SlimPermission(permission) if permission is not None else None
+        quotas = raw.get("quotas")
+        self.quotas = [SlimQuota(q) for q in quotas] if quotas is not None else None
+        self._raw = raw
+        self._full: Optional[StorageResource] = None
+
+    def to_model(self) -> StorageResource:
+        full = self._full
+        if full is None:
+            full = self._full = StorageResource.model_validate(self._raw)
+        return full
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached for attributes outside the slots, e.g. storageSystem or URLs.
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.to_model(), name)
+
+    def __repr__(self) -> str:
+        return f"ResourceRecord(itemId={self.itemId!r}, status={self.status!r})"
+
+
+Resource = Union[StorageResource, ResourceRecord]
+Quota = Union[QuotaItem, SlimQuota]
+
+
+def parse_resource(raw: Dict[str, Any]) -> Resource:
+    if raw.get("status") in ACTIONABLE_STATUSES:
+        return StorageResource.model_validate(raw)
+    try:
+        return ResourceRecord(raw)
+    except (KeyError, TypeError, AttributeError):
+        # Anything the strict fast path rejects goes through pydantic, which either
+        # coerces it or reports a proper validation error.
+        return StorageResource.model_validate(raw)
+
+
+def resource_to_raw(res: Resource) -> Dict[str, Any]:
+    """Returns the proxy payload of a resource, as accepted by parse_resource."""
+    if isinstance(res, ResourceRecord):
+        return res._raw
+    return res.model_dump(mode="json", exclude_none=True)
+
+
+def parse_page(content: Union[bytes, str]) -> PaginatedResponse:
+    """Fast path for proxy pages: full validation only for actionable resources."""
+    data = from_json(content)
+    pagination = data.get("pagination")
+    return PaginatedResponse.model_construct(
+        status=data["status"],
+        resources=[parse_resource(raw) for raw in data.get("resources") or []],
+        pagination=PaginationInfo.model_validate(pagination) if pagination else None,
+    )
@@ -0,0 +1,357 @@
+"""Detection of directories on disk that no resource manages any more.
+
+Directories left behind by a failed removal, and old entries of the archive,
+slow down every listing on the metadata server. The ManagedPathIndex holds the
+mountPoint of every resource of a storage system (all shards); the
+OrphanScanner lists, in parallel, only the directories leading to managed paths
+and reports the unmanaged directories next to them, plus archive entries older
+than a retention window. It spends at most ``orphan_scan_ops_per_second``
+metadata operations, so it never competes with the sync for the MDS.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterable, List, Optional, Set, Tuple
+
+from .archive import ArchiveEngine
+from .filesystem import FilesystemDriver
+from .models import Resource
+from .throttle import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ORPHAN_ACTIONS = ("report", "archive")
+# ArchiveEngine job ids of orphans start with this; resources use their itemId.
+ORPHAN_JOB_PREFIX = "orphan-"
+
+
+def orphan_job_id(path: Path) -> str:
+    """Archive job id of an unmanaged directory, the same for every scan that finds it."""
+    return ORPHAN_JOB_PREFIX + hashlib.sha1(str(path).encode()).hexdigest()[:16]
+
+
+class ManagedPathIndex:
+    """Managed directories of all resources, rebuilt from every complete full walk."""
+
+    def __init__(self, fs: FilesystemDriver):
+        self.fs = fs
+        self._lock = threading.Lock()
+        self._paths: Set[Path] = set()
+        self._pending: Optional[Set[Path]] = None
+        # False until the index was built from a complete inventory.
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def _path(self, res: Resource) -> Optional[Path]:
+        path = res.mountPoint.get("default") if res.mountPoint else None
+        if not path or res.status == "removed":
+            return None
+        return self.fs.resolve(path)
+
+    def add(self, res: Resource) -> None:
+        path = self._path(res)
+        if path is None:
+            return
+        with self._lock:
+            self._paths.add(path)
+            if self._pending is not None:
+                self._pending.add(path)
+
+    def begin_rebuild(self) -> None:
+        with self._lock:
+            self._pending = set()
+
+    def finish_rebuild(self, complete: bool) -> None:
+        """Replaces the index with the paths added since begin_rebuild, if complete."""
+        with self._lock:
+            if complete and self._pending is not None:
+                self._paths = self._pending
+                self.ready = True
+            self._pending = None
+
+    def replace(self, resources: Iterable[Resource]) -> None:
+        paths = {p for p in (self._path(res) for res in resources) if p is not None}
+        with self._lock:
+            self._paths = paths
+            self._pending = None
+            self.ready = True
+
+    def paths(self) -> Set[Path]:
+        with self._lock:
+            return set(self._paths)
+
+
+@dataclass
+class OrphanReport:
+    started: float
+    directories_listed: int = 0
+    orphans: List[Path] = field(default_factory=list)
+    expired_archives: List[Path] = field(default_factory=list)
+    archived: List[Path] = field(default_factory=list)
+    # Orphans still being copied to the archive in the background.
+    archiving: List[Path] = field(default_factory=list)
+    purged: List[Path] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "started": self.started,
+            "directories_listed": self.directories_listed,
+            "orphans": [str(p) for p in self.orphans],
+            "expired_archives": [str(p) for p in self.expired_archives],
+            "archived": [str(p) for p in self.archived],
+            "archiving": [str(p) for p in self.archiving],
+            "purged": [str(p) for p in self.purged],
+        }
+
+
+class OrphanScanner:
+    """Periodically looks for unmanaged directories and expired archive entries.
+
+    Only directories that lead to managed paths are listed, level by level with
+    ``orphan_scan_workers`` threads; an unmanaged directory is reported when it sits
+    next to managed ones (in a directory that directly holds a managed path) and
+    was not changed for ``orphan_min_age_seconds``, so directories being
+    provisioned right now are left alone. Nothing below a managed directory is
+    looked at unless other managed paths lie below it (tenants and customers hold
+    their projects). With ``orphan_action: archive`` orphans are moved to the archive by
+    the ArchiveEngine, like removed resources, and with ``orphan_purge_archives``
+    expired archive entries are deleted, at most ``orphan_max_actions`` of each per
+    scan.
+    """
+
+    def __init__(
+        self,
+        fs: FilesystemDriver,
+        index: ManagedPathIndex,
+        config: Dict[str, Any],
+        archive_engine: Optional[ArchiveEngine] = None,
+        report_path: Optional[str] = None,
+        claim: Optional[Callable[[], ContextManager[bool]]] = None,
+    ) -> None:
+        self.fs = fs
+        self.index = index
+        self.archive_engine = archive_engine
+        self.report_path = Path(report_path) if report_path else None
+        # With several agents sharing a storage system, only one of them scans it:
+        # each scan runs within claim(), and only if it yields True.
+        self.claim = claim
+        self.budget = TokenBucket(0)
+        self.configure(config)
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        action = config.get("orphan_action", "report")
+        if action not in ORPHAN_ACTIONS:
+            raise ValueError(f"Unknown orphan_action: {action}")
+        self.action = action
+        self.interval = config.get("orphan_scan_interval_seconds", 0)
+        self.workers = max(1, config.get("orphan_scan_workers", 4))
+        self.budget.rate = config.get("orphan_scan_ops_per_second", 200)
+        self.min_age = config.get("orphan_min_age_seconds", 86400)
+        self.retention = config.get("orphan_archive_retention_days", 0) * 86400
+        self.purge_archives = config.get("orphan_purge_archives", False)
+        self.max_actions = config.get("orphan_max_actions", 100)
+        self.archive_root = Path(config.get("archive_dir", "/tmp/archive"))
+        self.exclude = {self.fs.resolve(p) for p in config.get("orphan_scan_exclude") or []}
+
+    # -- Scanning ----------------------------------------------------------------
+
+    def scan(self) -> Optional[OrphanReport]:
+        """Runs one scan; returns None when there is no complete index to compare with."""
+        managed = self.index.paths()
+        if not self.index.ready or not managed:
+            logger.info("Orphan scan skipped: no complete inventory yet")
+            return None
+
+        root = self.fs.root_path
+        ancestors: Set[Path] = set()
+        parents: Set[Path] = set()
+        for path in managed:
+            if root not in path.parents:
+                continue
+            parents.add(path.parent)
+            for parent in path.parents:
+                ancestors.add(parent)
+                if parent == root:
+                    break
+
+        report = OrphanReport(started=time.time())
+        cutoff = report.started - self.min_age
+        skip = self.exclude | {self.archive_root}
+
+        def visit(directory: Path) -> Tuple[List[Path], List[Path]]:
+            # Subdirectories to list next, and orphans found in directory.
+            descend: List[Path] = []
+            orphans: List[Path] = []
+            self.budget.spend()
+            try:
+                with os.scandir(directory) as it:
+                    entries = [e for e in it if e.is_dir(follow_symlinks=False)]
+            except OSError as e:
+                logger.warning(f"Orphan scan cannot list {directory}: {e}")
+                return descend, orphans
+            # Large directories take one readdir round trip per ~1000 entries.
+            self.budget.spend(len(entries) // 1000)
+            for entry in entries:
+                path = Path(entry.path)
+                if path in skip:
+                    continue
+                if path in ancestors:
+                    # Also when managed itself, e.g. a tenant holding its customers.
+                    descend.append(path)
+                elif path in managed:
+                    continue
+                elif directory in parents:
+                    self.budget.spend()
+                    try:
+                        changed = entry.stat(follow_symlinks=False).st_ctime
+                    except OSError:
+                        continue
+                    if changed < cutoff:
+                        orphans.append(path)
+            return descend, orphans
+
+        frontier = [root] if root in ancestors else []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="orphans") as pool:
+            while frontier and not self._stopped.is_set():
+                next_frontier: List[Path] = []
+                for descend, orphans in pool.map(visit, frontier):
+                    next_frontier.extend(descend)
+                    report.orphans.extend(orphans)
+                report.directories_listed += len(frontier)
+                frontier = next_frontier
+        report.orphans.sort()
+        report.expired_archives = self._expired_archives(report.started)
+
+        for path in report.orphans:
+            logger.warning(f"Unmanaged directory: {path}")
+        for path in report.expired_archives:
+            logger.info(f"Archive entry past retention: {path}")
+        logger.info(
+            f"Orphan scan listed {report.directories_listed} directories: "
+            f"{len(report.orphans)} unmanaged, {len(report.expired_archives)} expired archives"
+        )
+
+        if self.action == "archive":
+            self._archive_orphans(report)
+        if self.purge_archives:
+            self._purge_archives(report)
+        self._write_report(report)
+        return report
+
+    def _expired_archives(self, now: float) -> List[Path]:
+        if not self.retention:
+            return []
+        expired = []
+        self.budget.spend()
+        try:
+            with os.scandir(self.archive_root) as it:
+                entries = [e for e in it if "_archived_" in e.name]
+        except FileNotFoundError:
+            return []
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            # ArchiveEngine names entries <name>_archived_<itemId>; skip running jobs.
+            item_id = entry.name.rsplit("_archived_", 1)[1]
+            if self.archive_engine is not None and self.archive_engine.in_progress(item_id):
+                continue
+            self.budget.spend()
+            try:
+                # ctime changes when the entry is renamed into the archive.
+                if entry.stat(follow_symlinks=False).st_ctime < now - self.retention:
+                    expired.append(Path(entry.path))
+            except OSError:
+                continue
+        return sorted(expired)
+
+    # -- Actions -----------------------------------------------------------------
+
+    def _archive_orphans(self, report: OrphanReport) -> None:
+        engine = self.archive_engine
+        if engine is None:
+            logger.error("Cannot archive unmanaged directories without an archive engine")
+            return
+        # Copies started by earlier scans, or before a restart: collects finished ones.
+        jobs = engine.journaled(ORPHAN_JOB_PREFIX)
+        for job_id, path in jobs.items():
+            self._archive(report, engine, path, job_id)
+
+        managed = self.index.paths()
+        for path in report.orphans[: self.max_actions]:
+            if path in managed:
+                # Provisioned since the scan started.
+                continue
+            job_id = orphan_job_id(path)
+            if job_id in jobs:
+                continue
+            self._archive(report, engine, path, job_id)
+
+    def _archive(
+        self, report: OrphanReport, engine: ArchiveEngine, path: Path, job_id: str
+    ) -> None:
+        rel_path = "/" + str(path.relative_to(self.fs.root_path))
+        if self.fs.resolve(rel_path) != path:
+            logger.warning(f"Cannot archive {path}: it does not resolve back to itself")
+            return
+        try:
+            done = engine.archive(rel_path, job_id)
+        except OSError as e:
+            # A failed background copy is raised once; the next scan retries it.
+            logger.error(f"Archiving unmanaged directory {path} failed: {e}")
+            return
+        (report.archived if done else report.archiving).append(path)
+
+    def _purge_archives(self, report: OrphanReport) -> None:
+        for path in report.expired_archives[: self.max_actions]:
+            logger.info(f"Purging expired archive entry {path}")
+            if self.fs.dry_run:
+                continue
+            try:
+                shutil.rmtree(path)
+            except OSError as e:
+                logger.error(f"Purging {path} failed: {e}")
+                continue
+            report.purged.append(path)
+
+    def _write_report(self, report: OrphanReport) -> None:
+        if self.report_path is None:
+            return
+        tmp = self.report_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(report.to_dict()))
+        os.replace(tmp, self.report_path)
+
+    # -- Background loop ---------------------------------------------------------
+
+    def _loop(self) -> None:
+        # A reload may set the interval to 0, which pauses scanning.
+        while not self._stopped.wait(self.interval or 60):
+            if not self.interval:
+                continue
+            with self.claim() if self.claim is not None else nullcontext(True) as allowed:
+                if not allowed:
+                    continue
+                try:
+                    self.scan()
+                except Exception as e:
+                    logger.error(f"Orphan scan error: {e}", exc_info=True)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="orphans", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Does not wait: a running scan stops after the level it is listing.
+        self._stopped.set()
@@ -0,0 +1,444 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .api_client import build_client
+from .archive import ArchiveEngine
+from .drift import DriftIndex, build_drift_watcher
+from .filesystem import FilesystemDriver
+from .metrics import SyncMetrics
+from .models import Resource
+from .orphans import ORPHAN_JOB_PREFIX, ManagedPathIndex, OrphanScanner
+from .processors import ResourceProcessor
+from .profiling import CycleProfiler
+from .quota import QuotaEngine
+from .quota_backend import build_quota_backend
+from .scheduler import SyncScheduler
+from .sharding import ShardMembership
+from .state import StateStore
+from .usage import UsageCollector
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "warm_start.json"
+SNAPSHOT_VERSION = 1
+
+
+def system_config(config: Dict[str, Any], system: str) -> Dict[str, Any]:
+    """Returns the config of one storage system: global keys overridden by
+    ``storage_systems.<system>``, with its own state_dir below the global one."""
+    overrides = (config.get("storage_systems") or {}).get(system) or {}
+    merged = {**config, **overrides}
+    if config.get("state_dir") and "state_dir" not in overrides:
+        merged["state_dir"] = os.path.join(config["state_dir"], system)
+    return merged
+
+
+def storage_root_for(config: Dict[str, Any], storage_system: Optional[str] = None) -> str:
+    """Filesystem root of a storage system: <storage_root>/<system_mappings entry>."""
+    root: str = config["storage_root"]
+    if storage_system:
+        local_dir = (config.get("system_mappings") or {}).get(storage_system)
+        root = os.path.join(root, local_dir or storage_system)
+    return root
+
+
+class SyncPipeline:
+    """Client, filesystem driver, processor and scheduler of one storage system.
+
+    Without a storage system the pipeline handles the whole inventory under
+    ``storage_root`` (the single-pipeline setup). With one, only that system's
+    resources are fetched and paths resolve under ``storage_root/<system_mappings entry>``.
+    """
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        storage_system: Optional[str] = None,
+        shard: Optional[ShardMembership] = None,
+        metrics: Optional[SyncMetrics] = None,
+        profiler: Optional[CycleProfiler] = None,
+    ):
+        self.name = storage_system or "default"
+        self.storage_system = storage_system
+        self.shard = shard
+        self.config = config
+        self.client = build_client(config)
+        if config.get("callback_async", True):
+            spool_dir = config.get("callback_spool_dir")
+            if not spool_dir and config.get("state_dir"):
+                spool_dir = os.path.join(config["state_dir"], "callbacks")
+            self.client.start_dispatcher(
+                spool_dir=spool_dir,
+                max_in_flight=config.get("callback_max_in_flight", 4),
+                max_attempts=config.get("callback_max_attempts", 20),
+            )
+
+        self.fs = FilesystemDriver(
+            storage_root_for(config, storage_system),
+            dry_run=config.get("dry_run", False),
+            debug_mode=config.get("debug_mode", False),
+            dir_scan_threshold=config.get("dir_scan_threshold", 16),
+            mount_prefix=storage_system,
+            quota_backend=build_quota_backend(config.get("quota_backend", "cli")),
+        )
+        self.state = StateStore(config["state_dir"]) if config.get("state_dir") else None
+        self.quota_engine = (
+            QuotaEngine(
+                self.fs,
+                max_workers=config.get("quota_workers", 8),
+                conflict_policy=config.get("quota_conflict_policy", "max"),
+            )
+            if config.get("quota_batching", False)
+            else None
+        )
+        archive_journal_dir = config.get("archive_journal_dir")
+        if not archive_journal_dir and config.get("state_dir"):
+            archive_journal_dir = os.path.join(config["state_dir"], "archive")
+        self.archive_engine = ArchiveEngine(
+            self.fs,
+            config.get("archive_dir", "/tmp/archive"),
+            journal_dir=archive_journal_dir,
+            max_jobs=config.get("archive_jobs", 2),
+            copy_workers=config.get("archive_copy_workers", 8),
+        )
+        self.usage_collector = (
+            UsageCollector(self.fs, self.client, config) if config.get("usage_report_url") else None
+        )
+        self.processor = ResourceProcessor(
+            self.fs,
+            self.client,
+            config,
+            state=self.state,
+            quota_engine=self.quota_engine,
+            archive_engine=self.archive_engine,
+            usage_collector=self.usage_collector,
+        )
+        # Maps out-of-band changes of managed directories back to their resources.
+        self.drift_index = DriftIndex(self.fs) if config.get("drift_feed") else None
+        # Paths of all resources, to tell unmanaged directories from managed ones.
+        self.path_index = (
+            ManagedPathIndex(self.fs) if config.get("orphan_scan_interval_seconds") else None
+        )
+        self.scheduler = SyncScheduler(
+            self.client,
+            self.processor,
+            config,
+            storage_system=storage_system,
+            shard=shard,
+            drift_index=self.drift_index,
+            path_index=self.path_index,
+        )
+        self.drift_watcher = (
+            build_drift_watcher(config, self.fs, self.drift_index, self.scheduler.reenforce)
+            if self.drift_index is not None
+            else None
+        )
+        self.orphan_scanner = (
+            OrphanScanner(
+                self.fs,
+                self.path_index,
+                config,
+                archive_engine=self.archive_engine,
+                report_path=(
+                    os.path.join(config["state_dir"], "orphans.json")
+                    if config.get("state_dir")
+                    else None
+                ),
+                claim=self._orphan_claim if shard else None,
+            )
+            if self.path_index is not None
+            else None
+        )
+        self.archive_engine.on_complete = self._archived
+
+        if metrics:
+            metrics.instrument_client(self.client, self.name)
+            metrics.instrument_fs(self.fs, self.name)
+            metrics.instrument_processor(self.processor)
+            metrics.instrument_archive(self.archive_engine, self.name)
+            metrics.instrument_scheduler(self.scheduler, self.name)
+        if profiler:
+            profiler.instrument(self)
+
+        self._thread: Optional[threading.Thread] = None
+
+    def _archived(self, item_id: str) -> None:
+        # Report removals as soon as their background archive completes; archived
+        # orphans are collected by the next orphan scan.
+        if not item_id.startswith(ORPHAN_JOB_PREFIX):
+            self.scheduler.trigger([item_id])
+
+    @contextmanager
+    def _orphan_claim(self) -> Iterator[bool]:
+        # One agent per storage system walks its tree, holding its shard meanwhile.
+        if self.shard is None:
+            yield True
+            return
+        key = f"orphans:{self.name}"
+        with self.shard.claim(key) as claim:
+            yield claim.holds(key)
+
+    def reconfigure(self, config: Dict[str, Any]) -> None:
+        """Applies reloadable settings in place; connections and caches are kept."""
+        self.config = config
+        self.processor.configure(config)
+        self.scheduler.configure(config)
+        self.fs.dir_scan_threshold = config.get("dir_scan_threshold", 16)
+        self.fs.debug_mode = config.get("debug_mode", False)
+        self.client.max_parallel_pages = max(1, config.get("max_parallel_pages", 4))
+        if self.client.dispatcher:
+            self.client.dispatcher.max_attempts = max(1, config.get("callback_max_attempts", 20))
+        self.archive_engine.copy_workers = max(1, config.get("archive_copy_workers", 8))
+        if self.drift_watcher:
+            self.drift_watcher.interval = config.get("drift_poll_seconds", 10)
+        if self.orphan_scanner:
+            self.orphan_scanner.configure(config)
+        if self.usage_collector:
+            self.usage_collector.configure(config)
+        if self.quota_engine:
+            self.quota_engine.max_workers = max(1, config.get("quota_workers", 8))
+            self.quota_engine.conflict_policy = config.get("quota_conflict_policy", "max")
+        # Recompute the next cycle with the new intervals.
+        self.scheduler.wake()
+        logger.info(f"Reloaded configuration of pipeline {self.name}")
+
+    # -- Warm restart ------------------------------------------------------------
+
+    @property
+    def snapshot_path(self) -> Optional[Path]:
+        if not self.config.get("state_dir") or not self.config.get("warm_start", True):
+            return None
+        return Path(self.config["state_dir"]) / SNAPSHOT_FILE
+
+    def save_snapshot(self) -> None:
+        """Saves in-memory caches so the next start does not begin cold.
+
+        Fingerprints are in the state store already; this adds the cached inventory
+        and polling validators, and the quota engine's contributions and applied
+        limits, which would otherwise force a full reconciliation after a restart.
+        """
+        path = self.snapshot_path
+        if path is None:
+            return
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "storage_root": str(self.fs.root_path),
+            "client": self.client.snapshot(),
+            "quota": self.quota_engine.snapshot() if self.quota_engine else None,
+        }
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, path)
+        logger.info(f"Saved warm start snapshot of {self.name} to {path}")
+
+    def load_snapshot(self) -> bool:
+        """Restores a snapshot written at the last clean shutdown. It is removed once
+        read: after a crash the next start is cold rather than based on old data."""
+        path = self.snapshot_path
+        if path is None or not path.exists():
+            return False
+        try:
+            data = json.loads(path.read_text())
+        except ValueError as e:
+            logger.warning(f"Ignoring corrupt warm start snapshot {path}: {e}")
+            data = {}
+        finally:
+            path.unlink(missing_ok=True)
+
+        age = time.time() - data.get("saved_at", 0)
+        if data.get("version") != SNAPSHOT_VERSION:
+            return False
+        if age > self.config.get("warm_start_max_age_seconds", 86400):
+            logger.info(f"Warm start snapshot of {self.name} is {age:.0f}s old, starting cold")
+            return False
+        if data.get("storage_root") != str(self.fs.root_path):
+            logger.info(f"Storage root of {self.name} changed, starting cold")
+            return False
+
+        self.client.restore(data.get("client") or {})
+        if self.drift_index is not None:
+            # An unchanged inventory skips the first cycle; watch what was cached.
+            resources: Iterable[Resource] = self.client.cached_inventory()
+            if self.shard:
+                resources = self.shard.filter(resources, self.fs.filesystem_for)
+            for res in resources:
+                self.drift_index.record(res)
+        if self.path_index is not None and self.client.inventory:
+            self.path_index.replace(self.client.cached_inventory())
+        if self.quota_engine and data.get("quota"):
+            self.quota_engine.restore(data["quota"])
+        logger.info(f"Warm start of {self.name} from a {age:.0f}s old snapshot")
+        return True
+
+    def start(self) -> None:
+        self.load_snapshot()
+        self.archive_engine.resume()
+        self._thread = threading.Thread(
+            target=self.scheduler.run, name=f"sync-{self.name}", daemon=True
+        )
+        self._thread.start()
+        if self.drift_watcher:
+            self.drift_watcher.start()
+        if self.orphan_scanner:
+            self.orphan_scanner.start()
+        if self.usage_collector:
+            self.usage_collector.start()
+        logger.info(f"Started sync pipeline for {self.name} (root: {self.fs.root_path})")
+
+    def stop(self) -> None:
+        if self.drift_watcher:
+            self.drift_watcher.stop()
+        if self.orphan_scanner:
+            self.orphan_scanner.stop()
+        if self.usage_collector:
+            self.usage_collector.stop()
+        self.scheduler.stop()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Waits for the scheduler thread. Returns False if it is still running."""
+        if self._thread:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def close(self) -> None:
+        # Only a scheduler that stopped between cycles leaves consistent caches.
+        if self._thread and not self._thread.is_alive():
+            try:
+                self.save_snapshot()
+            except OSError as e:
+                logger.warning(f"Could not save warm start snapshot of {self.name}: {e}")
+        self.archive_engine.close()
+        self.client.close()
+        if self.state:
+            self.state.close()
+
+
+def pipeline_configs(config: Dict[str, Any]) -> Dict[str, Tuple[Optional[str], Dict[str, Any]]]:
+    """Pipeline name -> (storage system, config) for every pipeline config asks for."""
+    mappings = config.get("system_mappings") or {}
+    if not mappings:
+        return {"default": (None, config)}
+    return {system: (system, system_config(config, system)) for system in mappings}
+
+
+class PipelineGroup:
+    """Runs pipelines side by side; triggers are fanned out to all of them."""
+
+    def __init__(
+        self,
+        pipelines: Iterable[SyncPipeline],
+        shard: Optional[ShardMembership] = None,
+        metrics: Optional[SyncMetrics] = None,
+        profiler: Optional[CycleProfiler] = None,
+    ):
+        self.pipelines: List[SyncPipeline] = list(pipelines)
+        self.shard = shard
+        self.metrics = metrics
+        self.profiler = profiler
+        self._started = False
+
+    def trigger(self, item_ids: Iterable[str] = ()) -> None:
+        # Pipelines that do not have an itemId just log it as not found.
+        item_ids = list(item_ids)
+        for pipeline in self.pipelines:
+            pipeline.scheduler.trigger(item_ids)
+
+    def start(self) -> None:
+        self._started = True
+        for pipeline in self.pipelines:
+            pipeline.start()
+
+    def stop(self) -> None:
+        for pipeline in self.pipelines:
+            pipeline.stop()
+
+    def wait(self, poll: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """Blocks until every pipeline has stopped or timeout passed; True if all stopped."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not all(pipeline.join(poll) for pipeline in self.pipelines):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        return True
+
+    def reload(self, config: Dict[str, Any]) -> None:
+        """Reconfigures running pipelines in place; pipelines of added, removed or
+        re-rooted storage systems are started, stopped or replaced.
+
+        Retired pipelines are stopped, joined and closed before their replacements
+        start: both would share the state_dir (state store, callback spool and
+        archive journals).
+        """
+        wanted = pipeline_configs(config)
+        current = {pipeline.name: pipeline for pipeline in self.pipelines}
+        retired = [
+            pipeline
+            for name, pipeline in current.items()
+            if name not in wanted
+            or str(pipeline.fs.root_path) != storage_root_for(wanted[name][1], wanted[name][0])
+        ]
+        if retired:
+            # Swapped in one assignment: triggers may iterate the list concurrently.
+            self.pipelines = [p for p in self.pipelines if p not in retired]
+        for pipeline in retired:
+            logger.info(f"Removing pipeline for {pipeline.name}")
+            pipeline.stop()
+        for pipeline in retired:
+            pipeline.join()
+            pipeline.close()
+            del current[pipeline.name]
+
+        pipelines = []
+        for name, (system, system_cfg) in wanted.items():
+            existing = current.get(name)
+            if existing:
+                existing.reconfigure(system_cfg)
+                pipeline = existing
+            else:
+                logger.info(f"Adding pipeline for {name}")
+                pipeline = SyncPipeline(
+                    system_cfg,
+                    storage_system=system,
+                    shard=self.shard,
+                    metrics=self.metrics,
+                    profiler=self.profiler,
+                )
+                if self._started:
+                    pipeline.start()
+            pipelines.append(pipeline)
+        self.pipelines = pipelines
+
+    def close(self) -> None:
+        for pipeline in self.pipelines:
+            pipeline.close()
+
+
+def build_pipelines(
+    config: Dict[str, Any],
+    shard: Optional[ShardMembership] = None,
+    metrics: Optional[SyncMetrics] = None,
+    profiler: Optional[CycleProfiler] = None,
+) -> PipelineGroup:
+    """One pipeline per ``system_mappings`` entry, or a single one without mappings."""
+    return PipelineGroup(
+        (
+            SyncPipeline(
+                system_cfg,
+                storage_system=system,
+                shard=shard,
+                metrics=metrics,
+                profiler=profiler,
+            )
+            for system, system_cfg in pipeline_configs(config).values()
+        ),
+        shard=shard,
+        metrics=metrics,
+        profiler=profiler,
+    )
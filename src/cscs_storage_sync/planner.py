@@ -0,0 +1,452 @@
+"""Offline planner: computes what a sync cycle would do, without disks or network.
+
+The real ResourceProcessor runs against a saved proxy snapshot, with a filesystem
+and a Waldur client that only record actions. Directory attributes and group
+quotas come from a filesystem snapshot, so the plan is the diff a live cycle would
+apply. Snapshots are captured on a management node with the capture commands:
+
+    cscs-sync-plan capture-proxy --output proxy.json
+    cscs-sync-plan capture-fs --proxy proxy.json --output fs.json
+    cscs-sync-plan plan --proxy proxy.json --fs fs.json --output plan.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from pydantic_core import from_json
+
+from .api_client import build_client
+from .filesystem import DirAttrs, FilesystemDriver, parse_mode
+from .models import PaginatedResponse, Resource, parse_resource
+from .pipeline import storage_root_for, system_config
+from .processors import ResourceProcessor
+from .quota import GroupQuota, QuotaEngine, QuotaLimits
+from .state import StateStore
+
+logger = logging.getLogger(__name__)
+
+# Rough seconds per action on a busy Lustre MDS, overridable with --costs.
+DEFAULT_COSTS = {
+    "stat": 0.0005,
+    "mkdir": 0.002,
+    "chown": 0.001,
+    "chmod": 0.001,
+    "setquota": 0.05,
+    "quota_read": 1.0,
+    "archive_rename": 0.005,
+    "archive_copy": 600.0,
+    "callback": 0.05,
+}
+
+# Mode of a directory right after mkdir, before chown/chmod (umask 022, owned by root).
+_NEW_DIR = (0, 0, 0o755)
+
+
+class Plan:
+    """Actions recorded while planning, attributed to the resource being processed."""
+
+    def __init__(self, record_actions: bool = True):
+        self.record_actions = record_actions
+        self.actions: List[Dict[str, Any]] = []
+        self.counts: Counter[str] = Counter()
+        self.statuses: Counter[str] = Counter()
+        self.item_id: Optional[str] = None
+
+    def add(self, action: str, path: Optional[Path] = None, **detail: Any) -> None:
+        self.counts[action] += 1
+        if not self.record_actions:
+            return
+        entry: Dict[str, Any] = {"action": action, "item_id": self.item_id}
+        if path is not None:
+            entry["path"] = str(path)
+        entry.update(detail)
+        self.actions.append(entry)
+
+    def count(self, action: str) -> None:
+        # Lookups are only counted, they change nothing.
+        self.counts[action] += 1
+
+    def to_dict(self, costs: Dict[str, float]) -> Dict[str, Any]:
+        by_action = {a: round(n * costs.get(a, 0.0), 3) for a, n in sorted(self.counts.items())}
+        plan: Dict[str, Any] = {
+            "resources": sum(self.statuses.values()),
+            "by_status": dict(sorted(self.statuses.items())),
+            "counts": dict(sorted(self.counts.items())),
+            "estimated_seconds": {"total": round(sum(by_action.values()), 3), **by_action},
+        }
+        if self.record_actions:
+            plan["actions"] = self.actions
+        return plan
+
+
+class FilesystemSnapshot:
+    """Directory attributes and group quotas as captured by ``capture-fs``."""
+
+    def __init__(
+        self,
+        directories: Dict[str, Tuple[int, int, int, int]],
+        quotas: Dict[str, Dict[int, QuotaLimits]],
+        archive_dev: Optional[int] = None,
+    ):
+        # path -> (uid, gid, mode, st_dev)
+        self.directories = directories
+        self.quotas = quotas
+        self.archive_dev = archive_dev
+
+    @classmethod
+    def load(cls, path: str) -> "FilesystemSnapshot":
+        data = from_json(Path(path).read_bytes())
+        directories = {
+            p: (uid, gid, parse_mode(mode), dev)
+            for p, (uid, gid, mode, dev) in data["directories"].items()
+        }
+        quotas = {
+            mount: {int(gid): QuotaLimits(*limits) for gid, limits in groups.items()}
+            for mount, groups in data.get("quotas", {}).items()
+        }
+        return cls(directories, quotas, data.get("archive_dev"))
+
+    @classmethod
+    def empty(cls) -> "FilesystemSnapshot":
+        return cls({}, {})
+
+    def dump(self) -> Dict[str, Any]:
+        return {
+            "directories": {
+                p: [uid, gid, format(mode, "o"), dev]
+                for p, (uid, gid, mode, dev) in self.directories.items()
+            },
+            "quotas": {
+                mount: {str(gid): list(asdict(limits).values()) for gid, limits in groups.items()}
+                for mount, groups in self.quotas.items()
+            },
+            "archive_dev": self.archive_dev,
+        }
+
+
+class PlanningFilesystem(FilesystemDriver):
+    """FilesystemDriver whose reads come from a snapshot and whose writes are recorded."""
+
+    def __init__(
+        self, root_path: str, plan: Plan, snapshot: FilesystemSnapshot, **kwargs: Any
+    ) -> None:
+        super().__init__(root_path, dry_run=False, dir_scan_threshold=0, **kwargs)
+        self.plan = plan
+        self.snapshot = snapshot
+
+    def _stat(self, path: Path) -> Optional[DirAttrs]:
+        self.plan.count("stat")
+        entry = self.snapshot.directories.get(str(path))
+        if entry is None:
+            return None
+        uid, gid, mode, dev = entry
+        return DirAttrs(uid, gid, mode, 0, 0)
+
+    # The snapshot is the cache: no scans, no invalidation.
+
+    def _lookup(self, path: Path) -> Optional[DirAttrs]:
+        return self._stat(path)
+
+    def invalidate(self, path: Path, tree: bool = False) -> None:
+        pass
+
+    def _update(
+        self,
+        path: Path,
+        uid: Optional[int] = None,
+        gid: Optional[int] = None,
+        mode: Optional[int] = None,
+    ) -> None:
+        old_uid, old_gid, old_mode, dev = self.snapshot.directories[str(path)]
+        self.snapshot.directories[str(path)] = (
+            old_uid if uid is None else uid,
+            old_gid if gid is None else gid,
+            old_mode if mode is None else mode,
+            dev,
+        )
+
+    def _mkdir(self, path: Path) -> None:
+        self.plan.add("mkdir", path)
+        parent = self.snapshot.directories.get(str(path.parent))
+        self.snapshot.directories[str(path)] = (*_NEW_DIR, parent[3] if parent else 0)
+
+    def _chown(self, path: Path, uid: int, gid: int) -> None:
+        self.plan.add("chown", path, uid=uid, gid=gid)
+        self._update(path, uid=uid, gid=gid)
+
+    def _chmod(self, path: Path, mode: int) -> None:
+        self.plan.add("chmod", path, mode=format(mode, "o"))
+        self._update(path, mode=mode)
+
+    def apply_quota_limits(
+        self, full_path: Path, gid: int, limits: QuotaLimits, check: bool = False
+    ) -> None:
+        self.plan.add("setquota", full_path, gid=gid, limits=dict(vars(limits)))
+
+    def read_group_quotas(
+        self, mount: Path, gids: Optional[Iterable[int]] = None
+    ) -> Dict[int, GroupQuota]:
+        self.plan.count("quota_read")
+        groups = self.snapshot.quotas.get(str(mount), {})
+        return {gid: GroupQuota(limits) for gid, limits in groups.items()}
+
+    def archive_directory(self, rel_path: str, archive_root: str) -> None:
+        full_path = self.resolve(rel_path)
+        if str(full_path) in self.snapshot.directories:
+            self.plan.add("archive_rename", full_path)
+
+
+class PlanningArchive:
+    """Stands in for ArchiveEngine: records a rename or a background copy."""
+
+    def __init__(self, fs: PlanningFilesystem):
+        self.fs = fs
+
+    def in_progress(self, item_id: str) -> bool:
+        return False
+
+    def archive(self, rel_path: str, item_id: str) -> bool:
+        full_path = self.fs.resolve(rel_path)
+        entry = self.fs.snapshot.directories.get(str(full_path))
+        if entry is not None:
+            same_device = self.fs.snapshot.archive_dev in (None, entry[3])
+            self.fs.plan.add("archive_rename" if same_device else "archive_copy", full_path)
+        return True
+
+
+class PlanningClient:
+    """Records Waldur callbacks instead of sending them."""
+
+    def __init__(self, plan: Plan):
+        self.plan = plan
+
+    @contextmanager
+    def callback_scope(self, key: str) -> Iterator[None]:
+        self.plan.item_id = key
+        try:
+            yield
+        finally:
+            self.plan.item_id = None
+
+    def send_callback(self, url: str, data: Optional[Dict[str, Any]] = None) -> None:
+        self.plan.add("callback", url=url, data=data)
+
+
+# -- Snapshots -------------------------------------------------------------------
+
+
+def load_proxy_snapshot(path: str) -> Iterator[Resource]:
+    """Yields the resources of a saved page, a list of pages, or a directory of pages."""
+    source = Path(path)
+    files = sorted(source.glob("*.json")) if source.is_dir() else [source]
+    seen = set()
+    for file in files:
+        data = from_json(file.read_bytes())
+        pages = data if isinstance(data, list) else [data]
+        for page in pages:
+            for raw in page.get("resources") or []:
+                if raw.get("itemId") in seen:
+                    continue
+                seen.add(raw.get("itemId"))
+                yield parse_resource(raw)
+
+
+def capture_proxy(config: Dict[str, Any], output: str, storage_system: Optional[str] = None) -> int:
+    """Saves the raw proxy pages of the current inventory."""
+    client = build_client(config)
+    pages: List[Dict[str, Any]] = []
+    parse_page = client._parse_page
+
+    def recording_parse(content: bytes) -> PaginatedResponse:
+        pages.append(from_json(content))
+        return parse_page(content)
+
+    client._parse_page = recording_parse  # type: ignore[method-assign]
+    try:
+        count = sum(1 for _ in client.iter_resources(storage_system))
+    finally:
+        client.close()
+    pages.sort(key=lambda p: (p.get("pagination") or {}).get("current", 0))
+    Path(output).write_text(json.dumps(pages))
+    return count
+
+
+def capture_fs(
+    fs: FilesystemDriver, resources: Iterator[Resource], archive_dir: str
+) -> FilesystemSnapshot:
+    """Stats every resource directory and reads group quotas of their filesystems."""
+    directories: Dict[str, Tuple[int, int, int, int]] = {}
+    mounts: Dict[Path, Set[int]] = {}
+    for res in resources:
+        rel_path = (res.mountPoint or {}).get("default")
+        if not rel_path:
+            continue
+        full_path = fs.resolve(rel_path)
+        gids = mounts.setdefault(fs.filesystem_for(rel_path), set())
+        gid = res.target.targetItem.unixGid if res.target else None
+        if gid:
+            gids.add(gid)
+        # Parents too, so the planner knows the device and group of new directories
+        for path in (full_path, full_path.parent):
+            if str(path) in directories:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            directories[str(path)] = (st.st_uid, st.st_gid, st.st_mode & 0o7777, st.st_dev)
+
+    quotas: Dict[str, Dict[int, QuotaLimits]] = {}
+    for mount in sorted(mounts):
+        groups = fs.read_group_quotas(mount, sorted(mounts[mount]))
+        quotas[str(mount)] = {gid: group.limits for gid, group in groups.items()}
+
+    try:
+        archive_dev = os.stat(archive_dir).st_dev
+    except FileNotFoundError:
+        archive_dev = None
+    return FilesystemSnapshot(directories, quotas, archive_dev)
+
+
+# -- Planning --------------------------------------------------------------------
+
+
+def build_planning_fs(
+    config: Dict[str, Any], plan: Plan, snapshot: FilesystemSnapshot, storage_system: Optional[str]
+) -> PlanningFilesystem:
+    return PlanningFilesystem(
+        storage_root_for(config, storage_system),
+        plan,
+        snapshot,
+        debug_mode=config.get("debug_mode", False),
+        mount_prefix=storage_system,
+    )
+
+
+def plan_cycle(
+    config: Dict[str, Any],
+    resources: Iterator[Resource],
+    snapshot: FilesystemSnapshot,
+    storage_system: Optional[str] = None,
+    state_dir: Optional[str] = None,
+    record_actions: bool = True,
+) -> Plan:
+    """Runs one full cycle of the real processor against the snapshots."""
+    plan = Plan(record_actions)
+    fs = build_planning_fs(config, plan, snapshot, storage_system)
+    # Planning is sequential, so actions are attributed to the right resource.
+    planning_config = {**config, "workers": 1}
+
+    with tempfile.TemporaryDirectory(prefix="cscs-plan-") as tmp:
+        state = None
+        if state_dir:
+            # Work on a copy, the planner must not record anything in the real store.
+            db = Path(state_dir) / "state.db"
+            if db.exists():
+                source = sqlite3.connect(str(db))
+                target = sqlite3.connect(os.path.join(tmp, "state.db"))
+                source.backup(target)
+                source.close()
+                target.close()
+            state = StateStore(tmp)
+
+        processor = ResourceProcessor(
+            fs,
+            PlanningClient(plan),  # type: ignore[arg-type]
+            planning_config,
+            state=state,
+            quota_engine=QuotaEngine(
+                fs, max_workers=1, conflict_policy=config.get("quota_conflict_policy", "max")
+            ),
+            archive_engine=PlanningArchive(fs),  # type: ignore[arg-type]
+        )
+
+        def counted(stream: Iterable[Resource]) -> Iterator[Resource]:
+            for res in stream:
+                plan.statuses[res.status] += 1
+                yield res
+
+        processor.begin_cycle()
+        processor.process_all(counted(resources))
+        processor.end_cycle()
+        if state:
+            state.close()
+    return plan
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--system", help="Storage system key (uses its system_mappings root)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("capture-proxy", help="Save the proxy inventory pages")
+    p.add_argument("--output", required=True)
+
+    p = sub.add_parser("capture-fs", help="Save directory attributes and group quotas")
+    p.add_argument("--proxy", required=True, help="Proxy snapshot listing the directories")
+    p.add_argument("--output", required=True)
+
+    p = sub.add_parser("plan", help="Compute the action plan of one full cycle")
+    p.add_argument("--proxy", required=True)
+    p.add_argument("--fs", help="Filesystem snapshot (default: nothing exists yet)")
+    p.add_argument("--state-dir", help="Plan incrementally against this state store")
+    p.add_argument("--costs", help="JSON file of seconds per action")
+    p.add_argument("--summary", action="store_true", help="Omit the list of actions")
+    p.add_argument("--output", help="Write the plan here instead of stdout")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s - %(message)s")
+
+    # Imported late: main configures INFO logging on import.
+    from .main import load_config
+
+    config = load_config(args.config)
+    if args.system:
+        config = system_config(config, args.system)
+
+    if args.command == "capture-proxy":
+        count = capture_proxy(config, args.output, args.system)
+        print(f"Captured {count} resources to {args.output}", file=sys.stderr)
+    elif args.command == "capture-fs":
+        fs = FilesystemDriver(storage_root_for(config, args.system), mount_prefix=args.system)
+        archive_dir = config.get("archive_dir", "/tmp/archive")
+        snapshot = capture_fs(fs, load_proxy_snapshot(args.proxy), archive_dir)
+        Path(args.output).write_text(json.dumps(snapshot.dump()))
+        print(f"Captured {len(snapshot.directories)} directories to {args.output}", file=sys.stderr)
+    else:
+        costs = dict(DEFAULT_COSTS)
+        if args.costs:
+            costs.update(json.loads(Path(args.costs).read_text()))
+        snapshot = FilesystemSnapshot.load(args.fs) if args.fs else FilesystemSnapshot.empty()
+        started = time.perf_counter()
+        plan = plan_cycle(
+            config,
+            load_proxy_snapshot(args.proxy),
+            snapshot,
+            args.system,
+            args.state_dir,
+            record_actions=not args.summary,
+        )
+        result = plan.to_dict(costs)
+        result["planning_seconds"] = round(time.perf_counter() - started, 3)
+        text = json.dumps(result, indent=2)
+        if args.output:
+            Path(args.output).write_text(text + "\n")
+        else:
+            print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,158 @@
 import logging
+import time
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
 
 from .api_client import StorageProxyClient
+from .archive import ArchiveEngine
+from .executor import OrderedExecutor
 from .filesystem import FilesystemDriver
-from .models import QuotaItem, StorageResource
+from .models import Quota, Resource
+from .quota import QuotaEngine
+from .state import StateStore, resource_fingerprint
+from .usage import UsageCollector
+from .workqueue import WorkQueue
 
 logger = logging.getLogger(__name__)
 
 
 class ResourceProcessor:
-    def __init__(self, fs: FilesystemDriver, client: StorageProxyClient, config: dict):
+    def __init__(
+        self,
+        fs: FilesystemDriver,
+        client: StorageProxyClient,
+        config: Dict[str, Any],
+        state: Optional[StateStore] = None,
+        quota_engine: Optional[QuotaEngine] = None,
+        archive_engine: Optional[ArchiveEngine] = None,
+        usage_collector: Optional[UsageCollector] = None,
+    ):
         self.fs = fs
         self.client = client
+        self.state = state
+        self.quota_engine = quota_engine
+        self.archive_engine = archive_engine
+        self.usage_collector = usage_collector
+        self.configure(config)
+        # Without a state store every cycle is a full reconciliation.
+        self.full_reconcile = True
+        # Start of the full reconciliation in progress, recorded once it completes.
+        self._full_started_at: Optional[float] = None
+        # Whether the cycle in progress walks the whole inventory.
+        self._full_cycle = False
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        """Applies the reloadable settings; they take effect from the next resource."""
         self.min_gid = config.get("min_gid_allowed", 1000)
         self.archive_dir = config.get("archive_dir", "/tmp/archive")
+        self.full_reconcile_interval = config.get("full_reconcile_interval_seconds", 3600)
+        self.workers = config.get("workers", 1)
+        self.queue_window = config.get("queue_window", 500)
+        self.queue_deadlines = config.get("queue_deadlines") or {}
 
-    def process(self, resource: StorageResource):
-        try:
-            if resource.status == "pending":
-                self._handle_pending(resource)
-            elif resource.status == "active":
-                self._handle_active(resource)
-            elif resource.status == "removing":
-                self._handle_removing(resource)
-            elif resource.status == "updating":
-                self._handle_updating(resource)
-            elif resource.status == "removed":
-                # Already handled, just log
-                pass
-        except Exception as e:
-            logger.error(f"Error processing {resource.itemId}: {e}")
-            if resource.set_state_erred_url:
-                self.client.send_callback(resource.set_state_erred_url)
-
-    def _get_gid_and_mode(self, res: StorageResource):
+    def begin_cycle(self, full: bool = True) -> None:
+        """Starts a cycle. A full cycle walks the inventory and decides whether it
+        re-enforces unchanged active resources; a partial one (lifecycle, triggered,
+        drift) only handles the resources it is given and is never a reconciliation."""
+        self._full_cycle = full
+        self._full_started_at = None
+        if full:
+            # Parent directory scans only pay off when walking the inventory.
+            self.fs.begin_cycle()
+        if not full:
+            self.full_reconcile = False
+        elif not self.state:
+            self.full_reconcile = True
+        else:
+            now = time.time()
+            last_full = float(self.state.get_meta("last_full_reconcile") or 0)
+            self.full_reconcile = now - last_full >= self.full_reconcile_interval
+            if self.quota_engine and not self.quota_engine.primed:
+                # Group quotas can only be merged once every resource has been seen.
+                self.full_reconcile = True
+            if self.full_reconcile:
+                logger.info("Running full reconciliation cycle")
+                self._full_started_at = now
+        if self.quota_engine:
+            self.quota_engine.begin_cycle(full=self.full_reconcile)
+        if self.usage_collector:
+            self.usage_collector.begin_cycle(full=self.full_reconcile)
+
+    def end_cycle(self, complete: bool = True) -> None:
+        """Flushes work batched during the cycle.
+
+        complete is False when the cycle did not process the inventory (e.g. skipped
+        because nothing changed, or aborted), so batched state must not be pruned and
+        a full reconciliation does not count as done.
+        """
+        full, self._full_cycle = self._full_cycle, False
+        if full:
+            self.fs.end_cycle()
+        started, self._full_started_at = self._full_started_at, None
+        if started is not None and complete and self.state:
+            self.state.set_meta("last_full_reconcile", str(started))
+        if self.usage_collector:
+            self.usage_collector.end_cycle(complete=complete)
+        if not self.quota_engine:
+            return
+
+        failed = self.quota_engine.apply(complete=complete)
+        if self.state:
+            # Make sure resources whose quota failed are enforced again next cycle.
+            for item_id in failed:
+                self.state.forget(item_id)
+
+    def process_all(self, resources: Iterable[Resource], force: bool = False) -> int:
+        """Processes a batch of resources, concurrently when workers > 1.
+
+        Up to ``queue_window`` resources are read ahead and handed out by priority:
+        lifecycle transitions first, tenants taking turns (see workqueue). With
+        force, active resources are enforced even if their fingerprint is unchanged.
+        """
+        # Resolved on each call so wrappers installed later (e.g. metrics) apply.
+        queue = WorkQueue(
+            self.queue_deadlines,
+            on_dequeue=lambda priority, waited, late: self._dequeued(priority, waited, late),
+        )
+        count = OrderedExecutor(
+            lambda res: self.process(res, force=force),
+            self.workers,
+            max_pending=max(self.workers, self.queue_window),
+            queue=queue,
+        ).run(resources)
+
+        for priority, stats in queue.stats().items():
+            if stats["served"]:
+                logger.info(
+                    f"Queue wait of {stats['served']} {priority} resources: "
+                    f"p50 {stats['p50']:.2f}s, p99 {stats['p99']:.2f}s, max {stats['max']:.2f}s, "
+                    f"{stats['missed']} past the {stats['deadline']:.0f}s deadline"
+                )
+        return count
+
+    def _dequeued(self, priority: str, waited: float, late: bool) -> None:
+        """Called when a resource leaves the work queue; a hook for metrics."""
+
+    def process(self, resource: Resource, force: bool = False) -> None:
+        # Keeps this resource's callbacks in order (approve -> options -> backend_id -> done)
+        with self.client.callback_scope(resource.itemId):
+            try:
+                if resource.status == "pending":
+                    self._handle_pending(resource)
+                elif resource.status == "active":
+                    self._handle_active(resource, force=force)
+                elif resource.status == "removing":
+                    self._handle_removing(resource)
+                elif resource.status == "updating":
+                    self._handle_updating(resource)
+                elif resource.status == "removed":
+                    # Already handled, just log
+                    pass
+            except Exception as e:
+                logger.error(f"Error processing {resource.itemId}: {e}")
+                if resource.set_state_erred_url:
+                    self.client.send_callback(resource.set_state_erred_url)
+
+    def _get_gid_and_mode(self, res: Resource) -> Tuple[int, str]:
         """Determines valid GID and Mode for the resource."""
         # Default mode from JSON or fallback
         mode = res.permission.value if res.permission else "775"
@@ -52,7 +172,20 @@ class ResourceProcessor:
         # Based on example JSON, these have "775" but no unixGid.
         return 0, mode
 
-    def _map_quotas_to_waldur(self, quotas: list[QuotaItem]) -> dict:
+    def _enforce_quota(self, res: Resource, path: str, gid: int) -> None:
+        """Applies the quota of a resource right away (pending/updating)."""
+        quotas = res.quotas or []
+        if self.quota_engine:
+            # Merged with the other resources of the GID; skipped if already in place.
+            self.quota_engine.enforce(path, gid, quotas, item_id=res.itemId)
+        else:
+            self.fs.set_lustre_quota(path, gid, quotas)
+
+    def _track_usage(self, res: Resource, path: str, gid: int) -> None:
+        if self.usage_collector and gid > 0:
+            self.usage_collector.track(res.itemId, path, gid)
+
+    def _map_quotas_to_waldur(self, quotas: Sequence[Quota]) -> Dict[str, Any]:
         key_map = {
             ("space", "hard"): "hard_quota_space",
             ("inodes", "soft"): "soft_quota_inodes",
@@ -64,7 +197,7 @@ class ResourceProcessor:
             if (q.type, q.enforcementType) in key_map
         }
 
-    def _handle_pending(self, res: StorageResource):
+    def _handle_pending(self, res: Resource) -> None:
         path = res.mountPoint.get("default")
         if not path:
             logger.error(f"No mount point for {res.itemId}")
@@ -84,7 +217,8 @@ class ResourceProcessor:
 
             # 2. Apply Quota (Only if present and valid GID)
             if res.quotas and gid > 0:
-                self.fs.set_lustre_quota(path, gid, res.quotas)
+                self._enforce_quota(res, path, gid)
+            self._track_usage(res, path, gid)
         except Exception:
             # If provisioning fails, we should ideally report error but for now just raise
             # so the main loop logs it and we retry later.
@@ -106,31 +240,64 @@ class ResourceProcessor:
         if res.set_state_done_url:
             self.client.send_callback(res.set_state_done_url)
 
-    def _handle_active(self, res: StorageResource):
+    def _handle_active(self, res: Resource, force: bool = False) -> None:
         path = res.mountPoint.get("default")
+        if not path:
+            logger.error(f"No mount point for {res.itemId}")
+            return
         gid, mode = self._get_gid_and_mode(res)
+        # Unchanged resources are skipped below, but their usage is still collected.
+        self._track_usage(res, path, gid)
+
+        fingerprint = None
+        if self.state:
+            fingerprint = resource_fingerprint(res, gid, mode)
+            skip_allowed = not (self.full_reconcile or force)
+            if skip_allowed and self.state.get(res.itemId) == fingerprint:
+                logger.debug(f"Resource {res.itemId} unchanged, skipping enforcement")
+                return
 
         # Periodic enforcement
         self.fs.ensure_directory(path, gid, mode)
         if res.quotas and gid > 0:
-            self.fs.set_lustre_quota(path, gid, res.quotas)
+            if self.quota_engine:
+                self.quota_engine.stage(path, gid, res.quotas, item_id=res.itemId)
+            else:
+                self.fs.set_lustre_quota(path, gid, res.quotas)
+
+        if fingerprint and self.state:
+            self.state.record(res.itemId, fingerprint)
 
-    def _handle_removing(self, res: StorageResource):
+    def _handle_removing(self, res: Resource) -> None:
         path = res.mountPoint.get("default")
         if not path:
             return
 
-        # 0. Acknowledge (Approve)
-        if res.approve_by_provider_url:
+        archiving = bool(self.archive_engine and self.archive_engine.in_progress(res.itemId))
+
+        # 0. Acknowledge (Approve), only once while a background archive runs
+        if res.approve_by_provider_url and not archiving:
             self.client.send_callback(res.approve_by_provider_url)
 
-        logger.info(f"Deprovisioning: {path}")
-        self.fs.archive_directory(path, self.archive_dir)
+        if not archiving:
+            logger.info(f"Deprovisioning: {path}")
+        if self.archive_engine:
+            if not self.archive_engine.archive(path, res.itemId):
+                logger.info(f"Archiving {path} in progress, reporting done once complete")
+                return
+        else:
+            self.fs.archive_directory(path, self.archive_dir)
+        if self.quota_engine:
+            self.quota_engine.forget(res.itemId)
+        if self.usage_collector:
+            self.usage_collector.forget(res.itemId)
+        if self.state:
+            self.state.forget(res.itemId)
 
         if res.set_state_done_url:
             self.client.send_callback(res.set_state_done_url)
 
-    def _handle_updating(self, res: StorageResource):
+    def _handle_updating(self, res: Resource) -> None:
         # Similar to pending, we re-apply state and notify
         path = res.mountPoint.get("default")
         if not path:
@@ -149,7 +316,8 @@ class ResourceProcessor:
 
         # 2. Apply Quota
         if res.quotas and gid > 0:
-            self.fs.set_lustre_quota(path, gid, res.quotas)
+            self._enforce_quota(res, path, gid)
+        self._track_usage(res, path, gid)
 
         # 3. Callbacks
         if res.set_state_done_url:
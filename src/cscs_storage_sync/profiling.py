@@ -0,0 +1,333 @@
+"""On-demand profiling of one sync cycle.
+
+``cscs-sync --profile-cycle`` or ``kill -USR1 <pid>`` arms the CycleProfiler; the
+next cycle of the requested kind then runs under cProfile and tracemalloc, with
+per-resource timers installed on the processor, filesystem driver and client.
+When it ends the profiler writes to ``profile_dir``:
+
+- ``<stem>.pstats``: cProfile statistics of the cycle's threads (``python -m pstats``)
+- ``<stem>.alloc.txt``: the top allocation sites still holding memory
+- ``<stem>.resources.tsv``: itemId, status and seconds spent in fetch, parse,
+  ensure_directory, setquota and callback, slowest resources first
+
+and removes the timers again. Until armed, a cycle only pays one attribute check.
+"""
+
+import cProfile
+import functools
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from types import FrameType
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .pipeline import SyncPipeline
+
+logger = logging.getLogger(__name__)
+
+CYCLE_KINDS = ("full", "lifecycle", "targeted", "drift")
+PHASES = ("fetch", "parse", "ensure_directory", "setquota", "callback")
+# Row of time that cannot be tied to a resource (e.g. batched quota enforcement).
+UNATTRIBUTED = "-"
+# Threads a cycle starts and joins: resource workers, page fetches, quota setters.
+# Long-lived pools (callbacks, archive jobs) that happen to start during the cycle
+# are not profiled: a thread's profiler can only be turned off from that thread.
+CYCLE_THREAD_PREFIXES = ("sync_", "page_", "quota_")
+
+_missing = object()
+
+
+class ResourceTimings:
+    """Seconds per phase and resource; the resource is the one processed by the
+    calling thread, or the one whose callback it delivers."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.rows: Dict[str, Dict[str, float]] = {}
+        self.statuses: Dict[str, str] = {}
+
+    @property
+    def current(self) -> str:
+        return getattr(self._local, "item_id", UNATTRIBUTED)
+
+    def enter(self, item_id: str) -> str:
+        previous = self.current
+        self._local.item_id = item_id
+        return previous
+
+    def leave(self, previous: str) -> None:
+        self._local.item_id = previous
+
+    def add(self, item_id: str, phase: str, seconds: float) -> None:
+        with self._lock:
+            row = self.rows.setdefault(item_id, {})
+            row[phase] = row.get(phase, 0.0) + seconds
+
+    def set_status(self, item_id: str, status: str) -> None:
+        with self._lock:
+            self.statuses[item_id] = status
+            self.rows.setdefault(item_id, {})
+
+    def table(self) -> List[Tuple[str, str, Dict[str, float]]]:
+        """(itemId, status, phase -> seconds) rows, by descending total time."""
+        with self._lock:
+            rows = [(i, self.statuses.get(i, ""), dict(r)) for i, r in self.rows.items()]
+        return sorted(rows, key=lambda row: (-row[2].get("total", 0.0), row[0]))
+
+    def write(self, path: Path) -> None:
+        columns = ("total",) + PHASES
+        lines = ["\t".join(("itemId", "status") + columns)]
+        for item_id, status, row in self.table():
+            values = (f"{row.get(c, 0.0):.6f}" for c in columns)
+            lines.append("\t".join((item_id, status, *values)))
+        path.write_text("\n".join(lines) + "\n")
+
+
+class CycleProfiler:
+    """Profiles the next cycle of a given kind once requested, then stops.
+
+    One cycle is profiled at a time: tracemalloc is process wide and the first
+    pipeline to start a cycle of the requested kind takes the request.
+    """
+
+    def __init__(self, output_dir: str, top: int = 25):
+        self.output_dir = Path(output_dir)
+        self.top = top
+        self._lock = threading.Lock()
+        # Kind of cycle to profile next; None when profiling is off.
+        self._requested: Optional[str] = None
+        self._thread_profiles: List[cProfile.Profile] = []
+
+    def request(self, kind: str = "full") -> None:
+        """Profiles the next cycle of kind. Only sets an attribute: safe in signal handlers."""
+        if kind not in CYCLE_KINDS:
+            raise ValueError(f"Unknown cycle kind: {kind}")
+        self._requested = kind
+
+    @property
+    def requested(self) -> Optional[str]:
+        return self._requested
+
+    def _claim(self, kind: str) -> bool:
+        with self._lock:
+            if self._requested != kind:
+                return False
+            self._requested = None
+            return True
+
+    def instrument(self, pipeline: "SyncPipeline") -> None:
+        """Wraps the cycles of a pipeline's scheduler so a request takes effect."""
+        for kind in CYCLE_KINDS:
+            self._wrap_cycle(pipeline, f"run_{kind}_cycle", kind)
+
+    def _wrap_cycle(self, pipeline: "SyncPipeline", name: str, kind: str) -> None:
+        scheduler = pipeline.scheduler
+        original = getattr(scheduler, name)
+
+        @functools.wraps(original)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            # The only cost while profiling is off.
+            if self._requested is None or not self._claim(kind):
+                return original(*args, **kwargs)
+            return self._profile(pipeline, kind, original, args, kwargs)
+
+        setattr(scheduler, name, wrapper)
+
+    # -- Profiled cycle ----------------------------------------------------------
+
+    def _profile(
+        self,
+        pipeline: "SyncPipeline",
+        kind: str,
+        original: Callable[..., Any],
+        args: Tuple[Any, ...],
+        kwargs: Dict[str, Any],
+    ) -> Any:
+        logger.info(f"Profiling the next {kind} cycle of {pipeline.name}")
+        timings = ResourceTimings()
+        restore = self._install_timers(pipeline, timings)
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        self._thread_profiles = []
+        # The cycle's own threads started meanwhile profile themselves.
+        threading.setprofile(self._profile_thread)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            threading.setprofile(None)
+            with self._lock:
+                thread_profiles = list(self._thread_profiles)
+            for thread_profile in thread_profiles:
+                # The cycle's threads were joined, or exit once idle (page fetches).
+                thread_profile.disable()
+            restore()
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+            try:
+                self._dump(pipeline.name, kind, elapsed, profiler, snapshot, peak, timings)
+            except OSError as e:
+                logger.error(f"Could not write the cycle profile to {self.output_dir}: {e}")
+
+    def _profile_thread(self, frame: FrameType, event: str, arg: Any) -> None:
+        sys.setprofile(None)
+        if not threading.current_thread().name.startswith(CYCLE_THREAD_PREFIXES):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: the cycle's profiler already sees every thread.
+            return
+        with self._lock:
+            self._thread_profiles.append(profiler)
+
+    def _install_timers(
+        self, pipeline: "SyncPipeline", timings: ResourceTimings
+    ) -> Callable[[], None]:
+        """Wraps the per-resource steps; returns a function that removes the wrappers."""
+        installed: List[Tuple[object, str, object]] = []
+        local = threading.local()
+
+        def wrap(obj: Any, name: str, make: Callable[[Any], Any]) -> None:
+            if obj is None or not hasattr(obj, name):
+                return
+            installed.append((obj, name, obj.__dict__.get(name, _missing)))
+            setattr(obj, name, functools.wraps(getattr(obj, name))(make(getattr(obj, name))))
+
+        def timed(phase: str) -> Callable[[Any], Any]:
+            def make(original: Callable[..., Any]) -> Callable[..., Any]:
+                def wrapper(*args: Any, **kwargs: Any) -> Any:
+                    started = time.perf_counter()
+                    try:
+                        return original(*args, **kwargs)
+                    finally:
+                        timings.add(timings.current, phase, time.perf_counter() - started)
+
+                return wrapper
+
+            return make
+
+        def process(original: Callable[..., Any]) -> Callable[..., Any]:
+            def wrapper(resource: Any, *args: Any, **kwargs: Any) -> Any:
+                timings.set_status(resource.itemId, resource.status)
+                previous = timings.enter(resource.itemId)
+                started = time.perf_counter()
+                try:
+                    return original(resource, *args, **kwargs)
+                finally:
+                    timings.add(resource.itemId, "total", time.perf_counter() - started)
+                    timings.leave(previous)
+
+            return wrapper
+
+        def get_page(original: Callable[..., Any]) -> Callable[..., Any]:
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    # Spread over the page's resources once it is parsed.
+                    local.fetch = time.perf_counter() - started
+
+            return wrapper
+
+        def parse_page(original: Callable[..., Any]) -> Callable[..., Any]:
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                started = time.perf_counter()
+                parsed = original(*args, **kwargs)
+                parse = time.perf_counter() - started
+                fetch, local.fetch = getattr(local, "fetch", 0.0), 0.0
+                resources = getattr(parsed, "resources", None) or []
+                for res in resources:
+                    timings.add(res.itemId, "fetch", fetch / len(resources))
+                    timings.add(res.itemId, "parse", parse / len(resources))
+                if not resources:
+                    timings.add(UNATTRIBUTED, "fetch", fetch)
+                    timings.add(UNATTRIBUTED, "parse", parse)
+                return parsed
+
+            return wrapper
+
+        def deliver(original: Callable[..., Any]) -> Callable[..., Any]:
+            def wrapper(cb: Any, *args: Any, **kwargs: Any) -> Any:
+                previous = timings.enter(cb.key)
+                try:
+                    return original(cb, *args, **kwargs)
+                finally:
+                    timings.leave(previous)
+
+            return wrapper
+
+        client = pipeline.client
+        wrap(pipeline.processor, "process", process)
+        wrap(pipeline.fs, "ensure_directory", timed("ensure_directory"))
+        wrap(pipeline.fs, "apply_quota_limits", timed("setquota"))
+        wrap(client, "_get_page", get_page)
+        wrap(client, "_parse_page", parse_page)
+        wrap(client, "_post_callback", timed("callback"))
+        wrap(getattr(client, "dispatcher", None), "_deliver", deliver)
+
+        def restore() -> None:
+            for obj, name, previous in reversed(installed):
+                if previous is _missing:
+                    delattr(obj, name)
+                else:
+                    setattr(obj, name, previous)
+
+        return restore
+
+    def _dump(
+        self,
+        name: str,
+        kind: str,
+        elapsed: float,
+        profiler: cProfile.Profile,
+        snapshot: tracemalloc.Snapshot,
+        peak: int,
+        timings: ResourceTimings,
+    ) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        stem = self.output_dir / f"cycle-{name}-{kind}-{stamp}"
+
+        stats = pstats.Stats(profiler)
+        with self._lock:
+            thread_profiles, self._thread_profiles = self._thread_profiles, []
+        for thread_profile in thread_profiles:
+            try:
+                stats.add(thread_profile)
+            except TypeError:
+                # A thread that never made a call has no stats.
+                continue
+        stats.dump_stats(f"{stem}.pstats")
+
+        snapshot = snapshot.filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        lines = [f"Peak traced memory: {peak / 1024:.1f} KiB", ""]
+        for stat in snapshot.statistics("lineno")[: self.top]:
+            lines.append(str(stat))
+        Path(f"{stem}.alloc.txt").write_text("\n".join(lines) + "\n")
+
+        timings.write(Path(f"{stem}.resources.tsv"))
+        logger.info(
+            f"Profiled {kind} cycle of {name}: {elapsed:.1f}s, "
+            f"{len(timings.rows)} resources, written to {stem}.*"
+        )
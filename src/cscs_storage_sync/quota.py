@@ -0,0 +1,379 @@
+import functools
+import logging
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from .models import Quota
+
+if TYPE_CHECKING:
+    from .filesystem import FilesystemDriver
+
+logger = logging.getLogger(__name__)
+
+_GROUP_HEADER = re.compile(r"^Disk quotas for gr(?:ou)?p \S+ \(gid (\d+)\):")
+
+
+@dataclass(frozen=True)
+class QuotaLimits:
+    """Lustre group limits: blocks in KB, inodes as counts. 0 means unlimited."""
+
+    block_soft: int = 0
+    block_hard: int = 0
+    inode_soft: int = 0
+    inode_hard: int = 0
+
+
+@dataclass(frozen=True)
+class GroupQuota:
+    limits: QuotaLimits
+    space_used: int = 0
+    inodes_used: int = 0
+
+
+class QuotaError(ValueError):
+    """A quota that cannot be translated into Lustre limits."""
+
+
+# KB per unit of a space quota. Waldur's "TB" has always been applied as TiB.
+SPACE_UNITS_KB = {
+    "KB": 1,
+    "KIB": 1,
+    "MB": 1024,
+    "MIB": 1024,
+    "GB": 1024**2,
+    "GIB": 1024**2,
+    "TB": 1024**3,
+    "TIB": 1024**3,
+    "PB": 1024**4,
+    "PIB": 1024**4,
+}
+DEFAULT_SPACE_UNIT = "TB"
+INODE_UNITS = {"", "inodes", "files", "count"}
+
+# (type, enforcementType) -> QuotaLimits field position
+_LIMIT_FIELDS = {
+    ("space", "soft"): 0,
+    ("space", "hard"): 1,
+    ("inodes", "soft"): 2,
+    ("inodes", "hard"): 3,
+}
+
+
+def compute_quota_limits(quotas: Sequence[Quota]) -> QuotaLimits:
+    """Converts Waldur quotas to Lustre limits. Raises QuotaError on unit mismatches."""
+    return _compute_limits(
+        tuple((q.type, float(q.quota), q.unit or "", q.enforcementType) for q in quotas)
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _compute_limits(items: Tuple[Tuple[str, float, str, str], ...]) -> QuotaLimits:
+    # Most resources share a handful of quota templates, so results are memoized.
+    values = [0, 0, 0, 0]
+    for qtype, quota, unit, enforcement in items:
+        field = _LIMIT_FIELDS.get((qtype, enforcement))
+        if field is None:
+            continue
+        if qtype == "space":
+            factor = SPACE_UNITS_KB.get((unit or DEFAULT_SPACE_UNIT).upper())
+            if factor is None:
+                raise QuotaError(f"Unsupported unit {unit!r} for a space quota")
+            values[field] = int(quota * factor)
+        else:
+            if unit.lower() not in INODE_UNITS:
+                raise QuotaError(f"Unit {unit!r} does not apply to an inode quota")
+            values[field] = int(quota)
+    return QuotaLimits(*values)
+
+
+def merge_limits(candidates: List[QuotaLimits], policy: str = "max") -> QuotaLimits:
+    """Resolves several desired limits for one group into one, independent of order.
+
+    ``max`` keeps the most permissive value of each limit, ``sum`` adds them up (for
+    resources that each bring their own allocation). 0 (unlimited) always wins.
+    """
+    if len(candidates) == 1:
+        return candidates[0]
+    combine = sum if policy == "sum" else max
+    merged = []
+    for values in zip(*(astuple(c) for c in candidates), strict=True):
+        merged.append(0 if 0 in values else combine(values))
+    return QuotaLimits(*merged)
+
+
+def _to_int(token: str) -> int:
+    # lfs marks exceeded limits with '*' and unset grace with '-'
+    token = token.rstrip("*")
+    return int(token) if token.isdigit() else 0
+
+
+def parse_lfs_quota(output: str) -> Dict[int, GroupQuota]:
+    """Parses `lfs quota -g` style output, one block per group, into a GID map."""
+    result: Dict[int, GroupQuota] = {}
+    gid: Optional[int] = None
+    pending: List[str] = []
+
+    for line in output.splitlines():
+        header = _GROUP_HEADER.match(line.strip())
+        if header:
+            gid = int(header.group(1))
+            pending = []
+            continue
+        if gid is None:
+            continue
+
+        tokens = line.split()
+        if not tokens or tokens[0] == "Filesystem":
+            continue
+
+        # Long filesystem names are printed on their own line, values on the next.
+        pending.extend(tokens)
+        if len(pending) < 9:
+            continue
+
+        # Filesystem kbytes quota limit grace files quota limit grace
+        values = pending[1:9]
+        result[gid] = GroupQuota(
+            limits=QuotaLimits(
+                block_soft=_to_int(values[1]),
+                block_hard=_to_int(values[2]),
+                inode_soft=_to_int(values[5]),
+                inode_hard=_to_int(values[6]),
+            ),
+            space_used=_to_int(values[0]),
+            inodes_used=_to_int(values[4]),
+        )
+        gid = None
+        pending = []
+
+    return result
+
+
+GroupKey = Tuple[Path, int]
+# (group, path, merged limits, contributing item ids) of a group quota to set.
+GroupChange = Tuple[GroupKey, Path, QuotaLimits, Set[str]]
+
+
+class QuotaEngine:
+    """Aggregates desired group quotas and applies only the differences.
+
+    Lustre group quotas are per filesystem, so every resource of a GID on the same
+    filesystem shares one limit set. Desired limits are collected per
+    (filesystem, gid) from all resources, merged with ``conflict_policy`` and set
+    with at most one ``lfs setquota`` per group. Current limits are read with one
+    bulk query per filesystem; when that fails, the limits last applied by this
+    engine are used instead, so unchanged groups are not set again.
+
+    Contributions are kept between cycles, so incremental cycles that only stage
+    changed resources still merge against the other resources of the group.
+    """
+
+    def __init__(
+        self, fs: "FilesystemDriver", max_workers: int = 8, conflict_policy: str = "max"
+    ) -> None:
+        if conflict_policy not in ("max", "sum"):
+            raise ValueError(f"Unknown quota conflict policy: {conflict_policy}")
+        self.fs = fs
+        self.max_workers = max(1, max_workers)
+        self.conflict_policy = conflict_policy
+        self._lock = threading.Lock()
+        # group -> contributor (itemId or path) -> desired limits
+        self._desired: Dict[GroupKey, Dict[str, QuotaLimits]] = {}
+        self._paths: Dict[GroupKey, Path] = {}
+        self._groups_of: Dict[str, GroupKey] = {}
+        self._applied: Dict[GroupKey, QuotaLimits] = {}
+        self._touched: Set[GroupKey] = set()
+        self._staged: Set[str] = set()
+        self._full = False
+        # Contributions are only complete once a full cycle staged every resource.
+        self.primed = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Contributions and applied limits, for a warm restart (see restore)."""
+        with self._lock:
+            return {
+                "primed": self.primed,
+                "desired": [
+                    [str(mount), gid, contributor, astuple(limits)]
+                    for (mount, gid), group in self._desired.items()
+                    for contributor, limits in group.items()
+                ],
+                "paths": [
+                    [str(mount), gid, str(path)] for (mount, gid), path in self._paths.items()
+                ],
+                "applied": [
+                    [str(mount), gid, astuple(limits)]
+                    for (mount, gid), limits in self._applied.items()
+                ],
+            }
+
+    def restore(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            for mount, gid, contributor, limits in data.get("desired", []):
+                key = (Path(mount), gid)
+                self._desired.setdefault(key, {})[contributor] = QuotaLimits(*limits)
+                self._groups_of[contributor] = key
+            for mount, gid, path in data.get("paths", []):
+                self._paths[(Path(mount), gid)] = Path(path)
+            for mount, gid, limits in data.get("applied", []):
+                self._applied[(Path(mount), gid)] = QuotaLimits(*limits)
+            self.primed = bool(data.get("primed"))
+
+    def begin_cycle(self, full: bool) -> None:
+        """With full, contributors that are not staged again before apply() are dropped."""
+        with self._lock:
+            self._full = full
+            self._staged = set()
+
+    def stage(self, rel_path: str, gid: int, quotas: Sequence[Quota], item_id: str = "") -> None:
+        if gid == 0:
+            logger.warning("Skipping quota application for GID 0 (root).")
+            return
+
+        limits = compute_quota_limits(quotas)
+        full_path = self.fs.resolve(rel_path)
+        key = (self.fs.filesystem_for(rel_path), gid)
+        contributor = item_id or str(full_path)
+        with self._lock:
+            previous = self._groups_of.get(contributor)
+            if previous is not None and previous != key:
+                # The resource moved to another GID or filesystem.
+                self._remove(contributor, previous)
+            group = self._desired.setdefault(key, {})
+            if group.get(contributor) != limits:
+                self._touched.add(key)
+            group[contributor] = limits
+            self._groups_of[contributor] = key
+            self._staged.add(contributor)
+            # Any path of the group works for setquota; keep the choice deterministic.
+            if key not in self._paths or full_path < self._paths[key]:
+                self._paths[key] = full_path
+
+    def forget(self, item_id: str) -> None:
+        """Drops a removed resource from its group; the others are re-merged on apply."""
+        with self._lock:
+            key = self._groups_of.get(item_id)
+            if key is not None:
+                self._remove(item_id, key)
+
+    def _remove(self, contributor: str, key: GroupKey) -> None:
+        group = self._desired.get(key, {})
+        group.pop(contributor, None)
+        self._groups_of.pop(contributor, None)
+        self._touched.add(key)
+        if not group:
+            self._desired.pop(key, None)
+            self._paths.pop(key, None)
+
+    def enforce(self, rel_path: str, gid: int, quotas: Sequence[Quota], item_id: str = "") -> None:
+        """Stages and immediately applies the group of one resource (pending/updating).
+
+        Raises subprocess.CalledProcessError/OSError if setquota fails.
+        """
+        self.stage(rel_path, gid, quotas, item_id=item_id)
+        if gid == 0:
+            return
+        key = (self.fs.filesystem_for(rel_path), gid)
+        with self._lock:
+            change = self._resolve(key)
+            self._touched.discard(key)
+        if change:
+            self._apply_one(change, check=True)
+
+    def _resolve(
+        self, key: GroupKey, current: Optional[QuotaLimits] = None
+    ) -> Optional[GroupChange]:
+        """Returns (key, path, merged limits, contributors) if the group needs setting."""
+        group = self._desired.get(key)
+        if not group:
+            return None
+        candidates = sorted(set(group.values()), key=astuple)
+        merged = merge_limits(candidates, self.conflict_policy)
+        if len(candidates) > 1:
+            logger.warning(
+                f"Conflicting quotas for GID {key[1]} on {key[0]} from {sorted(group)}, "
+                f"using {self.conflict_policy}: {merged}"
+            )
+        if current is None:
+            current = self._applied.get(key)
+        if current == merged:
+            self._applied[key] = merged
+            return None
+        return key, self._paths[key], merged, set(group)
+
+    def apply(self, complete: bool = True) -> Set[str]:
+        """Applies groups changed this cycle (all groups after a complete full cycle).
+
+        Returns the item ids whose quota could not be set.
+        """
+        with self._lock:
+            if self._full and complete:
+                for contributor in [c for c in self._groups_of if c not in self._staged]:
+                    self._remove(contributor, self._groups_of[contributor])
+                keys = set(self._desired) | self._touched
+                self.primed = True
+            else:
+                keys = set(self._touched)
+            self._touched = set()
+            self._full = False
+        if not keys:
+            return set()
+
+        gids: Dict[Path, Set[int]] = {}
+        for mount, gid in keys:
+            gids.setdefault(mount, set()).add(gid)
+        current: Dict[Path, Dict[int, GroupQuota]] = {
+            mount: self.fs.read_group_quotas(mount, sorted(gids[mount])) for mount in sorted(gids)
+        }
+
+        changes: List[GroupChange] = []
+        with self._lock:
+            for key in sorted(keys):
+                groups = current[key[0]]
+                if groups:
+                    existing = groups.get(key[1])
+                    limits = existing.limits if existing else QuotaLimits()
+                else:
+                    # Bulk read failed: compare with what this engine applied last.
+                    limits = None
+                change = self._resolve(key, limits)
+                if change:
+                    changes.append(change)
+
+        logger.info(f"Quota engine: {len(changes)} of {len(keys)} group quotas need updating")
+        if not changes:
+            return set()
+
+        failed: Set[str] = set()
+
+        def apply_one(change: GroupChange) -> None:
+            try:
+                self._apply_one(change, check=True)
+            except (subprocess.CalledProcessError, OSError) as e:
+                logger.error(f"Failed to set quota for GID {change[0][1]}: {e}")
+                with self._lock:
+                    failed.update(change[3])
+
+        workers = min(self.max_workers, len(changes))
+        if workers == 1:
+            for change in changes:
+                apply_one(change)
+            return failed
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quota") as pool:
+            list(pool.map(apply_one, changes))
+
+        return failed
+
+    def _apply_one(self, change: GroupChange, check: bool) -> None:
+        key, full_path, limits, _ = change
+        logger.info(f"Setting quota for GID {key[1]} on {full_path}")
+        with self._lock:
+            self._applied.pop(key, None)
+        self.fs.apply_quota_limits(full_path, key[1], limits, check=check)
+        with self._lock:
+            self._applied[key] = limits
@@ -0,0 +1,254 @@
+"""Group quota backends: the lfs CLI, liblustreapi in-process, or an in-memory fake.
+
+All backends take and return limits in the same units (blocks in KB, inodes as
+counts) and raise OSError (or subprocess.CalledProcessError for the CLI) when an
+operation fails.
+"""
+
+import abc
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import subprocess
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .quota import GroupQuota, QuotaLimits, parse_lfs_quota
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaBackend(abc.ABC):
+    name = ""
+
+    @abc.abstractmethod
+    def set_group_limits(self, path: Path, gid: int, limits: QuotaLimits) -> None:
+        """Sets the limits of gid on the filesystem holding path."""
+
+    @abc.abstractmethod
+    def get_group_quota(self, path: Path, gid: int) -> GroupQuota:
+        """Limits and usage of gid on the filesystem holding path."""
+
+    def read_group_quotas(
+        self, mount: Path, gids: Optional[Iterable[int]] = None
+    ) -> Dict[int, GroupQuota]:
+        """Limits and usage of the groups on a filesystem.
+
+        Returns at least the requested gids; backends that can list every group at
+        once return all of them.
+        """
+        return {gid: self.get_group_quota(mount, gid) for gid in gids or ()}
+
+
+def _run(cmd: List[str]) -> str:
+    logger.debug(f"Executing: {' '.join(cmd)}")
+    try:
+        return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Command failed: {e.stderr}")
+        raise
+
+
+class CliQuotaBackend(QuotaBackend):
+    """Runs ``lfs setquota`` / ``lfs quota``: one process per call."""
+
+    name = "cli"
+
+    def __init__(self, run: Callable[[List[str]], str] = _run):
+        self._run = run
+
+    def set_group_limits(self, path: Path, gid: int, limits: QuotaLimits) -> None:
+        self._run(
+            [
+                "lfs",
+                "setquota",
+                "-g",
+                str(gid),
+                "-b",
+                str(limits.block_soft),
+                "-B",
+                str(limits.block_hard),
+                "-i",
+                str(limits.inode_soft),
+                "-I",
+                str(limits.inode_hard),
+                str(path),
+            ]
+        )
+
+    def get_group_quota(self, path: Path, gid: int) -> GroupQuota:
+        output = self._run(["lfs", "quota", "-g", str(gid), str(path)])
+        quotas = parse_lfs_quota(output or "")
+        return quotas.get(gid) or next(iter(quotas.values()), GroupQuota(QuotaLimits()))
+
+    def read_group_quotas(
+        self, mount: Path, gids: Optional[Iterable[int]] = None
+    ) -> Dict[int, GroupQuota]:
+        # One process for all groups, whatever was asked for.
+        return parse_lfs_quota(self._run(["lfs", "quota", "-a", "-g", str(mount)]) or "")
+
+
+# liblustreapi quotactl, see lustre/include/uapi/linux/lustre/lustre_user.h
+LUSTRE_Q_GETQUOTA = 0x800007
+LUSTRE_Q_SETQUOTA = 0x800008
+GRPQUOTA = 1
+QIF_BLIMITS = 1
+QIF_ILIMITS = 4
+QIF_LIMITS = QIF_BLIMITS | QIF_ILIMITS
+
+
+class _ObdDqinfo(ctypes.Structure):
+    _fields_ = [
+        ("dqi_bgrace", ctypes.c_uint64),
+        ("dqi_igrace", ctypes.c_uint64),
+        ("dqi_flags", ctypes.c_uint32),
+        ("dqi_valid", ctypes.c_uint32),
+    ]
+
+
+class _ObdDqblk(ctypes.Structure):
+    _fields_ = [
+        ("dqb_bhardlimit", ctypes.c_uint64),  # KB
+        ("dqb_bsoftlimit", ctypes.c_uint64),
+        ("dqb_curspace", ctypes.c_uint64),  # bytes
+        ("dqb_ihardlimit", ctypes.c_uint64),
+        ("dqb_isoftlimit", ctypes.c_uint64),
+        ("dqb_curinodes", ctypes.c_uint64),
+        ("dqb_btime", ctypes.c_uint64),
+        ("dqb_itime", ctypes.c_uint64),
+        ("dqb_valid", ctypes.c_uint32),
+        ("dqb_padding", ctypes.c_uint32),
+    ]
+
+
+class _IfQuotactl(ctypes.Structure):
+    _fields_ = [
+        ("qc_cmd", ctypes.c_uint32),
+        ("qc_type", ctypes.c_uint32),
+        ("qc_id", ctypes.c_uint32),
+        ("qc_stat", ctypes.c_uint32),
+        ("qc_valid", ctypes.c_uint32),
+        ("qc_idx", ctypes.c_uint32),
+        ("qc_dqinfo", _ObdDqinfo),
+        ("qc_dqblk", _ObdDqblk),
+        ("obd_type", ctypes.c_char * 16),
+        ("obd_uuid", ctypes.c_char * 40),
+        # Room for the pool name newer releases append; zero means no pool.
+        ("qc_poolname", ctypes.c_char * 16),
+    ]
+
+
+class LlapiQuotaBackend(QuotaBackend):
+    """Calls ``llapi_quotactl`` from liblustreapi in-process: no fork/exec per call.
+
+    There is no bulk read; read_group_quotas queries the requested gids one by one,
+    which is an ioctl each.
+    """
+
+    name = "llapi"
+
+    def __init__(
+        self, library: Optional[str] = None, quotactl: Optional[Callable[..., int]] = None
+    ):
+        if quotactl is None:
+            path = library or ctypes.util.find_library("lustreapi") or "liblustreapi.so"
+            try:
+                lib = ctypes.CDLL(path, use_errno=True)
+            except OSError as e:
+                raise OSError(f"Cannot load liblustreapi ({path}): {e}") from e
+            quotactl = lib.llapi_quotactl
+            quotactl.argtypes = [ctypes.c_char_p, ctypes.POINTER(_IfQuotactl)]
+            quotactl.restype = ctypes.c_int
+        self._quotactl = quotactl
+
+    def _call(self, path: Path, qctl: _IfQuotactl) -> None:
+        rc = self._quotactl(os.fsencode(str(path)), ctypes.pointer(qctl))
+        if rc != 0:
+            # liblustreapi returns -errno
+            code = -rc if rc < 0 else ctypes.get_errno() or errno.EIO
+            raise OSError(code, f"llapi_quotactl: {os.strerror(code)}", str(path))
+
+    def set_group_limits(self, path: Path, gid: int, limits: QuotaLimits) -> None:
+        qctl = _IfQuotactl(qc_cmd=LUSTRE_Q_SETQUOTA, qc_type=GRPQUOTA, qc_id=gid)
+        qctl.qc_dqblk.dqb_bsoftlimit = limits.block_soft
+        qctl.qc_dqblk.dqb_bhardlimit = limits.block_hard
+        qctl.qc_dqblk.dqb_isoftlimit = limits.inode_soft
+        qctl.qc_dqblk.dqb_ihardlimit = limits.inode_hard
+        qctl.qc_dqblk.dqb_valid = QIF_LIMITS
+        self._call(path, qctl)
+
+    def get_group_quota(self, path: Path, gid: int) -> GroupQuota:
+        qctl = _IfQuotactl(qc_cmd=LUSTRE_Q_GETQUOTA, qc_type=GRPQUOTA, qc_id=gid)
+        self._call(path, qctl)
+        dqblk = qctl.qc_dqblk
+        return GroupQuota(
+            QuotaLimits(
+                dqblk.dqb_bsoftlimit,
+                dqblk.dqb_bhardlimit,
+                dqblk.dqb_isoftlimit,
+                dqblk.dqb_ihardlimit,
+            ),
+            space_used=dqblk.dqb_curspace // 1024,
+            inodes_used=dqblk.dqb_curinodes,
+        )
+
+
+class FakeQuotaBackend(QuotaBackend):
+    """Keeps group quotas in memory, for tests and benchmarks.
+
+    Paths map to the longest of ``mounts`` containing them; without mounts, all
+    paths share one filesystem.
+    """
+
+    name = "fake"
+
+    def __init__(self, mounts: Iterable[Path] = ()):
+        self.mounts = sorted((Path(m) for m in mounts), key=lambda m: len(m.parts), reverse=True)
+        self.groups: Dict[Path, Dict[int, GroupQuota]] = {}
+        self.calls: Dict[str, int] = {"set": 0, "get": 0, "read": 0}
+        self._lock = threading.Lock()
+
+    def _filesystem(self, path: Path) -> Path:
+        path = Path(path)
+        for mount in self.mounts:
+            if mount == path or mount in path.parents:
+                return mount
+        return Path("/")
+
+    def set_group_limits(self, path: Path, gid: int, limits: QuotaLimits) -> None:
+        with self._lock:
+            self.calls["set"] += 1
+            groups = self.groups.setdefault(self._filesystem(path), {})
+            current = groups.get(gid)
+            groups[gid] = GroupQuota(
+                limits,
+                space_used=current.space_used if current else 0,
+                inodes_used=current.inodes_used if current else 0,
+            )
+
+    def get_group_quota(self, path: Path, gid: int) -> GroupQuota:
+        with self._lock:
+            self.calls["get"] += 1
+            groups = self.groups.get(self._filesystem(path), {})
+            return groups.get(gid) or GroupQuota(QuotaLimits())
+
+    def read_group_quotas(
+        self, mount: Path, gids: Optional[Iterable[int]] = None
+    ) -> Dict[int, GroupQuota]:
+        with self._lock:
+            self.calls["read"] += 1
+            return dict(self.groups.get(self._filesystem(mount), {}))
+
+
+def build_quota_backend(name: str = "cli") -> QuotaBackend:
+    """Creates the backend selected by ``quota_backend``."""
+    if name == "cli":
+        return CliQuotaBackend()
+    if name == "llapi":
+        return LlapiQuotaBackend()
+    if name == "fake":
+        return FakeQuotaBackend()
+    raise ValueError(f"Unknown quota_backend: {name}")
@@ -0,0 +1,425 @@
+import functools
+import hmac
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Concatenate,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    ParamSpec,
+    Set,
+)
+
+from .api_client import IncompleteInventoryError, StorageProxyClient
+from .drift import DriftIndex
+from .models import Resource
+from .orphans import ManagedPathIndex
+from .processors import ResourceProcessor
+from .sharding import ShardClaim, ShardMembership
+from .workqueue import LIFECYCLE_STATUSES
+
+if TYPE_CHECKING:
+    from .pipeline import PipelineGroup
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+
+
+def _fenced(
+    cycle: Callable[Concatenate["SyncScheduler", P], None],
+) -> Callable[Concatenate["SyncScheduler", P], None]:
+    """Runs a cycle under a claim on this agent's shards, so none of them is handed
+    to another agent while the cycle may still touch their paths."""
+
+    @functools.wraps(cycle)
+    def wrapper(self: "SyncScheduler", /, *args: P.args, **kwargs: P.kwargs) -> None:
+        if self.shard is None:
+            return cycle(self, *args, **kwargs)
+        with self.shard.claim() as claim:
+            self._claim = claim
+            try:
+                return cycle(self, *args, **kwargs)
+            finally:
+                self._claim = None
+
+    return wrapper
+
+
+class SyncScheduler:
+    """Drives sync cycles at two cadences plus on-demand triggers.
+
+    * Full cycle every ``sync_interval_seconds``: the whole inventory, including
+      periodic enforcement of active resources.
+    * Lifecycle cycle every ``lifecycle_poll_interval_seconds`` (0 disables it):
+      only pending/updating/removing resources, filtered on the proxy via
+      ``lifecycle_status_param``, so new requests are provisioned within seconds.
+    * Triggered cycle: ``trigger(item_ids)`` wakes the scheduler immediately to run
+      a lifecycle cycle and force-enforce the given itemIds.
+    * Drift cycle: ``reenforce(item_ids)`` force-enforces resources whose directory
+      changed out of band, from their last seen state in ``drift_index`` and
+      without asking the proxy.
+
+    With a ``shard``, only the resources of shards this agent holds a claim on are
+    processed. A
+    ``path_index`` is kept up to date with the paths of all resources, owned or not.
+    """
+
+    def __init__(
+        self,
+        client: StorageProxyClient,
+        processor: ResourceProcessor,
+        config: Dict[str, Any],
+        storage_system: Optional[str] = None,
+        shard: Optional[ShardMembership] = None,
+        drift_index: Optional[DriftIndex] = None,
+        path_index: Optional[ManagedPathIndex] = None,
+    ):
+        self.client = client
+        self.processor = processor
+        self.storage_system = storage_system
+        self.shard = shard
+        self.drift_index = drift_index
+        self.path_index = path_index
+        self.configure(config)
+
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._targets: Set[str] = set()
+        self._drifted: Set[str] = set()
+        # Shards held by the running cycle, when sharding.
+        self._claim: Optional[ShardClaim] = None
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        """Applies the reloadable settings; a running loop picks them up when woken."""
+        self.full_interval = config.get("sync_interval_seconds", 60)
+        self.lifecycle_interval = config.get("lifecycle_poll_interval_seconds", 0)
+        self.status_param = config.get("lifecycle_status_param", "status")
+        self.conditional = config.get("conditional_polling", False)
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def reenforce(self, item_ids: Iterable[str]) -> None:
+        with self._lock:
+            self._drifted.update(item_ids)
+        self._wake.set()
+
+    def trigger(self, item_ids: Iterable[str] = ()) -> None:
+        """Syncs item_ids (and pending lifecycle work) as soon as possible.
+
+        Active resources are not part of the lifecycle query, so finding one walks
+        the storage system's inventory on the proxy until every given itemId was
+        seen: up to the page fetches of a full cycle, without its processing. Ids
+        triggered while a cycle runs are handled together by the next one.
+        """
+        with self._lock:
+            self._targets.update(item_ids)
+        self._wake.set()
+
+    def stop(self) -> None:
+        """Stops the loop. A running cycle finishes the resources it already took and
+        takes no new ones, so in-flight work drains without waiting for the inventory."""
+        self._stopped.set()
+        self._wake.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    # -- Cycles ------------------------------------------------------------------
+
+    def _indexed(self, resources: Iterable[Resource]) -> Iterable[Resource]:
+        if self.path_index is None:
+            return resources
+        return self._record_paths(resources)
+
+    def _record_paths(self, resources: Iterable[Resource]) -> Iterator[Resource]:
+        for res in resources:
+            if self.path_index is not None:
+                self.path_index.add(res)
+            yield res
+
+    def _update_path_index(self, complete: bool) -> None:
+        if self.path_index is None:
+            return
+        if not self.conditional:
+            self.path_index.finish_rebuild(complete)
+        elif complete:
+            # Deltas only carry changes; the cached inventory holds everything.
+            self.path_index.replace(self.client.cached_inventory())
+
+    def _owned(self, resources: Iterable[Resource]) -> Iterator[Resource]:
+        """Resources this agent holds, until the scheduler is stopped."""
+        if self._claim is not None:
+            resources = self._claim.filter(resources, self.processor.fs.filesystem_for)
+        for res in resources:
+            if self._stopped.is_set():
+                logger.info("Stopping, not taking further resources this cycle.")
+                return
+            if self.drift_index is not None:
+                self.drift_index.record(res)
+            yield res
+
+    def _select_resources(self) -> Optional[Iterable[Resource]]:
+        """Returns the resources to process in a full cycle, or None when nothing changed."""
+        if not self.conditional:
+            return self.client.iter_resources(self.storage_system)
+
+        result = self.client.poll(self.storage_system)
+        if result.full:
+            return result.resources
+        if self.processor.full_reconcile:
+            # Re-enforce the whole cached inventory, deltas are already merged into it.
+            return self.client.cached_inventory()
+        if result.changed:
+            return result.resources
+        return None
+
+    @_fenced
+    def run_full_cycle(self) -> None:
+        self.processor.begin_cycle()
+        if self.path_index is not None and not self.conditional:
+            self.path_index.begin_rebuild()
+        logger.info("Polling proxy...")
+        try:
+            resources = self._select_resources()
+            if resources is None:
+                logger.info("No changes in Waldur, skipping cycle.")
+                self.processor.end_cycle(complete=False)
+                return
+
+            # Resources are processed while later pages are still being fetched.
+            count = self.processor.process_all(self._owned(self._indexed(resources)))
+        except IncompleteInventoryError as e:
+            self._incomplete("Full", e)
+            self.processor.end_cycle(complete=False)
+            return
+        except Exception:
+            # Flush what was batched; the reconciliation is not complete.
+            self.processor.end_cycle(complete=False)
+            raise
+        logger.info(f"Processed {count} resources.")
+        # An inventory that shifted while paging, or a drained cycle, may miss resources.
+        complete = bool(self.client.last_walk_complete) and not self.stopped
+        self._update_path_index(complete)
+        self.processor.end_cycle(complete=complete)
+
+    def _incomplete(self, kind: str, error: IncompleteInventoryError) -> None:
+        # Resources received so far were handled; nothing may assume the rest is gone.
+        logger.error(f"{kind} cycle stopped on an incomplete inventory: {error}")
+
+    @contextmanager
+    def _partial_cycle(self) -> Iterator[None]:
+        """Brackets a lifecycle, triggered or drift cycle; what it batched (quotas)
+        is flushed even when it fails."""
+        self.processor.begin_cycle(full=False)
+        try:
+            yield
+        finally:
+            self.processor.end_cycle()
+
+    def _lifecycle_resources(self) -> Iterator[Resource]:
+        params = {self.status_param: ",".join(LIFECYCLE_STATUSES)}
+        stream = self.client.iter_resources(self.storage_system, params=params)
+        for res in self._owned(self._indexed(stream)):
+            # The proxy filter is an optimization; never act on unexpected statuses here.
+            if res.status in LIFECYCLE_STATUSES:
+                yield res
+
+    @_fenced
+    def run_lifecycle_cycle(self) -> None:
+        with self._partial_cycle():
+            try:
+                count = self.processor.process_all(self._lifecycle_resources())
+            except IncompleteInventoryError as e:
+                self._incomplete("Lifecycle", e)
+                return
+        if count:
+            logger.info(f"Processed {count} lifecycle resources.")
+
+    @_fenced
+    def run_targeted_cycle(self, item_ids: Set[str]) -> None:
+        logger.info(f"Triggered sync for {len(item_ids)} resources")
+        remaining = set(item_ids)
+
+        def matching(resources: Iterable[Resource]) -> Iterator[Resource]:
+            for res in resources:
+                if res.itemId in remaining:
+                    remaining.discard(res.itemId)
+                    yield res
+                    if not remaining:
+                        return
+
+        with self._partial_cycle():
+            try:
+                self.processor.process_all(matching(self._lifecycle_resources()), force=True)
+                if remaining:
+                    # Active resources are not part of the lifecycle query; the walk
+                    # stops once all of them were found (see trigger()).
+                    stream = self._owned(self.client.iter_resources(self.storage_system))
+                    self.processor.process_all(matching(stream), force=True)
+            except IncompleteInventoryError as e:
+                self._incomplete("Triggered", e)
+                return
+        if remaining:
+            logger.warning(f"Triggered resources not found: {sorted(remaining)}")
+
+    @_fenced
+    def run_drift_cycle(self, item_ids: Set[str]) -> None:
+        resources = self.drift_index.resources(item_ids) if self.drift_index else []
+        if self._claim is not None:
+            resources = list(self._claim.filter(resources, self.processor.fs.filesystem_for))
+        logger.info(f"Re-enforcing {len(resources)} resources changed out of band")
+        with self._partial_cycle():
+            self.processor.process_all(resources, force=True)
+
+    def _run_safely(self, cycle: Callable[..., None], *args: Any) -> None:
+        try:
+            cycle(*args)
+        except Exception as e:
+            logger.error(f"Sync loop error: {e}", exc_info=True)
+
+    def run(self) -> None:
+        # Intervals are added on every pass so that a reloaded config applies at once.
+        last_full = None
+        last_lifecycle = time.monotonic()
+
+        while not self._stopped.is_set():
+            with self._lock:
+                targets, self._targets = self._targets, set()
+                drifted, self._drifted = self._drifted, set()
+            self._wake.clear()
+
+            now = time.monotonic()
+            next_full = now if last_full is None else last_full + self.full_interval
+            next_lifecycle = last_lifecycle + self.lifecycle_interval
+            if now >= next_full:
+                self._run_safely(self.run_full_cycle)
+                last_full = last_lifecycle = time.monotonic()
+            elif targets:
+                self._run_safely(self.run_targeted_cycle, targets)
+                targets = set()
+            elif drifted:
+                self._run_safely(self.run_drift_cycle, drifted)
+                drifted = set()
+            elif self.lifecycle_interval and now >= next_lifecycle:
+                self._run_safely(self.run_lifecycle_cycle)
+                last_lifecycle = time.monotonic()
+
+            if targets:
+                # Triggered ids that arrived while a full cycle ran; handle them next.
+                self.trigger(targets)
+            if drifted:
+                self.reenforce(drifted)
+
+            deadline = last_full + self.full_interval
+            if self.lifecycle_interval:
+                deadline = min(deadline, last_lifecycle + self.lifecycle_interval)
+            self._wake.wait(max(0.0, deadline - time.monotonic()))
+
+
+class _TriggerHandler(BaseHTTPRequestHandler):
+    """POST /sync with {"itemIds": [...]} (or an empty body) triggers a sync.
+
+    With a token, requests must carry ``Authorization: Bearer <token>``.
+    """
+
+    scheduler: SyncScheduler
+    token: Optional[str] = None
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/sync":
+            self.send_error(404)
+            return
+        if self.token is not None:
+            supplied = self.headers.get("Authorization") or ""
+            if not hmac.compare_digest(supplied.encode(), f"Bearer {self.token}".encode()):
+                self.send_error(401)
+                return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            item_ids = [str(i) for i in body.get("itemIds", [])]
+        except (ValueError, AttributeError) as e:
+            self.send_error(400, f"Invalid request: {e}")
+            return
+
+        self.scheduler.trigger(item_ids)
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def address_string(self) -> str:
+        # Unix socket peers have no (host, port) address.
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"Trigger {self.address_string()}: {format % args}")
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TriggerServer:
+    """Local endpoint for immediate syncs, on a Unix socket or a loopback TCP port.
+
+    The Unix socket is only accessible to the agent's user. Any local user can
+    connect to the TCP port, so it needs a token that requests must present.
+    """
+
+    def __init__(
+        self,
+        scheduler: "SyncScheduler | PipelineGroup",
+        port: Optional[int] = None,
+        socket_path: Optional[str] = None,
+        host: str = "127.0.0.1",
+        token: Optional[str] = None,
+    ):
+        if not socket_path and not token:
+            raise ValueError("A trigger TCP port requires trigger_token")
+        handler = type(
+            "TriggerHandler", (_TriggerHandler,), {"scheduler": scheduler, "token": token or None}
+        )
+        self.socket_path = socket_path
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            # Created 0600, so there is no window in which others can connect.
+            umask = os.umask(0o177)
+            try:
+                self.server: socketserver.BaseServer = _UnixHTTPServer(socket_path, handler)
+            finally:
+                os.umask(umask)
+            os.chmod(socket_path, 0o600)
+            self.address = socket_path
+        else:
+            tcp = ThreadingHTTPServer((host, port or 0), handler)
+            self.server = tcp
+            self.address = f"http://{host}:{tcp.server_port}/sync"
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="sync-trigger", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+        logger.info(f"Listening for sync triggers on {self.address}")
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
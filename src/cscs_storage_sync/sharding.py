@@ -0,0 +1,286 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .models import Resource
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring: adding or removing a node only moves that node's keys."""
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64):
+        self.nodes = sorted(set(nodes))
+        ring = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._hashes = [h for h, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+def shard_key(res: Resource, filesystem: Optional[Callable[[str], object]] = None) -> str:
+    """Key a resource is placed on the ring by.
+
+    Projects sharing a GID on one filesystem share a Lustre group quota, which only
+    the agent holding all of them can merge, so they are keyed by (filesystem, GID).
+    filesystem maps a mount point to its filesystem (FilesystemDriver.filesystem_for);
+    without it the first path component is used. Other resources hash the path
+    rather than the itemId, so a path re-created under a new itemId is still handled
+    by the same agent.
+    """
+    path = (res.mountPoint or {}).get("default")
+    if path and res.target.targetType == "project" and res.target.targetItem.unixGid:
+        mount = filesystem(path) if filesystem else path.lstrip("/").split("/", 1)[0]
+        return f"quota:{mount}:{res.target.targetItem.unixGid}"
+    return path or res.itemId
+
+
+class ShardClaim:
+    """Shards an agent holds, and may touch the paths of, while the claim is open."""
+
+    def __init__(self, membership: "ShardMembership", held: FrozenSet[int]):
+        self.membership = membership
+        self.held = held
+
+    def holds(self, key: str) -> bool:
+        return self.membership.shard_of(key) in self.held
+
+    def owns(self, res: Resource, filesystem: Optional[Callable[[str], object]] = None) -> bool:
+        return self.holds(shard_key(res, filesystem))
+
+    def filter(
+        self,
+        resources: Iterable[Resource],
+        filesystem: Optional[Callable[[str], object]] = None,
+    ) -> Iterator[Resource]:
+        for res in resources:
+            if self.holds(shard_key(res, filesystem)):
+                yield res
+
+
+class ShardMembership:
+    """Splits resources across agents that share a lease directory.
+
+    Keys are hashed into ``shards`` shards, which the hash ring assigns to agents.
+    Every agent keeps ``<lease_dir>/<node>.lease`` fresh from a heartbeat thread.
+    Agents whose lease is younger than ``lease_seconds`` form the hash ring, so a
+    stopped or crashed agent's resources move to the others once its lease expires.
+    The lease directory must be on a filesystem all management nodes mount.
+
+    Ring views of agents differ for a while when members change, so the ring alone
+    does not keep two agents off a path. A lease also lists the shards its agent
+    holds, and paths are only touched within ``claim()``: an agent takes an assigned
+    shard once no live lease lists it, and lists it until no open claim uses it
+    and the ring has moved it elsewhere. A shard is thus handed over only after its
+    previous owner released it, or its lease expired.
+    """
+
+    def __init__(
+        self,
+        lease_dir: str,
+        node: Optional[str] = None,
+        lease_seconds: float = 120.0,
+        replicas: int = 64,
+        shards: int = 1024,
+    ):
+        self.lease_dir = Path(lease_dir)
+        self.node = node or socket.gethostname()
+        self.lease_seconds = lease_seconds
+        self.replicas = replicas
+        self.shards = shards
+        self._ring = HashRing([self.node], replicas)
+        self._ring_checked = 0.0
+        self._assigned: Tuple[Optional[HashRing], FrozenSet[int]] = (None, frozenset())
+        self._lock = threading.Lock()
+        # Shards listed in our lease, and the open claims using each of them.
+        self._claim_lock = threading.Lock()
+        self._held: Set[int] = set()
+        self._pins: Counter[int] = Counter()
+        self._renewed: Optional[float] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def _lease(self) -> Path:
+        return self.lease_dir / f"{self.node}.lease"
+
+    def shard_of(self, key: str) -> int:
+        return _hash(key) % self.shards
+
+    def heartbeat(self) -> None:
+        with self._claim_lock:
+            now = time.monotonic()
+            if self._renewed is not None and now - self._renewed > self.lease_seconds:
+                # Others saw our lease expire and may have taken our shards.
+                logger.warning(f"Shard lease of {self.node} expired, releasing its shards")
+                self._held.clear()
+            self._write_lease()
+            self._renewed = now
+
+    def _write_lease(self) -> None:
+        self.lease_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._lease.with_suffix(f".tmp{os.getpid()}")
+        tmp.write_text(json.dumps({"renewed": time.time(), "shards": sorted(self._held)}))
+        os.replace(tmp, self._lease)
+
+    def _live_leases(self) -> Iterator["os.DirEntry[str]"]:
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.lease_dir))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if not entry.name.endswith(".lease"):
+                continue
+            try:
+                if now - entry.stat().st_mtime <= self.lease_seconds:
+                    yield entry
+            except FileNotFoundError:
+                continue
+
+    def members(self) -> List[str]:
+        """Nodes with a live lease (by lease file mtime), always including this one."""
+        nodes = {self.node}
+        nodes.update(entry.name[: -len(".lease")] for entry in self._live_leases())
+        return sorted(nodes)
+
+    def _held_by_others(self) -> Dict[int, str]:
+        """Shard -> node, for the shards other live agents list in their lease."""
+        held: Dict[int, str] = {}
+        for entry in self._live_leases():
+            node = entry.name[: -len(".lease")]
+            if node == self.node:
+                continue
+            try:
+                with open(entry.path) as f:
+                    shards = json.load(f).get("shards", [])
+            except (OSError, ValueError, AttributeError):
+                # Gone meanwhile, or being replaced.
+                continue
+            held.update((shard, node) for shard in shards)
+        return held
+
+    def ring(self) -> HashRing:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._ring_checked >= self.lease_seconds / 4:
+                self._ring_checked = now
+                members = self.members()
+                if members != self._ring.nodes:
+                    logger.info(f"Shard members changed: {members}")
+                    self._ring = HashRing(members, self.replicas)
+            return self._ring
+
+    def assigned(self) -> FrozenSet[int]:
+        """Shards the ring currently assigns to this agent."""
+        ring = self.ring()
+        with self._lock:
+            if self._assigned[0] is not ring:
+                shards = (n for n in range(self.shards) if ring.owner(f"shard:{n}") == self.node)
+                self._assigned = (ring, frozenset(shards))
+            return self._assigned[1]
+
+    def owns(self, res: Resource, filesystem: Optional[Callable[[str], object]] = None) -> bool:
+        """Whether the ring assigns res here; only a claim allows touching its path."""
+        key = shard_key(res, filesystem)
+        return self.ring().owner(f"shard:{self.shard_of(key)}") == self.node
+
+    def filter(
+        self,
+        resources: Iterable[Resource],
+        filesystem: Optional[Callable[[str], object]] = None,
+    ) -> Iterator[Resource]:
+        ring = self.ring()
+        for res in resources:
+            shard = self.shard_of(shard_key(res, filesystem))
+            if ring.owner(f"shard:{shard}") == self.node:
+                yield res
+
+    @contextmanager
+    def claim(self, key: Optional[str] = None) -> Iterator[ShardClaim]:
+        """Holds this agent's shards (only key's shard if given) until the block ends."""
+        held = self._acquire(None if key is None else self.shard_of(key))
+        try:
+            yield ShardClaim(self, held)
+        finally:
+            with self._claim_lock:
+                self._pins.subtract(held)
+                self._release(self.assigned())
+
+    def _acquire(self, only: Optional[int]) -> FrozenSet[int]:
+        assigned = self.assigned()
+        wanted = assigned if only is None else assigned & {only}
+        with self._claim_lock:
+            if self._renewed is None or time.monotonic() - self._renewed > self.lease_seconds:
+                logger.warning(f"Shard lease of {self.node} is not fresh, holding no shards")
+                return frozenset()
+            others = self._held_by_others()
+            lost = {n for n in self._held & others.keys() if not self._pins[n]}
+            if lost:
+                # Taken over while our lease was stale.
+                logger.warning(f"Shards {sorted(lost)} are held by other agents, releasing them")
+                self._held -= lost
+            new = wanted - self._held - others.keys()
+            if new:
+                self._held |= new
+                self._write_lease()
+                # An agent with an older view of the ring may have listed some of them
+                # meanwhile. Whoever sees the other's lease backs off; the next claim
+                # retries once the views agree.
+                taken = new & self._held_by_others().keys()
+                if taken:
+                    self._held -= taken
+                    self._write_lease()
+            held = frozenset(self._held & wanted)
+            self._pins.update(held)
+            self._release(assigned)
+            return held
+
+    def _release(self, keep: FrozenSet[int]) -> None:
+        """Drops held shards the ring moved away and no open claim uses."""
+        idle = {n for n in self._held - keep if self._pins[n] <= 0}
+        if idle:
+            self._held -= idle
+            logger.info(f"Releasing {len(idle)} shards moved to other agents")
+            self._write_lease()
+
+    def start(self) -> None:
+        self.heartbeat()
+        self._thread = threading.Thread(target=self._run, name="shard-lease", daemon=True)
+        self._thread.start()
+        logger.info(f"Sharding as {self.node} with leases in {self.lease_dir}")
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.lease_seconds / 3):
+            try:
+                self.heartbeat()
+            except OSError as e:
+                logger.error(f"Failed to renew shard lease: {e}")
+
+    def stop(self) -> None:
+        """Stops the heartbeat and releases the lease so other agents take over now."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        try:
+            self._lease.unlink()
+        except FileNotFoundError:
+            pass
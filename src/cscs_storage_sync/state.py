@@ -0,0 +1,83 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+from .models import Resource
+
+logger = logging.getLogger(__name__)
+
+
+def resource_fingerprint(res: Resource, gid: int, mode: str) -> str:
+    """Hashes the resource fields that influence what is applied on disk."""
+    payload = {
+        "status": res.status,
+        "mountPoint": res.mountPoint,
+        "mode": mode,
+        "gid": gid,
+        "quotas": [[q.type, float(q.quota), q.unit, q.enforcementType] for q in res.quotas or []],
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class StateStore:
+    """Persists the fingerprint of the last successfully applied state per itemId."""
+
+    def __init__(self, state_dir: str):
+        path = Path(state_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        self.db_path = path / "state.db"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS resources ("
+                "item_id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, "
+                "applied_at REAL NOT NULL DEFAULT (strftime('%s','now')))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+        logger.info(f"Using state store at {self.db_path}")
+
+    def get(self, item_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint FROM resources WHERE item_id = ?", (item_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(self, item_id: str, fingerprint: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO resources (item_id, fingerprint) VALUES (?, ?) "
+                "ON CONFLICT(item_id) DO UPDATE SET fingerprint = excluded.fingerprint, "
+                "applied_at = strftime('%s','now')",
+                (item_id, fingerprint),
+            )
+
+    def forget(self, item_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM resources WHERE item_id = ?", (item_id,))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.RequestException):
+    """The proxy failed repeatedly; requests are refused until the breaker resets."""
+
+
+def retry_after_seconds(resp: requests.Response) -> Optional[float]:
+    """Parses a Retry-After header given in seconds or as an HTTP date."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class CircuitBreaker:
+    """Stops calling the proxy after ``threshold`` consecutive failures.
+
+    While open, requests fail immediately with CircuitOpenError. After
+    ``reset_seconds`` a single trial request is let through (half-open): success
+    closes the breaker, failure opens it again.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 5,
+        reset_seconds: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_request(self) -> None:
+        if not self.threshold:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_seconds - self.clock()
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(
+                    f"Proxy circuit open after {self._failures} failures, "
+                    f"retrying in {max(0.0, remaining):.0f}s"
+                )
+            self._trial = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Proxy recovered, closing circuit breaker.")
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        if not self.threshold:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self.threshold):
+                logger.error(
+                    f"Proxy failed {self._failures} times in a row, pausing requests "
+                    f"for {self.reset_seconds:.0f}s"
+                )
+                self._opened_at = self.clock()
+            self._trial = False
+
+
+class AdaptivePageSize:
+    """Picks the page size of the next inventory walk from observed pages.
+
+    Each page reports its item count, fetch+parse time and payload size. The size
+    that would take ``target_seconds`` and stay below ``max_bytes`` is smoothed
+    with an exponential moving average and clamped to [min_size, max_size].
+    Server errors and timeouts halve it. With min_size == max_size it is fixed.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        target_seconds: float = 2.0,
+        max_bytes: int = 8 * 1024 * 1024,
+        smoothing: float = 0.3,
+    ):
+        self.min_size = max(1, min_size or initial)
+        self.max_size = max(self.min_size, max_size or initial)
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._estimate = float(self._clamp(initial))
+
+    def _clamp(self, size: float) -> int:
+        return int(min(self.max_size, max(self.min_size, size)))
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._clamp(round(self._estimate))
+
+    def observe(self, items: int, seconds: float, nbytes: int) -> None:
+        if items <= 0 or self.min_size == self.max_size:
+            return
+        ideal = float(self.max_size)
+        if seconds > 0:
+            ideal = min(ideal, self.target_seconds * items / seconds)
+        if nbytes > 0:
+            ideal = min(ideal, self.max_bytes * items / nbytes)
+        with self._lock:
+            self._estimate += self.smoothing * (self._clamp(ideal) - self._estimate)
+
+    def reset(self, size: int) -> None:
+        with self._lock:
+            self._estimate = float(self._clamp(size))
+
+    def shrink(self) -> None:
+        with self._lock:
+            self._estimate = float(self._clamp(round(self._estimate) // 2))
+
+
+class TokenBucket:
+    """Limits operations to ``rate`` per second; callers sleep off what they overspend.
+
+    A rate of 0 or less disables the limit.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = clock()
+
+    def spend(self, ops: float = 1) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = self._clock()
+            # At most one second of unused budget carries over.
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= ops
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
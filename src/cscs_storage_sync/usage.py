@@ -0,0 +1,221 @@
+"""Space and inode usage reporting to Waldur.
+
+Lustre accounts usage per group and filesystem, so the usage of every resource
+is read with one bulk group quota query per filesystem (``read_group_quotas``)
+instead of a query or ``du`` per resource. Resources sharing a GID on one
+filesystem share its usage and are reported with ``shared``.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from .filesystem import FilesystemDriver
+from .throttle import TokenBucket
+
+if TYPE_CHECKING:
+    from .api_client import StorageProxyClient
+
+logger = logging.getLogger(__name__)
+
+
+class Usage(NamedTuple):
+    gid: int
+    space_kb: int
+    inodes: int
+    shared: bool = False
+
+
+class UsageCollector:
+    """Collects usage of the tracked resources and POSTs what changed to Waldur.
+
+    The processor tracks every active resource it sees. Every
+    ``usage_interval_seconds`` the usage of all of them is read and the resources
+    whose space or inode usage moved by more than ``usage_report_threshold`` (a
+    fraction of the last reported value), or that were not reported for
+    ``usage_report_max_age_seconds``, are sent to ``usage_report_url`` in batches
+    of ``usage_batch_size``, at most ``usage_requests_per_second``. A batch that
+    fails is sent again in the next round.
+    """
+
+    def __init__(
+        self,
+        fs: FilesystemDriver,
+        client: "StorageProxyClient",
+        config: Dict[str, Any],
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.fs = fs
+        self.client = client
+        self.clock = clock
+        self.limiter = TokenBucket(0)
+        self.configure(config)
+        self._lock = threading.Lock()
+        # itemId -> (filesystem, gid)
+        self._tracked: Dict[str, Tuple[Path, int]] = {}
+        # itemId -> (last reported usage, when)
+        self._reported: Dict[str, Tuple[Usage, float]] = {}
+        self._seen: Set[str] = set()
+        self._full = False
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        self.url = config.get("usage_report_url")
+        self.interval = config.get("usage_interval_seconds", 900)
+        self.threshold: float = config.get("usage_report_threshold", 0.01)
+        self.max_age = config.get("usage_report_max_age_seconds", 86400)
+        self.batch_size = max(1, config.get("usage_batch_size", 500))
+        self.limiter.rate = config.get("usage_requests_per_second", 1)
+
+    # -- Tracking (called by the processor) --------------------------------------
+
+    def begin_cycle(self, full: bool) -> None:
+        """With full, resources not tracked again before end_cycle() are dropped."""
+        with self._lock:
+            self._full = full
+            self._seen = set()
+
+    def end_cycle(self, complete: bool = True) -> None:
+        with self._lock:
+            if self._full and complete:
+                for item_id in set(self._tracked) - self._seen:
+                    self._tracked.pop(item_id, None)
+                    self._reported.pop(item_id, None)
+            self._full = False
+
+    def track(self, item_id: str, rel_path: str, gid: int) -> None:
+        key = (self.fs.filesystem_for(rel_path), gid)
+        with self._lock:
+            self._tracked[item_id] = key
+            self._seen.add(item_id)
+
+    def forget(self, item_id: str) -> None:
+        with self._lock:
+            self._tracked.pop(item_id, None)
+            self._reported.pop(item_id, None)
+
+    # -- Collection --------------------------------------------------------------
+
+    def collect(self) -> Dict[str, Usage]:
+        """Usage of every tracked resource; filesystems whose read failed are left out."""
+        with self._lock:
+            tracked = dict(self._tracked)
+        gids: Dict[Path, Set[int]] = {}
+        for mount, gid in tracked.values():
+            gids.setdefault(mount, set()).add(gid)
+
+        groups = {}
+        for mount in sorted(gids):
+            quotas = self.fs.read_group_quotas(mount, sorted(gids[mount]))
+            if quotas:
+                groups[mount] = quotas
+            else:
+                logger.warning(f"No group usage for {mount}, not reporting its resources")
+
+        sharing = Counter(tracked.values())
+        usages = {}
+        for item_id, (mount, gid) in tracked.items():
+            if mount not in groups:
+                continue
+            quota = groups[mount].get(gid)
+            usages[item_id] = Usage(
+                gid,
+                quota.space_used if quota else 0,
+                quota.inodes_used if quota else 0,
+                shared=sharing[(mount, gid)] > 1,
+            )
+        return usages
+
+    def _beyond_threshold(self, old: int, new: int) -> bool:
+        if not old:
+            return new != 0
+        return abs(new - old) > self.threshold * old
+
+    def _changed(self, item_id: str, usage: Usage, now: float) -> bool:
+        last = self._reported.get(item_id)
+        if last is None:
+            return True
+        previous, reported_at = last
+        if now - reported_at >= self.max_age:
+            return True
+        if (previous.gid, previous.shared) != (usage.gid, usage.shared):
+            return True
+        if self._beyond_threshold(previous.space_kb, usage.space_kb):
+            return True
+        return self._beyond_threshold(previous.inodes, usage.inodes)
+
+    def report(self) -> int:
+        """Collects usage and sends what changed. Returns the number of resources sent."""
+        if not self.url:
+            return 0
+        usages = self.collect()
+        now = self.clock()
+        with self._lock:
+            changed = [(i, u) for i, u in sorted(usages.items()) if self._changed(i, u, now)]
+
+        sent = 0
+        posts = 0
+        for start in range(0, len(changed), self.batch_size):
+            if self._stopped.is_set():
+                break
+            batch = changed[start : start + self.batch_size]
+            self.limiter.spend()
+            try:
+                self.client.post(self.url, self._payload(batch, now))
+            except Exception as e:
+                # The rest is sent in the next round, still counted as changed.
+                logger.error(f"Usage report failed: {e}")
+                break
+            posts += 1
+            with self._lock:
+                for item_id, usage in batch:
+                    if item_id in self._tracked:
+                        self._reported[item_id] = (usage, now)
+            sent += len(batch)
+
+        logger.info(
+            f"Usage of {len(usages)} resources collected, {len(changed)} changed, "
+            f"{sent} reported in {posts} requests"
+        )
+        return sent
+
+    @staticmethod
+    def _payload(batch: List[Tuple[str, Usage]], now: float) -> Dict[str, Any]:
+        return {
+            "collected_at": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            "usages": [
+                {
+                    "itemId": item_id,
+                    "gid": usage.gid,
+                    "space_used_kb": usage.space_kb,
+                    "inodes_used": usage.inodes,
+                    "shared": usage.shared,
+                }
+                for item_id, usage in batch
+            ],
+        }
+
+    # -- Background loop ---------------------------------------------------------
+
+    def _loop(self) -> None:
+        # A reload may set the interval to 0, which pauses reporting.
+        while not self._stopped.wait(self.interval or 60):
+            if not self.interval:
+                continue
+            try:
+                self.report()
+            except Exception as e:
+                logger.error(f"Usage collector error: {e}", exc_info=True)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._loop, name="usage", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        # Does not wait: a round in progress stops before its next request.
+        self._stopped.set()
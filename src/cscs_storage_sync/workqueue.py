@@ -0,0 +1,187 @@
+"""Priority queue of resources that are ready to be processed.
+
+Lifecycle transitions (pending, updating, removing) are requests someone waits
+for in Waldur and go before the periodic enforcement of active resources. Within
+a class, tenants/customers take turns: a resource's tenant is the resource its
+parentItemId points to (a project's customer), or the resource itself for
+tenants and customers, so one customer with thousands of projects cannot hold a
+cycle up. Each class has a deadline; once its oldest resource waited that long,
+the class is served oldest-first ahead of higher classes, so enforcement is not
+starved by a flood of lifecycle work either.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .models import Resource
+
+LIFECYCLE = "lifecycle"
+ENFORCEMENT = "enforcement"
+# Served in this order.
+PRIORITY_CLASSES = (LIFECYCLE, ENFORCEMENT)
+# Statuses that need prompt handling; everything else waits for the full cycle.
+LIFECYCLE_STATUSES = ("pending", "updating", "removing")
+DEFAULT_DEADLINES = {LIFECYCLE: 60.0, ENFORCEMENT: 3600.0}
+
+
+def priority_class(res: Resource) -> str:
+    return LIFECYCLE if res.status in LIFECYCLE_STATUSES else ENFORCEMENT
+
+
+def tenant_key(res: Resource) -> str:
+    """The tenant/customer a resource is scheduled fairly within."""
+    if res.target.targetType in ("tenant", "customer"):
+        return res.itemId
+    return res.parentItemId or res.target.targetItem.itemId
+
+
+class _Entry:
+    __slots__ = ("item", "queued_at", "taken")
+
+    def __init__(self, item: object, queued_at: float):
+        self.item = item
+        self.queued_at = queued_at
+        self.taken = False
+
+
+class _Class:
+    """Entries of one priority class: per tenant for round-robin, plus in arrival
+    order for the deadline. Entries taken through one view are skipped in the other."""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.tenants: Dict[str, Deque[_Entry]] = {}
+        self.turns: Deque[str] = deque()
+        self.arrivals: Deque[_Entry] = deque()
+        self.size = 0
+        self.waits: List[float] = []
+        self.missed = 0
+
+    def put(self, tenant: str, entry: _Entry) -> None:
+        queue = self.tenants.get(tenant)
+        if queue is None:
+            queue = self.tenants[tenant] = deque()
+            self.turns.append(tenant)
+        queue.append(entry)
+        self.arrivals.append(entry)
+        self.size += 1
+
+    def oldest(self) -> Optional[_Entry]:
+        while self.arrivals and self.arrivals[0].taken:
+            self.arrivals.popleft()
+        return self.arrivals[0] if self.arrivals else None
+
+    def next_turn(self) -> _Entry:
+        # Called with size > 0: some tenant still holds an entry that was not taken.
+        while True:
+            tenant = self.turns.popleft()
+            queue = self.tenants[tenant]
+            while queue and queue[0].taken:
+                queue.popleft()
+            if not queue:
+                del self.tenants[tenant]
+                continue
+            entry = queue.popleft()
+            if queue:
+                self.turns.append(tenant)
+            else:
+                del self.tenants[tenant]
+            return entry
+
+    def take(self, entry: _Entry, now: float) -> float:
+        entry.taken = True
+        self.size -= 1
+        waited = now - entry.queued_at
+        self.waits.append(waited)
+        if waited > self.deadline:
+            self.missed += 1
+        return waited
+
+
+class WorkQueue:
+    """Blocking queue handing resources to workers by class, tenant and deadline.
+
+    ``on_dequeue(priority, waited, late)`` is called for every item taken, e.g. to
+    feed metrics.
+    """
+
+    def __init__(
+        self,
+        deadlines: Optional[Dict[str, float]] = None,
+        on_dequeue: Optional[Callable[[str, float, bool], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+        self._classes = {name: _Class(float(deadlines[name])) for name in PRIORITY_CLASSES}
+        self.on_dequeue = on_dequeue
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self) -> int:
+        with self._cond:
+            return sum(cls.size for cls in self._classes.values())
+
+    def put(self, res: Resource, item: object) -> None:
+        """Queues item (the work for res), classified by res."""
+        with self._cond:
+            entry = _Entry(item, self.clock())
+            self._classes[priority_class(res)].put(tenant_key(res), entry)
+            self._cond.notify()
+
+    def close(self) -> None:
+        """Lets get() return None once the queue is empty; put() still works."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get(self) -> Optional[object]:
+        """Blocks until an item is available; None once closed and empty."""
+        with self._cond:
+            while not any(cls.size for cls in self._classes.values()):
+                if self._closed:
+                    return None
+                self._cond.wait()
+            now = self.clock()
+            name, entry = self._select(now)
+            cls = self._classes[name]
+            waited = cls.take(entry, now)
+        if self.on_dequeue is not None:
+            self.on_dequeue(name, waited, waited > cls.deadline)
+        return entry.item
+
+    def _select(self, now: float) -> Tuple[str, _Entry]:
+        # A class whose oldest entry is past its deadline goes first, oldest first.
+        for name, cls in self._classes.items():
+            oldest = cls.oldest()
+            if oldest is not None and now - oldest.queued_at > cls.deadline:
+                return name, oldest
+        for name, cls in self._classes.items():
+            if cls.size:
+                return name, cls.next_turn()
+        raise LookupError("empty work queue")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per class: items served, queued, and wait percentiles in seconds."""
+        result: Dict[str, Dict[str, float]] = {}
+        with self._cond:
+            for name, cls in self._classes.items():
+                waits = sorted(cls.waits)
+                result[name] = {
+                    "served": len(waits),
+                    "queued": cls.size,
+                    "missed": cls.missed,
+                    "deadline": cls.deadline,
+                    "p50": _percentile(waits, 0.5),
+                    "p99": _percentile(waits, 0.99),
+                    "max": waits[-1] if waits else 0.0,
+                }
+        return result
+
+
+def _percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
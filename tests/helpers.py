@@ -0,0 +1,32 @@
+"""Resource builders shared by the tests.
+
+Importable as ``helpers``: pytest puts this directory on sys.path for the test
+modules in it (there is no ``__init__.py``), as does ``unittest discover``.
+"""
+
+from unittest.mock import MagicMock
+
+from cscs_storage_sync.models import StorageResource
+
+
+def resource(item_id, path, status="active"):
+    """A stand-in with the attributes path based code reads."""
+    res = MagicMock()
+    res.itemId = item_id
+    res.status = status
+    res.mountPoint = {"default": path}
+    return res
+
+
+def make_resource(item_id, path=None, status="active", parent=None, target_type="project"):
+    """A parsed StorageResource, mounted at /p/<item_id> unless path is given."""
+    return StorageResource(
+        itemId=item_id,
+        status=status,
+        mountPoint={"default": path or f"/p/{item_id}"},
+        parentItemId=parent,
+        target={"targetType": target_type, "targetItem": {"itemId": f"t-{item_id}", "name": "t"}},
+        storageSystem={"itemId": "s-1", "key": "sys", "name": "Sys", "active": True},
+        storageFileSystem={"itemId": "fs-1", "key": "fs", "name": "FS", "active": True},
+        storageDataType={"itemId": "dt-1", "key": "dt", "name": "DT", "active": True},
+    )
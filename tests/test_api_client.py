@@ -0,0 +1,337 @@
+import json
+import threading
+import unittest
+from datetime import datetime
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+from urllib.parse import parse_qs, urlparse
+
+from cscs_storage_sync.api_client import IncompleteInventoryError, StorageProxyClient
+from cscs_storage_sync.throttle import AdaptivePageSize, CircuitOpenError, TokenBucket
+
+
+def make_resource(item_id):
+    return {
+        "itemId": item_id,
+        "status": "active",
+        "mountPoint": {"default": f"/capstor/{item_id}"},
+        "target": {
+            "targetType": "project",
+            "targetItem": {"itemId": f"p-{item_id}", "name": item_id, "unixGid": 2000},
+        },
+        "storageSystem": {"itemId": "s-1", "key": "capstor", "name": "Sys", "active": True},
+        "storageFileSystem": {"itemId": "fs-1", "key": "fs", "name": "FS", "active": True},
+        "storageDataType": {"itemId": "dt-1", "key": "dt", "name": "DT", "active": True},
+    }
+
+
+def make_page(page, item_ids, total, pages, limit=2):
+    return {
+        "status": "success",
+        "resources": [make_resource(i) for i in item_ids],
+        "pagination": {
+            "current": page,
+            "limit": limit,
+            "offset": (page - 1) * limit,
+            "pages": pages,
+            "total": total,
+        },
+    }
+
+
+class TestStorageProxyClient(unittest.TestCase):
+    def setUp(self):
+        self.client = StorageProxyClient(
+            "http://proxy/api/", "proxy-token", "waldur-token", page_size=2, max_parallel_pages=3
+        )
+        self.client.session = MagicMock()
+
+    def serve(self, pages):
+        def get(url, headers=None, params=None, timeout=None):
+            resp = MagicMock()
+            resp.status_code = 200
+            resp.content = json.dumps(pages[params["page"]]).encode()
+            return resp
+
+        self.client.session.get.side_effect = get
+
+    def test_fetch_all_resources_keeps_page_order(self):
+        self.serve(
+            {
+                1: make_page(1, ["a", "b"], total=5, pages=3),
+                2: make_page(2, ["c", "d"], total=5, pages=3),
+                3: make_page(3, ["e"], total=5, pages=3),
+            }
+        )
+
+        resources = self.client.fetch_all_resources()
+
+        self.assertEqual([r.itemId for r in resources], ["a", "b", "c", "d", "e"])
+        requested = sorted(c.kwargs["params"]["page"] for c in self.client.session.get.mock_calls)
+        self.assertEqual(requested, [1, 2, 3])
+
+    def test_fetch_all_resources_drops_items_shifted_between_pages(self):
+        self.serve(
+            {
+                1: make_page(1, ["a", "b"], total=4, pages=2),
+                2: make_page(2, ["b", "c"], total=4, pages=2),
+            }
+        )
+
+        resources = self.client.fetch_all_resources()
+
+        self.assertEqual([r.itemId for r in resources], ["a", "b", "c"])
+
+    def test_send_callback_uses_shared_session(self):
+        self.client.send_callback("http://done", data={"x": 1})
+
+        self.client.session.post.assert_called_once()
+        self.assertEqual(self.client.session.post.call_args.args[0], "http://done")
+
+    def test_iter_resources_streams_pages_lazily(self):
+        pages = {
+            p: make_page(p, [f"r{2 * p}", f"r{2 * p + 1}"], total=20, pages=10)
+            for p in range(1, 11)
+        }
+        self.serve(pages)
+
+        stream = self.client.iter_resources()
+        self.assertEqual(next(stream).itemId, "r2")
+        # Nothing beyond the first page is requested before the consumer gets there.
+        self.assertEqual(self.client.session.get.call_count, 1)
+
+        rest = list(stream)
+        self.assertEqual(len(rest), 19)
+        self.assertEqual(self.client.session.get.call_count, 10)
+
+    def failing_client(self, **kwargs):
+        client = StorageProxyClient("http://proxy/api/", "p", "w", page_size=2, **kwargs)
+        client.session = MagicMock()
+        pages = {1: make_page(1, ["a", "b"], total=4, pages=2)}
+
+        def get(url, headers=None, params=None, timeout=None):
+            resp = MagicMock(headers={}, url=url)
+            if params["page"] in pages:
+                resp.status_code = 200
+                resp.content = json.dumps(pages[params["page"]]).encode()
+            else:
+                resp.status_code = 503
+            return resp
+
+        client.session.get.side_effect = get
+        return client
+
+    def test_failed_page_raises_instead_of_truncating(self):
+        client = self.failing_client(max_retries=1)
+
+        received = []
+        with self.assertRaises(IncompleteInventoryError) as ctx:
+            for res in client.iter_resources():
+                received.append(res.itemId)
+
+        self.assertEqual(received, ["a", "b"])
+        self.assertEqual((ctx.exception.fetched, ctx.exception.total), (2, 4))
+        self.assertFalse(client.last_walk_complete)
+
+    def test_rate_limit_waits_for_retry_after(self):
+        responses = [
+            MagicMock(status_code=429, headers={"Retry-After": "0"}),
+            MagicMock(
+                status_code=200,
+                content=json.dumps(make_page(1, ["a"], total=1, pages=1)).encode(),
+            ),
+        ]
+        self.client.session.get.side_effect = responses
+
+        self.assertEqual([r.itemId for r in self.client.iter_resources()], ["a"])
+        self.assertEqual(self.client.session.get.call_count, 2)
+        self.assertTrue(self.client.last_walk_complete)
+
+    def test_circuit_opens_after_repeated_server_errors(self):
+        client = self.failing_client(max_retries=1, breaker_threshold=1)
+        client.session.get.side_effect = lambda *a, **kw: MagicMock(status_code=500, headers={})
+
+        with self.assertRaises(IncompleteInventoryError):
+            list(client.iter_resources())
+        with self.assertRaises(IncompleteInventoryError) as ctx:
+            list(client.iter_resources())
+
+        self.assertIsInstance(ctx.exception.__cause__, CircuitOpenError)
+        self.assertEqual(client.session.get.call_count, 1)
+
+
+class TestAdaptivePageSize(unittest.TestCase):
+    def test_converges_to_target_latency_within_bounds(self):
+        pager = AdaptivePageSize(100, min_size=10, max_size=1000, target_seconds=1.0)
+        for _ in range(30):
+            pager.observe(pager.size, pager.size / 25, 1000)
+        self.assertAlmostEqual(pager.size, 25, delta=2)
+
+        for _ in range(30):
+            pager.observe(pager.size, pager.size / 1e6, 1000)
+        self.assertEqual(pager.size, 1000)
+
+        pager.shrink()
+        self.assertEqual(pager.size, 500)
+
+    def test_payload_size_caps_pages(self):
+        pager = AdaptivePageSize(100, min_size=10, max_size=1000, max_bytes=50_000)
+        for _ in range(30):
+            pager.observe(pager.size, 0.001, pager.size * 1000)
+        self.assertAlmostEqual(pager.size, 50, delta=2)
+
+    def test_walk_uses_one_page_size(self):
+        client = StorageProxyClient(
+            "http://proxy/api/", "p", "w", page_size=2, page_size_min=1, page_size_max=10
+        )
+        client.session = MagicMock()
+        sizes = []
+
+        def get(url, headers=None, params=None, timeout=None):
+            sizes.append(params["page_size"])
+            page = make_page(params["page"], [f"r{params['page']}"], total=3, pages=3)
+            return MagicMock(status_code=200, content=json.dumps(page).encode())
+
+        client.session.get.side_effect = get
+        list(client.iter_resources())
+
+        # Fast pages grow the size of the next walk, never the current one.
+        self.assertEqual(sizes, [2, 2, 2])
+        self.assertGreater(client.pager.size, 2)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_overspending_sleeps_it_off(self):
+        now = [0.0]
+        slept = []
+        bucket = TokenBucket(10, clock=lambda: now[0], sleep=slept.append)
+
+        bucket.spend(5)
+        now[0] = 10.0
+        # Unused budget carries over for at most one second.
+        bucket.spend(10)
+        bucket.spend(1)
+
+        self.assertEqual(slept, [0.5, 0.1])
+
+
+class FakeProxy:
+    """Local stand-in for the storage proxy with ETag and modified_since support.
+
+    Its clock is the inventory version: every change advances it by one second.
+    """
+
+    EPOCH = 1_700_000_000
+
+    def __init__(self):
+        self.items = {}
+        self.modified = {}
+        self.version = 0
+        self.requests = []
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def date_time_string(self, timestamp=None):
+                return formatdate(proxy.EPOCH + proxy.version, usegmt=True)
+
+            def do_GET(self):
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                proxy.requests.append((query, dict(self.headers)))
+                etag = f'"v{proxy.version}"'
+                if "modified_since" not in query and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                ids = sorted(proxy.items)
+                if "modified_since" in query:
+                    since = datetime.fromisoformat(query["modified_since"]).timestamp()
+                    ids = [i for i in ids if proxy.EPOCH + proxy.modified[i] > since]
+                page, size = int(query["page"]), int(query["page_size"])
+                chunk = ids[(page - 1) * size : page * size]
+                body = {
+                    "status": "success",
+                    "resources": [proxy.items[i] for i in chunk],
+                    "pagination": {
+                        "current": page,
+                        "limit": size,
+                        "offset": (page - 1) * size,
+                        "pages": max(1, -(-len(ids) // size)),
+                        "total": len(ids),
+                    },
+                }
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/storage-resources/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def put(self, item_id, status="active"):
+        self.version += 1
+        resource = make_resource(item_id)
+        resource["status"] = status
+        self.items[item_id] = resource
+        self.modified[item_id] = self.version
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestConditionalPolling(unittest.TestCase):
+    def setUp(self):
+        self.proxy = FakeProxy()
+        for item_id in ["a", "b", "c"]:
+            self.proxy.put(item_id)
+
+    def tearDown(self):
+        self.proxy.close()
+
+    def make_client(self, delta_param=None):
+        client = StorageProxyClient(self.proxy.url, "p", "w", page_size=2, delta_param=delta_param)
+        self.addCleanup(client.close)
+        return client
+
+    def test_full_poll_then_not_modified(self):
+        client = self.make_client()
+
+        first = client.poll()
+        self.assertTrue(first.full)
+        self.assertEqual([r.itemId for r in first.resources], ["a", "b", "c"])
+        self.assertEqual(sorted(client.inventory), ["a", "b", "c"])
+
+        second = client.poll()
+        self.assertFalse(second.changed)
+        self.assertEqual(self.proxy.requests[-1][1]["If-None-Match"], '"v3"')
+
+        self.proxy.put("d")
+        third = client.poll()
+        self.assertTrue(third.full)
+        self.assertEqual(len(list(third.resources)), 4)
+
+    def test_delta_poll_merges_into_inventory(self):
+        client = self.make_client(delta_param="modified_since")
+        list(client.poll().resources)
+        self.assertFalse(client.poll().changed)
+        self.assertIn("modified_since", self.proxy.requests[-1][0])
+
+        self.proxy.put("b", status="updating")
+        self.proxy.put("c", status="removed")
+        delta = client.poll()
+
+        self.assertTrue(delta.changed)
+        self.assertFalse(delta.full)
+        self.assertEqual([r.itemId for r in delta.resources], ["b", "c"])
+        self.assertEqual(sorted(client.inventory), ["a", "b"])
+        self.assertEqual(client.inventory["b"].status, "updating")
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+from unittest.mock import MagicMock
+
+from cscs_storage_sync.archive import ArchiveEngine
+from cscs_storage_sync.filesystem import FilesystemDriver
+from cscs_storage_sync.processors import ResourceProcessor
+
+
+class TestArchiveEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        base = Path(self.tmp.name)
+        self.fs = FilesystemDriver(str(base / "root"), debug_mode=True)
+        self.archive_root = base / "archive"
+        self.project = base / "root" / "capstor" / "proj"
+        (self.project / "sub").mkdir(parents=True)
+        (self.project / "a.txt").write_text("a" * 100)
+        (self.project / "sub" / "b.txt").write_text("b")
+        os.symlink("a.txt", self.project / "link")
+        self.completed = threading.Event()
+        self.engine = ArchiveEngine(
+            self.fs,
+            str(self.archive_root),
+            journal_dir=str(base / "journal"),
+            on_complete=lambda item_id: self.completed.set(),
+        )
+
+    def tearDown(self):
+        self.engine.close()
+        self.tmp.cleanup()
+
+    def cross_device(self):
+        # Pretend the archive is on another filesystem
+        real_stat = os.stat
+
+        def fake_stat(path, *args, **kwargs):
+            st = real_stat(path, *args, **kwargs)
+            if Path(path) == self.archive_root:
+                values = list(st)
+                values[2] = st.st_dev + 1
+                return os.stat_result(values)
+            return st
+
+        return mock.patch("cscs_storage_sync.archive.os.stat", side_effect=fake_stat)
+
+    def test_same_filesystem_is_renamed(self):
+        self.assertTrue(self.engine.archive("/capstor/proj", "item-1"))
+
+        dest = self.archive_root / "proj_archived_item-1"
+        self.assertFalse(self.project.exists())
+        self.assertEqual((dest / "sub" / "b.txt").read_text(), "b")
+
+    def test_cross_filesystem_copies_in_background(self):
+        with self.cross_device():
+            self.assertFalse(self.engine.archive("/capstor/proj", "item-1"))
+            self.assertTrue(self.engine.in_progress("item-1"))
+            self.assertTrue(self.completed.wait(5))
+            self.assertTrue(self.engine.archive("/capstor/proj", "item-1"))
+
+        dest = self.archive_root / "proj_archived_item-1"
+        self.assertFalse(self.project.exists())
+        self.assertEqual((dest / "a.txt").read_text(), "a" * 100)
+        self.assertEqual(os.readlink(dest / "link"), "a.txt")
+        self.assertFalse(self.engine.in_progress("item-1"))
+
+    def test_resumes_from_journal_without_recopying(self):
+        dest = self.archive_root / "proj_archived_item-1"
+        (dest / "sub").mkdir(parents=True)
+        # A file copied before the interruption (same size and mtime)
+        (dest / "a.txt").write_text("a" * 100)
+        st = os.stat(self.project / "a.txt")
+        os.utime(dest / "a.txt", ns=(st.st_atime_ns, st.st_mtime_ns))
+        journal = {
+            "item_id": "item-1",
+            "source": str(self.project),
+            "dest": str(dest),
+            "state": "copying",
+            "files": 1,
+            "bytes": 100,
+        }
+        self.engine.journal_dir.mkdir(parents=True)
+        (self.engine.journal_dir / "item-1.json").write_text(json.dumps(journal))
+
+        with mock.patch("shutil.copy2", wraps=shutil.copy2) as copy2:
+            self.engine.resume()
+            self.assertTrue(self.completed.wait(5))
+        copied = [Path(c.args[0]).name for c in copy2.call_args_list]
+        self.assertEqual(copied, ["b.txt"])
+        self.assertTrue(self.engine.archive("/capstor/proj", "item-1"))
+        self.assertFalse(self.project.exists())
+
+    def test_failed_job_is_reported_and_retried(self):
+        with (
+            self.cross_device(),
+            mock.patch.object(self.engine, "_copy_file", side_effect=OSError("disk full")),
+        ):
+            self.assertFalse(self.engine.archive("/capstor/proj", "item-1"))
+            self.assertTrue(self.completed.wait(5))
+            with self.assertRaises(OSError):
+                self.engine.archive("/capstor/proj", "item-1")
+
+        self.assertTrue(self.project.exists())
+        # The journal is kept, so the next call restarts the job
+        self.assertTrue(self.engine.in_progress("item-1"))
+
+
+class TestRemovingWithArchiveEngine(unittest.TestCase):
+    def test_done_is_only_reported_when_archive_completes(self):
+        client = MagicMock()
+        engine = MagicMock()
+        engine.in_progress.return_value = False
+        engine.archive.return_value = False
+        processor = ResourceProcessor(MagicMock(), client, {}, archive_engine=engine)
+        res = MagicMock(
+            itemId="item-1",
+            status="removing",
+            mountPoint={"default": "/capstor/proj"},
+            approve_by_provider_url="http://approve",
+            set_state_done_url="http://done",
+        )
+
+        processor.process(res)
+        client.send_callback.assert_called_once_with("http://approve")
+
+        # Next cycle: still running, approve is not sent again
+        engine.in_progress.return_value = True
+        processor.process(res)
+        client.send_callback.assert_called_once_with("http://approve")
+
+        engine.archive.return_value = True
+        processor.process(res)
+        client.send_callback.assert_called_with("http://done")
@@ -0,0 +1,133 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+import requests
+
+from cscs_storage_sync.api_client import StorageProxyClient
+from cscs_storage_sync.callbacks import CallbackDispatcher
+
+
+def http_error(status):
+    response = MagicMock()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+class FlakySender:
+    """Fails the first delivery of every URL listed in `fail_once`."""
+
+    def __init__(self, fail_once=(), status=503):
+        self.fail_once = set(fail_once)
+        self.status = status
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def __call__(self, url, data):
+        with self.lock:
+            if url in self.fail_once:
+                self.fail_once.discard(url)
+                raise http_error(self.status)
+            self.delivered.append(url)
+
+
+class TestCallbackDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def wait_for(self, predicate, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not predicate() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(predicate())
+
+    def test_retries_and_preserves_order_per_key(self):
+        sender = FlakySender(fail_once={"http://approve"})
+        dispatcher = CallbackDispatcher(sender, max_in_flight=4, base_delay=0.01)
+        dispatcher.start()
+
+        for url in ["http://approve", "http://options", "http://backend_id", "http://done"]:
+            dispatcher.submit("res-1", url)
+        dispatcher.submit("res-2", "http://other")
+        dispatcher.stop(timeout=5)
+
+        res1 = [u for u in sender.delivered if u != "http://other"]
+        self.assertEqual(
+            res1, ["http://approve", "http://options", "http://backend_id", "http://done"]
+        )
+        self.assertIn("http://other", sender.delivered)
+        self.assertEqual(dispatcher.pending(), 0)
+
+    def test_client_errors_are_not_retried(self):
+        sender = FlakySender(fail_once={"http://bad"}, status=400)
+        dispatcher = CallbackDispatcher(sender, base_delay=0.01)
+        dispatcher.start()
+
+        dispatcher.submit("res-1", "http://bad")
+        dispatcher.submit("res-1", "http://done")
+        dispatcher.stop(timeout=5)
+
+        self.assertEqual(sender.delivered, ["http://done"])
+
+    def test_identical_queued_callbacks_are_merged(self):
+        dispatcher = CallbackDispatcher(FlakySender(), spool_dir=self.tmp.name)
+
+        self.assertTrue(dispatcher.submit("res-1", "http://done", {"state": "ok"}))
+        self.assertFalse(dispatcher.submit("res-1", "http://done", {"state": "ok"}))
+        self.assertTrue(dispatcher.submit("res-1", "http://done", {"state": "erred"}))
+        self.assertTrue(dispatcher.submit("res-2", "http://done", {"state": "ok"}))
+
+        self.assertEqual(dispatcher.pending(), 3)
+        self.assertEqual(len(list(dispatcher.spool_dir.glob("*.json"))), 3)
+
+    def test_exhausted_callbacks_go_to_the_dead_letter_file(self):
+        def down(url, data):
+            raise http_error(503)
+
+        dispatcher = CallbackDispatcher(
+            down, spool_dir=self.tmp.name, base_delay=0.001, max_delay=0.001, max_attempts=3
+        )
+        dispatcher.start()
+        dispatcher.submit("res-1", "http://done", {"state": "ok"})
+        self.wait_for(lambda: dispatcher.pending() == 0)
+        dispatcher.stop(timeout=1)
+
+        [line] = dispatcher.dead_letter_path.read_text().splitlines()
+        record = json.loads(line)
+        self.assertEqual((record["url"], record["attempts"]), ("http://done", 3))
+        self.assertEqual(list(dispatcher.spool_dir.glob("*.json")), [])
+        # Once given up, the same callback can be queued again.
+        self.assertTrue(dispatcher.submit("res-1", "http://done", {"state": "ok"}))
+
+    def test_undelivered_callbacks_survive_restart(self):
+        first = CallbackDispatcher(FlakySender(), spool_dir=self.tmp.name)
+        first.submit("res-1", "http://approve")
+        first.submit("res-1", "http://done", {"state": "ok"})
+        first.stop(timeout=0)
+
+        sender = FlakySender()
+        second = CallbackDispatcher(sender, spool_dir=self.tmp.name)
+        self.assertEqual(second.pending(), 2)
+        second.start()
+        self.wait_for(lambda: second.pending() == 0)
+        second.stop(timeout=1)
+
+        self.assertEqual(sender.delivered, ["http://approve", "http://done"])
+        self.assertEqual(list(second.spool_dir.glob("*.json")), [])
+
+
+class TestClientDispatch(unittest.TestCase):
+    def test_send_callback_is_queued_under_resource_scope(self):
+        client = StorageProxyClient("http://proxy/", "p", "w")
+        client.dispatcher = MagicMock()
+
+        with client.callback_scope("res-1"):
+            client.send_callback("http://done")
+
+        client.dispatcher.submit.assert_called_once_with("res-1", "http://done", None)
@@ -0,0 +1,146 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from helpers import resource
+
+from cscs_storage_sync.drift import (
+    Change,
+    ChangeFeed,
+    DriftIndex,
+    DriftWatcher,
+    LustreChangelogFeed,
+    PollingFeed,
+)
+from cscs_storage_sync.filesystem import FilesystemDriver
+from cscs_storage_sync.scheduler import SyncScheduler
+
+
+class TestDriftIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = DriftIndex(FilesystemDriver("/mnt/lustre"))
+        self.index.record(resource("a", "/capstor/store/a"))
+        self.index.record(resource("b", "/capstor/store/b"))
+        self.index.record(resource("t", "/capstor/tenant"))
+
+    def test_changed_directory_maps_to_its_item(self):
+        self.assertEqual(self.index.items_for(Change(Path("/mnt/lustre/capstor/store/a"))), {"a"})
+        # Changes inside a project directory are the project's business.
+        self.assertEqual(self.index.items_for(Change(Path("/mnt/lustre/capstor/store/a/x"))), set())
+
+    def test_removed_ancestor_maps_to_everything_below(self):
+        change = Change(Path("/mnt/lustre/capstor/store"), subtree=True)
+        self.assertEqual(self.index.items_for(change), {"a", "b"})
+        change = Change(Path("/mnt/lustre/capstor/store/a/x"), subtree=True)
+        self.assertEqual(self.index.items_for(change), set())
+
+    def test_moved_and_removed_resources_are_updated(self):
+        self.index.record(resource("a", "/capstor/other/a"))
+        self.index.record(resource("b", "/capstor/store/b", status="removing"))
+
+        self.assertEqual(
+            self.index.items_for(Change(Path("/mnt/lustre/capstor/store"), subtree=True)), set()
+        )
+        self.assertEqual(self.index.items_for(Change(Path("/mnt/lustre/capstor/other/a"))), {"a"})
+        self.assertEqual(len(self.index), 2)
+
+
+class TestPollingFeed(unittest.TestCase):
+    def test_out_of_band_chmod_is_reported(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "capstor", "a"))
+            os.makedirs(os.path.join(root, "capstor", "b"))
+            index = DriftIndex(FilesystemDriver(root))
+            index.record(resource("a", "/capstor/a"))
+            index.record(resource("b", "/capstor/b"))
+            drifted = []
+            watcher = DriftWatcher(PollingFeed(index), index, drifted.append)
+
+            self.assertEqual(watcher.poll(), set())
+            os.chmod(os.path.join(root, "capstor", "a"), 0o700)
+            os.rmdir(os.path.join(root, "capstor", "b"))
+
+            self.assertEqual(watcher.poll(), {"a", "b"})
+            self.assertEqual(drifted, [{"a", "b"}])
+            self.assertEqual(watcher.poll(), set())
+
+    def test_feed_without_changes_cannot_be_created(self):
+        with self.assertRaises(TypeError):
+            type("Feed", (ChangeFeed,), {})()
+
+
+CHANGELOG = "\n".join(
+    [
+        "11 01CREAT 10:00:00.1 2026.10.01 0x0 t=[0x200000401:0x9:0x0] ef=0xf u=1000:1000 "
+        "nid=0@lo p=[0x200000401:0x1:0x0] data.bin",
+        "12 14SATTR 10:00:01.1 2026.10.01 0x44 t=[0x200000401:0x1:0x0] ef=0xf u=0:0 nid=0@lo",
+        "13 07RMDIR 10:00:02.1 2026.10.01 0x1 t=[0x200000401:0x2:0x0] ef=0xf u=0:0 "
+        "nid=0@lo p=[0x200000007:0x1:0x0] b",
+        "14 08RENME 10:00:03.1 2026.10.01 0x0 t=[0:0x0:0x0] ef=0xf u=0:0 nid=0@lo "
+        "p=[0x200000007:0x1:0x0] c2 s=[0x200000401:0x3:0x0] sp=[0x200000007:0x1:0x0] c",
+    ]
+)
+
+FIDS = {
+    "[0x200000401:0x1:0x0]": "store/a",
+    "[0x200000007:0x1:0x0]": "store",
+}
+
+
+class TestLustreChangelogFeed(unittest.TestCase):
+    def test_records_are_mapped_to_paths_and_cleared(self):
+        calls = []
+
+        def run(cmd):
+            calls.append(cmd)
+            if cmd[1] == "changelog":
+                return CHANGELOG
+            if cmd[1] == "fid2path":
+                return FIDS[cmd[3]] + "\n"
+            return ""
+
+        feed = LustreChangelogFeed(Path("/mnt/lustre/capstor"), ["capstor-MDT0000"], "cl1", run=run)
+        changes = feed.changes()
+
+        root = Path("/mnt/lustre/capstor/store")
+        self.assertEqual(
+            changes,
+            [
+                Change(root / "a"),
+                Change(root / "b", subtree=True),
+                Change(root / "c", subtree=True),
+                Change(root / "c2", subtree=True),
+            ],
+        )
+        self.assertEqual(calls[-1], ["lfs", "changelog_clear", "capstor-MDT0000", "cl1", "14"])
+        # Each FID is resolved once per batch.
+        self.assertEqual(len([c for c in calls if c[1] == "fid2path"]), 2)
+
+
+class TestDriftCycle(unittest.TestCase):
+    def test_drifted_resources_are_enforced_without_the_proxy(self):
+        index = DriftIndex(FilesystemDriver("/mnt/lustre"))
+        client = MagicMock()
+        processor = MagicMock()
+        processed = []
+
+        def process_all(resources, force=False):
+            batch = [(r.itemId, force) for r in resources]
+            processed.extend(batch)
+            return len(batch)
+
+        processor.process_all.side_effect = process_all
+        client.iter_resources.return_value = iter(
+            [resource("a", "/capstor/a"), resource("b", "/capstor/b")]
+        )
+        scheduler = SyncScheduler(client, processor, {}, drift_index=index)
+        scheduler.run_full_cycle()
+        processed.clear()
+        client.reset_mock()
+
+        scheduler.run_drift_cycle({"b"})
+
+        self.assertEqual(processed, [("b", True)])
+        client.iter_resources.assert_not_called()
@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from helpers import make_resource
+
+from cscs_storage_sync.executor import OrderedExecutor
+
+
+class TestOrderedExecutor(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.events = []
+
+    def handler(self, res):
+        with self.lock:
+            self.events.append(("start", res.itemId))
+        time.sleep(0.01)
+        with self.lock:
+            self.events.append(("end", res.itemId))
+
+    def index(self, kind, item_id):
+        return self.events.index((kind, item_id))
+
+    def test_runs_in_parallel(self):
+        resources = [make_resource(f"r{i}", f"/p/{i}") for i in range(8)]
+
+        started = time.monotonic()
+        count = OrderedExecutor(self.handler, workers=8).run(resources)
+
+        self.assertEqual(count, 8)
+        # Sequential execution would take at least 80ms
+        self.assertLess(time.monotonic() - started, 0.06)
+
+    def test_same_mount_point_is_serialized(self):
+        resources = [make_resource("a", "/p/x"), make_resource("b", "/p/x")]
+
+        OrderedExecutor(self.handler, workers=4).run(resources)
+
+        self.assertLess(self.index("end", "a"), self.index("start", "b"))
+
+    def test_children_wait_for_parent_even_if_received_first(self):
+        resources = [
+            make_resource("child-1", "/t/c/1", parent="tenant"),
+            make_resource("child-2", "/t/c/2", parent="tenant"),
+            make_resource("tenant", "/t"),
+            make_resource("other", "/o", parent="missing"),
+        ]
+
+        count = OrderedExecutor(self.handler, workers=4, max_pending=8).run(resources)
+
+        self.assertEqual(count, 4)
+        self.assertLess(self.index("end", "tenant"), self.index("start", "child-1"))
+        self.assertLess(self.index("end", "tenant"), self.index("start", "child-2"))
+        self.assertIn(("end", "other"), self.events)
+
+    def test_orphans_do_not_deadlock_pending_limit(self):
+        resources = [make_resource(f"c{i}", f"/c/{i}", parent="late") for i in range(5)]
+        resources.append(make_resource("late", "/late"))
+
+        count = OrderedExecutor(self.handler, workers=2, max_pending=2).run(resources)
+
+        self.assertEqual(count, 6)
+        self.assertEqual(len([e for e in self.events if e[0] == "end"]), 6)
+
+    def test_tasks_behind_an_orphan_do_not_deadlock_pending_limit(self):
+        # b waits on a (same path), a on a parent that only arrives after the limit.
+        resources = [
+            make_resource("a", "/p", parent="x"),
+            make_resource("b", "/p"),
+            make_resource("c", "/c"),
+            make_resource("x", "/x"),
+        ]
+        result = []
+        runner = threading.Thread(
+            target=lambda: result.append(
+                OrderedExecutor(self.handler, workers=2, max_pending=2).run(resources)
+            ),
+            daemon=True,
+        )
+        runner.start()
+        runner.join(timeout=5)
+
+        self.assertEqual(result, [4])
+        self.assertLess(self.index("end", "a"), self.index("start", "b"))
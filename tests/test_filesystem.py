@@ -0,0 +1,98 @@
+import os
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from cscs_storage_sync.filesystem import FilesystemDriver
+
+
+class TestEnsureDirectory(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        # debug_mode skips chown so the tests also run unprivileged
+        self.fs = FilesystemDriver(self.tmp.name, debug_mode=True, dir_scan_threshold=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def count_stats(self):
+        return mock.patch("os.stat", side_effect=os.stat)
+
+    def test_creates_directory_with_mode(self):
+        self.fs.ensure_directory("/capstor/p1", 0, "2770")
+
+        path = self.root / "capstor" / "p1"
+        self.assertTrue(path.is_dir())
+        self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o2770)
+
+    def test_setgid_mode_is_not_reapplied(self):
+        self.fs.ensure_directory("/capstor/p1", 0, "2770")
+
+        with mock.patch.object(self.fs, "_chmod") as chmod:
+            self.fs.ensure_directory("/capstor/p1", 0, "2770")
+        chmod.assert_not_called()
+
+    def test_three_digit_mode_keeps_special_bits(self):
+        self.fs.ensure_directory("/capstor/p1", 0, "770")
+        path = self.root / "capstor" / "p1"
+        os.chmod(path, 0o2770)
+
+        with mock.patch.object(self.fs, "_chmod") as chmod:
+            self.fs.ensure_directory("/capstor/p1", 0, "770")
+        chmod.assert_not_called()
+
+        os.chmod(path, 0o2777)
+        self.fs.ensure_directory("/capstor/p1", 0, "770")
+        self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o2770)
+
+    def test_existing_directory_costs_one_stat(self):
+        self.fs.ensure_directory("/capstor/p1", 0, "770")
+
+        with self.count_stats() as stat_call:
+            self.fs.ensure_directory("/capstor/p1", 0, "770")
+        self.assertEqual(stat_call.call_count, 1)
+
+    def test_external_change_is_detected(self):
+        self.fs.ensure_directory("/capstor/p1", 0, "770")
+        os.chmod(self.root / "capstor" / "p1", 0o777)
+
+        self.fs.ensure_directory("/capstor/p1", 0, "770")
+        self.assertEqual(stat.S_IMODE((self.root / "capstor" / "p1").stat().st_mode), 0o770)
+
+    def test_parent_scan_replaces_per_directory_stats(self):
+        for i in range(10):
+            self.fs.ensure_directory(f"/capstor/p{i}", 0, "770")
+
+        self.fs.begin_cycle()
+        with self.count_stats() as stat_call:
+            for i in range(10):
+                self.fs.ensure_directory(f"/capstor/p{i}", 0, "770")
+            # Missing siblings are known from the listing and created without a lookup stat
+            self.fs.ensure_directory("/capstor/new", 0, "770")
+        self.fs.end_cycle()
+
+        # Two lookups before the third one triggers the scan, plus one stat after mkdir
+        self.assertEqual(stat_call.call_count, 3)
+        self.assertTrue((self.root / "capstor" / "new").is_dir())
+
+    def test_scan_results_are_not_trusted_after_the_cycle(self):
+        self.fs.begin_cycle()
+        for i in range(5):
+            self.fs.ensure_directory(f"/capstor/p{i}", 0, "770")
+        self.fs.end_cycle()
+        os.chmod(self.root / "capstor" / "p4", 0o700)
+
+        self.fs.ensure_directory("/capstor/p4", 0, "770")
+        self.assertEqual(stat.S_IMODE((self.root / "capstor" / "p4").stat().st_mode), 0o770)
+
+
+class TestMountPrefix(unittest.TestCase):
+    def test_system_prefix_is_resolved_against_the_system_root(self):
+        fs = FilesystemDriver("/mnt/lustre/capstor-fs", mount_prefix="capstor")
+
+        self.assertEqual(fs.resolve("/capstor/store/p1"), Path("/mnt/lustre/capstor-fs/store/p1"))
+        self.assertEqual(fs.resolve("/capstorage/p1"), Path("/mnt/lustre/capstor-fs/capstorage/p1"))
+        self.assertEqual(fs.filesystem_for("/capstor/store/p1"), Path("/mnt/lustre/capstor-fs"))
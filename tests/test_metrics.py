@@ -0,0 +1,146 @@
+import tempfile
+import unittest
+import urllib.request
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from cscs_storage_sync.metrics import Counter, Histogram, MetricsServer, SyncMetrics
+
+
+class TestMetricTypes(unittest.TestCase):
+    def test_counter_renders_labels(self):
+        counter = Counter("things_total", "Things.", ["kind"])
+        counter.inc(kind="a")
+        counter.inc(2, kind='b"c')
+
+        lines = counter.render()
+        self.assertIn("# TYPE things_total counter", lines)
+        self.assertIn('things_total{kind="a"} 1', lines)
+        self.assertIn('things_total{kind="b\\"c"} 2', lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        hist = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+        hist.observe(0.05)
+        hist.observe(0.5)
+        hist.observe(5)
+
+        lines = hist.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn("latency_seconds_count 3", lines)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.metrics = SyncMetrics()
+
+    def test_fs_actions_and_errors_are_counted(self):
+        fs = MagicMock()
+        fs.apply_quota_limits.side_effect = RuntimeError("lfs failed")
+        self.metrics.instrument_fs(fs)
+
+        fs._mkdir("/x")
+        fs._chmod("/x", 0o770)
+        with self.assertRaises(RuntimeError):
+            fs.apply_quota_limits("/x", 1000, None)
+
+        self.assertEqual(self.metrics.actions.value(action="mkdir"), 1)
+        self.assertEqual(self.metrics.actions.value(action="chmod"), 1)
+        self.assertEqual(self.metrics.actions.value(action="setquota"), 0)
+        self.assertEqual(self.metrics.errors.value(type="RuntimeError", phase="setquota"), 1)
+
+    def test_cycle_records_phase_totals_and_writes_textfile(self):
+        client = MagicMock()
+        scheduler = MagicMock()
+        self.metrics.instrument_client(client)
+
+        def cycle():
+            client._get_page(1)
+            client._get_page(2)
+            client._post_callback("http://cb", None)
+
+        scheduler.run_full_cycle.side_effect = cycle
+        self.metrics.instrument_scheduler(scheduler)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.metrics.textfile = Path(tmp) / "sync.prom"
+            scheduler.run_full_cycle()
+            text = self.metrics.textfile.read_text()
+
+        self.assertEqual(self.metrics.cycle_duration.count(kind="full"), 1)
+        self.assertEqual(self.metrics.phase_duration.count(phase="fetch"), 1)
+        self.assertEqual(self.metrics.phase_duration.count(phase="callback"), 1)
+        self.assertEqual(self.metrics.callback_latency.count(), 1)
+        self.assertIn('cscs_sync_cycle_duration_seconds_count{system="",kind="full"} 1', text)
+
+    def test_concurrent_cycles_of_pipelines_keep_their_own_phases(self):
+        capstor, vast = MagicMock(), MagicMock()
+        capstor_fs, vast_fs = MagicMock(), MagicMock()
+        self.metrics.instrument_fs(capstor_fs, "capstor")
+        self.metrics.instrument_fs(vast_fs, "vast")
+
+        def vast_cycle(item_ids):
+            vast_fs.ensure_directory("/vast/p", 1000, "770")
+
+        def capstor_cycle():
+            capstor_fs.apply_quota_limits("/capstor/p", 1000, None)
+            # A drift cycle of another pipeline starts and ends meanwhile.
+            vast.run_drift_cycle({"i-1"})
+            capstor_fs.ensure_directory("/capstor/p", 1000, "770")
+
+        capstor.run_full_cycle.side_effect = capstor_cycle
+        vast.run_drift_cycle.side_effect = vast_cycle
+        self.metrics.instrument_scheduler(capstor, "capstor")
+        self.metrics.instrument_scheduler(vast, "vast")
+        capstor.run_full_cycle()
+
+        phases = self.metrics.phase_duration
+        self.assertEqual(phases.count(system="capstor", phase="setquota"), 1)
+        self.assertEqual(phases.count(system="capstor", phase="ensure_directory"), 1)
+        self.assertEqual(phases.count(system="vast", phase="ensure_directory"), 1)
+        self.assertEqual(phases.count(system="vast", phase="setquota"), 0)
+        self.assertEqual(self.metrics.cycle_duration.count(system="vast", kind="drift"), 1)
+        self.assertIn(
+            'cscs_sync_cycle_duration_seconds_count{system="capstor",kind="full"} 1',
+            self.metrics.render(),
+        )
+
+    def test_processor_counts_statuses_and_handler_errors(self):
+        processor = MagicMock()
+        processor._handle_removing.side_effect = OSError("busy")
+        self.metrics.instrument_processor(processor)
+
+        res = MagicMock(status="removing")
+        processor.process(res)
+        with self.assertRaises(OSError):
+            processor._handle_removing(res)
+
+        self.assertEqual(self.metrics.resources.value(status="removing"), 1)
+        self.assertEqual(self.metrics.errors.value(type="OSError", phase="process_removing"), 1)
+
+    def test_queue_waits_are_observed_per_priority(self):
+        processor = MagicMock()
+        self.metrics.instrument_processor(processor)
+
+        processor._dequeued("lifecycle", 0.5, False)
+        processor._dequeued("enforcement", 4000.0, True)
+
+        self.assertEqual(self.metrics.queue_wait.count(priority="lifecycle"), 1)
+        self.assertEqual(self.metrics.queue_deadline_misses.value(priority="enforcement"), 1)
+        self.assertEqual(self.metrics.queue_deadline_misses.value(priority="lifecycle"), 0)
+
+
+class TestMetricsServer(unittest.TestCase):
+    def test_serves_metrics(self):
+        metrics = SyncMetrics()
+        metrics.resources.inc(status="active")
+        server = MetricsServer(metrics, port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(server.address, timeout=5) as resp:
+                body = resp.read().decode()
+        finally:
+            server.close()
+
+        self.assertIn('cscs_sync_resources_total{status="active"} 1', body)
@@ -0,0 +1,62 @@
+import json
+import unittest
+
+from pydantic import ValidationError
+
+from cscs_storage_sync.models import ResourceRecord, StorageResource, parse_page
+
+
+def make_raw(item_id, status):
+    return {
+        "itemId": item_id,
+        "status": status,
+        "mountPoint": {"default": f"/capstor/{item_id}"},
+        "permission": {"permissionType": "octal", "value": "770"},
+        "quotas": [{"type": "space", "quota": 1, "unit": "TB", "enforcementType": "hard"}],
+        "target": {
+            "targetType": "project",
+            "targetItem": {"itemId": "p-1", "name": "proj", "unixGid": 2000},
+        },
+        "storageSystem": {"itemId": "s-1", "key": "capstor", "name": "Sys", "active": True},
+        "storageFileSystem": {"itemId": "fs-1", "key": "fs", "name": "FS", "active": True},
+        "storageDataType": {"itemId": "dt-1", "key": "dt", "name": "DT", "active": True},
+        "set_state_erred_url": "http://erred",
+    }
+
+
+def make_page(resources):
+    return json.dumps({"status": "success", "resources": resources}).encode()
+
+
+class TestParsePage(unittest.TestCase):
+    def test_actionable_resources_are_fully_validated(self):
+        page = parse_page(make_page([make_raw("a", "pending"), make_raw("b", "active")]))
+
+        self.assertIsInstance(page.resources[0], StorageResource)
+        self.assertIsInstance(page.resources[1], ResourceRecord)
+
+    def test_record_exposes_hot_and_lazy_fields(self):
+        record = parse_page(make_page([make_raw("b", "active")])).resources[0]
+
+        self.assertEqual(record.target.targetItem.unixGid, 2000)
+        self.assertEqual(record.permission.value, "770")
+        self.assertEqual(record.quotas[0].quota, 1)
+        # Falls back to full validation for fields outside the hot set
+        self.assertEqual(record.storageSystem.key, "capstor")
+        self.assertEqual(record.set_state_erred_url, "http://erred")
+
+    def test_invalid_actionable_resource_fails_page(self):
+        raw = make_raw("a", "pending")
+        del raw["storageSystem"]
+
+        with self.assertRaises(ValidationError):
+            parse_page(make_page([raw]))
+
+    def test_record_falls_back_to_pydantic_for_loose_types(self):
+        raw = make_raw("b", "active")
+        raw["target"]["targetItem"]["unixGid"] = "2000"
+
+        resource = parse_page(make_page([raw])).resources[0]
+
+        self.assertIsInstance(resource, StorageResource)
+        self.assertEqual(resource.target.targetItem.unixGid, 2000)
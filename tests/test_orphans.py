@@ -0,0 +1,196 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+from unittest.mock import MagicMock
+
+from helpers import resource
+
+from cscs_storage_sync.archive import ArchiveEngine
+from cscs_storage_sync.filesystem import FilesystemDriver
+from cscs_storage_sync.orphans import ManagedPathIndex, OrphanScanner, orphan_job_id
+from cscs_storage_sync.scheduler import SyncScheduler
+
+
+class TestOrphanScanner(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name) / "root"
+        self.archive = Path(self.tmp.name) / "archive"
+        for rel in (
+            "capstor/store/a/data",
+            "capstor/store/b",
+            "capstor/store/stale/data",
+            "capstor/scratch/x",
+            "capstor/tenant",
+        ):
+            (self.root / rel).mkdir(parents=True)
+
+        self.fs = FilesystemDriver(str(self.root))
+        self.index = ManagedPathIndex(self.fs)
+        self.index.replace(
+            [
+                resource("a", "/capstor/store/a"),
+                resource("b", "/capstor/store/b"),
+                resource("t", "/capstor/tenant"),
+                resource("gone", "/capstor/store/stale", status="removed"),
+            ]
+        )
+        self.config = {
+            "archive_dir": str(self.archive),
+            "orphan_min_age_seconds": 0,
+            "orphan_scan_ops_per_second": 0,
+        }
+        self.journal = Path(self.tmp.name) / "journal"
+        self.completed = threading.Event()
+        self.engine = ArchiveEngine(
+            self.fs,
+            str(self.archive),
+            journal_dir=str(self.journal),
+            on_complete=lambda item_id: self.completed.set(),
+        )
+        self.addCleanup(self.engine.close)
+
+    def scanner(self, **config):
+        report_path = os.path.join(self.tmp.name, "orphans.json")
+        return OrphanScanner(
+            self.fs,
+            self.index,
+            {**self.config, **config},
+            archive_engine=self.engine,
+            report_path=report_path,
+        )
+
+    def test_unmanaged_directories_next_to_managed_ones_are_reported(self):
+        report = self.scanner().scan()
+
+        # scratch is next to managed "tenant"; nothing below managed leaves is listed.
+        self.assertEqual(
+            report.orphans,
+            [self.root / "capstor/scratch", self.root / "capstor/store/stale"],
+        )
+        self.assertEqual(report.directories_listed, 3)
+        written = json.loads(Path(self.tmp.name, "orphans.json").read_text())
+        self.assertEqual(len(written["orphans"]), 2)
+
+    def test_directories_below_managed_tenants_and_customers_are_scanned(self):
+        tenant = self.root / "capstor/tenant"
+        for rel in ("cust/projA/data", "cust/stale_proj", "stale_cust"):
+            (tenant / rel).mkdir(parents=True)
+        self.index.replace(
+            [
+                resource("t", "/capstor/tenant"),
+                resource("c", "/capstor/tenant/cust"),
+                resource("p", "/capstor/tenant/cust/projA"),
+            ]
+        )
+
+        report = self.scanner(orphan_scan_exclude=["/capstor/store", "/capstor/scratch"]).scan()
+
+        self.assertEqual(report.orphans, [tenant / "cust/stale_proj", tenant / "stale_cust"])
+        # root, capstor, tenant and cust; nothing below the project.
+        self.assertEqual(report.directories_listed, 4)
+
+    def test_recently_changed_directories_are_left_alone(self):
+        report = self.scanner(orphan_min_age_seconds=3600).scan()
+
+        self.assertEqual(report.orphans, [])
+
+    def test_no_scan_without_a_complete_index(self):
+        index = ManagedPathIndex(self.fs)
+        index.add(resource("a", "/capstor/store/a"))
+
+        self.assertIsNone(OrphanScanner(self.fs, index, self.config).scan())
+
+    def test_orphans_are_archived_and_expired_archives_purged(self):
+        self.archive.mkdir()
+        (self.archive / "old_archived_i-1").mkdir()
+        (self.archive / "busy_archived_i-2").mkdir()
+        self.journal.mkdir()
+        (self.journal / "i-2.json").write_text(json.dumps({"item_id": "i-2", "state": "copying"}))
+        scanner = self.scanner(
+            orphan_action="archive",
+            orphan_archive_retention_days=1e-9,
+            orphan_purge_archives=True,
+            orphan_scan_exclude=["/capstor/scratch"],
+        )
+
+        report = scanner.scan()
+
+        self.assertEqual(report.archived, [self.root / "capstor/store/stale"])
+        self.assertFalse((self.root / "capstor/store/stale").exists())
+        self.assertTrue((self.root / "capstor/scratch").exists())
+        self.assertEqual(report.purged, [self.archive / "old_archived_i-1"])
+        self.assertTrue((self.archive / "busy_archived_i-2").exists())
+        stale = self.root / "capstor/store/stale"
+        archived = self.archive / f"stale_archived_{orphan_job_id(stale)}"
+        self.assertTrue((archived / "data").is_dir())
+
+    def test_orphans_on_another_filesystem_are_copied_in_the_background(self):
+        (self.root / "capstor/store/stale/data/f").write_text("x")
+        real_stat = os.stat
+
+        def cross_device(path, *args, **kwargs):
+            st = real_stat(path, *args, **kwargs)
+            if Path(path) == self.archive:
+                values = list(st)
+                values[2] = st.st_dev + 1
+                return os.stat_result(values)
+            return st
+
+        scanner = self.scanner(orphan_action="archive", orphan_scan_exclude=["/capstor/scratch"])
+        stale = self.root / "capstor/store/stale"
+        with mock.patch("cscs_storage_sync.archive.os.stat", side_effect=cross_device):
+            report = scanner.scan()
+            self.assertEqual(report.archiving, [stale])
+            self.assertEqual(report.archived, [])
+            self.assertTrue(self.completed.wait(5))
+
+        # The next scan collects the finished job.
+        report = scanner.scan()
+
+        self.assertEqual((report.orphans, report.archived), ([], [stale]))
+        archived = self.archive / f"stale_archived_{orphan_job_id(stale)}"
+        self.assertEqual((archived / "data" / "f").read_text(), "x")
+        self.assertEqual(self.engine.journaled(), {})
+
+
+class TestPathIndexUpdates(unittest.TestCase):
+    def setUp(self):
+        self.index = ManagedPathIndex(FilesystemDriver("/mnt/lustre"))
+        self.client = MagicMock()
+        self.processor = MagicMock()
+        self.processor.process_all.side_effect = lambda resources, force=False: len(list(resources))
+        claim = MagicMock()
+        claim.filter.side_effect = lambda resources, filesystem=None: (
+            r for r in resources if r.itemId != "b"
+        )
+        shard = MagicMock()
+        shard.claim.return_value.__enter__.return_value = claim
+        self.scheduler = SyncScheduler(
+            self.client, self.processor, {}, shard=shard, path_index=self.index
+        )
+
+    def test_complete_walk_indexes_all_shards(self):
+        self.client.iter_resources.return_value = iter(
+            [resource("a", "/capstor/a"), resource("b", "/capstor/b")]
+        )
+        self.client.last_walk_complete = True
+        self.scheduler.run_full_cycle()
+
+        self.assertTrue(self.index.ready)
+        self.assertEqual(
+            self.index.paths(), {Path("/mnt/lustre/capstor/a"), Path("/mnt/lustre/capstor/b")}
+        )
+
+    def test_incomplete_walk_keeps_the_previous_index(self):
+        self.index.replace([resource("a", "/capstor/a"), resource("b", "/capstor/b")])
+        self.client.iter_resources.return_value = iter([resource("a", "/capstor/a")])
+        self.client.last_walk_complete = False
+        self.scheduler.run_full_cycle()
+
+        self.assertEqual(len(self.index), 2)
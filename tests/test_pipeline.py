@@ -0,0 +1,167 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import yaml
+
+from cscs_storage_sync.main import reload_config
+from cscs_storage_sync.models import QuotaItem, parse_resource
+from cscs_storage_sync.pipeline import SNAPSHOT_FILE, PipelineGroup, SyncPipeline, build_pipelines
+
+
+def raw_resource(item_id):
+    return {
+        "itemId": item_id,
+        "status": "active",
+        "mountPoint": {"default": f"/capstor/{item_id}"},
+        "target": {
+            "targetType": "project",
+            "targetItem": {"itemId": f"p-{item_id}", "name": item_id, "unixGid": 2000},
+        },
+        "storageSystem": {"itemId": "s-1", "key": "capstor", "name": "Sys", "active": True},
+        "storageFileSystem": {"itemId": "fs-1", "key": "fs", "name": "FS", "active": True},
+        "storageDataType": {"itemId": "dt-1", "key": "dt", "name": "DT", "active": True},
+    }
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = {
+            "proxy_url": "http://proxy/api/",
+            "api_token": "p",
+            "waldur_api_token": "w",
+            "storage_root": self.tmp.name,
+            "state_dir": os.path.join(self.tmp.name, "state"),
+            "archive_dir": os.path.join(self.tmp.name, "archive"),
+            "callback_async": False,
+            "quota_batching": True,
+            "dry_run": True,
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+class TestWarmStart(PipelineTestCase):
+    def stopped_pipeline(self):
+        pipeline = SyncPipeline(self.config)
+        # As after a scheduler loop that returned.
+        pipeline._thread = threading.Thread(target=lambda: None)
+        pipeline._thread.start()
+        pipeline._thread.join()
+        return pipeline
+
+    def test_caches_survive_a_clean_restart(self):
+        pipeline = self.stopped_pipeline()
+        pipeline.client.inventory = {"a": parse_resource(raw_resource("a"))}
+        pipeline.client._etag = '"v7"'
+        pipeline.quota_engine.begin_cycle(full=True)
+        pipeline.quota_engine.stage(
+            "/capstor/a",
+            2000,
+            [QuotaItem(type="space", quota=1, unit="TB", enforcementType="hard")],
+            item_id="a",
+        )
+        pipeline.quota_engine.apply()
+        pipeline.close()
+
+        restarted = SyncPipeline(self.config)
+        self.addCleanup(restarted.close)
+        self.assertTrue(restarted.load_snapshot())
+
+        self.assertEqual(list(restarted.client.inventory), ["a"])
+        self.assertEqual(restarted.client._etag, '"v7"')
+        self.assertTrue(restarted.quota_engine.primed)
+        self.assertEqual(restarted.quota_engine.snapshot(), pipeline.quota_engine.snapshot())
+        # Read once: a crash after this start begins cold again.
+        self.assertFalse(os.path.exists(os.path.join(self.config["state_dir"], SNAPSHOT_FILE)))
+
+    def test_stale_snapshot_is_ignored(self):
+        self.stopped_pipeline().close()
+        self.config["warm_start_max_age_seconds"] = -1
+
+        restarted = SyncPipeline(self.config)
+        self.addCleanup(restarted.close)
+
+        self.assertFalse(restarted.load_snapshot())
+        self.assertFalse(restarted.quota_engine.primed)
+
+    def test_no_snapshot_while_a_cycle_runs(self):
+        pipeline = SyncPipeline(self.config)
+        release = threading.Event()
+        pipeline._thread = threading.Thread(target=release.wait)
+        pipeline._thread.start()
+        pipeline.close()
+        release.set()
+
+        self.assertFalse(os.path.exists(os.path.join(self.config["state_dir"], SNAPSHOT_FILE)))
+
+
+class TestReload(PipelineTestCase):
+    def test_pipelines_are_reconfigured_in_place(self):
+        self.config["system_mappings"] = {"capstor": "capstor"}
+        group = build_pipelines(self.config)
+        self.addCleanup(group.close)
+        capstor = group.pipelines[0]
+        client = capstor.client
+
+        group.reload(
+            {
+                **self.config,
+                "workers": 3,
+                "min_gid_allowed": 5000,
+                "sync_interval_seconds": 10,
+                "system_mappings": {"capstor": "capstor", "vast": "vast"},
+            }
+        )
+
+        self.assertEqual([p.name for p in group.pipelines], ["capstor", "vast"])
+        self.assertIs(group.pipelines[0], capstor)
+        self.assertIs(capstor.client, client)
+        self.assertEqual(capstor.processor.workers, 3)
+        self.assertEqual(capstor.processor.min_gid, 5000)
+        self.assertEqual(capstor.scheduler.full_interval, 10)
+
+    def test_remapped_system_gets_a_new_pipeline(self):
+        self.config["system_mappings"] = {"capstor": "capstor"}
+        group = build_pipelines(self.config)
+        self.addCleanup(group.close)
+        old = group.pipelines[0]
+
+        group.reload({**self.config, "system_mappings": {"capstor": "capstor2"}})
+
+        self.assertIsNot(group.pipelines[0], old)
+        self.assertTrue(str(group.pipelines[0].fs.root_path).endswith("capstor2"))
+
+    def test_retired_pipeline_is_closed_before_its_replacement_is_built(self):
+        self.config["system_mappings"] = {"capstor": "capstor"}
+        group = build_pipelines(self.config)
+        self.addCleanup(group.close)
+        old = group.pipelines[0]
+        events = []
+        close = old.close
+        old.close = lambda: (events.append("close"), close())
+
+        def replacement(*args, **kwargs):
+            events.append("new")
+            return SyncPipeline(*args, **kwargs)
+
+        with patch("cscs_storage_sync.pipeline.SyncPipeline", side_effect=replacement):
+            group.reload({**self.config, "system_mappings": {"capstor": "capstor2"}})
+
+        self.assertEqual(events, ["close", "new"])
+
+    def test_restart_only_keys_are_kept(self):
+        path = os.path.join(self.tmp.name, "config.yaml")
+        with open(path, "w") as f:
+            yaml.safe_dump({**self.config, "proxy_url": "http://other/", "workers": 4}, f)
+        pipelines = MagicMock(spec=PipelineGroup)
+
+        config = reload_config(pipelines, self.config, path)
+
+        self.assertEqual(config["proxy_url"], "http://proxy/api/")
+        self.assertEqual(config["workers"], 4)
+        pipelines.reload.assert_called_once_with(config)
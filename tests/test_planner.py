@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from cscs_storage_sync.planner import (
+    DEFAULT_COSTS,
+    FilesystemSnapshot,
+    load_proxy_snapshot,
+    plan_cycle,
+)
+from cscs_storage_sync.quota import QuotaLimits
+
+
+def raw_resource(item_id, status, path, gid=2000, mode="2770"):
+    return {
+        "itemId": item_id,
+        "status": status,
+        "mountPoint": {"default": path},
+        "permission": {"permissionType": "octal", "value": mode},
+        "quotas": [{"type": "space", "quota": 1.0, "unit": "TB", "enforcementType": "hard"}],
+        "target": {
+            "targetType": "project",
+            "targetItem": {"itemId": f"p-{item_id}", "name": "proj", "unixGid": gid},
+        },
+        "storageSystem": {"itemId": "s", "key": "capstor", "name": "capstor", "active": True},
+        "storageFileSystem": {"itemId": "f", "key": "lustre", "name": "Lustre", "active": True},
+        "storageDataType": {"itemId": "d", "key": "store", "name": "Store", "active": True},
+        "approve_by_provider_url": f"http://waldur/{item_id}/approve",
+        "set_state_done_url": f"http://waldur/{item_id}/done",
+    }
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = {"storage_root": "/mnt/lustre", "archive_dir": "/mnt/archive"}
+        page = {
+            "status": "success",
+            "resources": [
+                raw_resource("ok", "active", "/capstor/store/ok"),
+                raw_resource("mode", "active", "/capstor/store/mode"),
+                raw_resource("new", "pending", "/capstor/store/new"),
+                raw_resource("gone", "removing", "/capstor/store/gone"),
+            ],
+        }
+        self.proxy = os.path.join(self.tmp.name, "proxy.json")
+        Path(self.proxy).write_text(json.dumps([page]))
+        hard = QuotaLimits(block_hard=1024**3)
+        self.snapshot = FilesystemSnapshot(
+            {
+                "/mnt/lustre/capstor/store": (0, 0, 0o755, 1),
+                "/mnt/lustre/capstor/store/ok": (0, 2000, 0o2770, 1),
+                "/mnt/lustre/capstor/store/mode": (0, 2000, 0o770, 1),
+                "/mnt/lustre/capstor/store/gone": (0, 2000, 0o2770, 1),
+            },
+            {"/mnt/lustre/capstor": {2000: hard}},
+            archive_dev=2,
+        )
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_plan_contains_only_the_diff(self):
+        plan = plan_cycle(self.config, load_proxy_snapshot(self.proxy), self.snapshot)
+        actions = {(a["action"], a.get("path")) for a in plan.actions}
+
+        self.assertIn(("chmod", "/mnt/lustre/capstor/store/mode"), actions)
+        self.assertIn(("mkdir", "/mnt/lustre/capstor/store/new"), actions)
+        self.assertIn(("chown", "/mnt/lustre/capstor/store/new"), actions)
+        self.assertIn(("archive_copy", "/mnt/lustre/capstor/store/gone"), actions)
+        self.assertFalse(
+            [a for a in plan.actions if a.get("path") == "/mnt/lustre/capstor/store/ok"]
+        )
+        # Active quotas already match the snapshot
+        self.assertFalse(
+            [a for a in plan.actions if a["action"] == "setquota" and a["item_id"] != "new"]
+        )
+
+    def test_callbacks_are_recorded_per_resource(self):
+        plan = plan_cycle(self.config, load_proxy_snapshot(self.proxy), self.snapshot)
+        callbacks = [(a["item_id"], a["url"]) for a in plan.actions if a["action"] == "callback"]
+
+        self.assertIn(("new", "http://waldur/new/approve"), callbacks)
+        self.assertIn(("new", "http://waldur/new/done"), callbacks)
+        self.assertIn(("gone", "http://waldur/gone/done"), callbacks)
+
+    def test_summary_counts_and_costs(self):
+        plan = plan_cycle(
+            self.config, load_proxy_snapshot(self.proxy), self.snapshot, record_actions=False
+        )
+        summary = plan.to_dict(DEFAULT_COSTS)
+
+        self.assertEqual(summary["resources"], 4)
+        self.assertEqual(summary["by_status"], {"active": 2, "pending": 1, "removing": 1})
+        self.assertEqual(summary["counts"]["chmod"], 2)
+        self.assertNotIn("actions", summary)
+        self.assertGreater(summary["estimated_seconds"]["total"], 0)
+
+    def test_snapshot_round_trip(self):
+        path = os.path.join(self.tmp.name, "fs.json")
+        Path(path).write_text(json.dumps(self.snapshot.dump()))
+        loaded = FilesystemSnapshot.load(path)
+
+        self.assertEqual(loaded.directories, self.snapshot.directories)
+        self.assertEqual(loaded.quotas, self.snapshot.quotas)
+        self.assertEqual(loaded.archive_dev, 2)
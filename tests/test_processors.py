@@ -1,8 +1,10 @@
+import tempfile
 import unittest
 from unittest.mock import MagicMock, call
 
-from cscs_storage_sync.models import StorageResource, Target, TargetItem, QuotaItem
+from cscs_storage_sync.models import QuotaItem, StorageResource, Target, TargetItem
 from cscs_storage_sync.processors import ResourceProcessor
+from cscs_storage_sync.state import StateStore
 
 
 class TestResourceProcessor(unittest.TestCase):
@@ -114,3 +116,96 @@ class TestResourceProcessor(unittest.TestCase):
 
         self.mock_fs.archive_directory.assert_called_with("/mnt/test", "/tmp/archive")
         self.mock_client.send_callback.assert_any_call("http://done")
+
+
+class TestIncrementalSync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state = StateStore(self.tmp.name)
+        self.mock_fs = MagicMock()
+        self.processor = ResourceProcessor(
+            self.mock_fs, MagicMock(), {"min_gid_allowed": 1000}, state=self.state
+        )
+        self.resource = StorageResource(
+            itemId="res-1",
+            status="active",
+            mountPoint={"default": "/mnt/test"},
+            target=Target(
+                targetType="project", targetItem=TargetItem(itemId="t-1", name="proj", unixGid=2000)
+            ),
+            quotas=[QuotaItem(type="space", quota=1, unit="TB", enforcementType="hard")],
+            storageSystem={"itemId": "s-1", "key": "sys", "name": "Sys", "active": True},
+            storageFileSystem={"itemId": "fs-1", "key": "fs", "name": "FS", "active": True},
+            storageDataType={"itemId": "dt-1", "key": "dt", "name": "DT", "active": True},
+        )
+
+    def tearDown(self):
+        self.state.close()
+        self.tmp.cleanup()
+
+    def test_unchanged_active_resource_is_skipped(self):
+        self.processor.begin_cycle()
+        self.processor.process(self.resource)
+        self.processor.end_cycle()
+        self.processor.begin_cycle()
+        self.processor.process(self.resource)
+
+        self.assertEqual(self.mock_fs.ensure_directory.call_count, 1)
+        self.assertEqual(self.mock_fs.set_lustre_quota.call_count, 1)
+
+    def test_changed_active_resource_is_reapplied(self):
+        self.processor.begin_cycle()
+        self.processor.process(self.resource)
+        self.processor.end_cycle()
+        self.processor.begin_cycle()
+        self.processor.process(self.resource.model_copy(update={"mountPoint": {"default": "/x"}}))
+
+        self.assertEqual(self.mock_fs.ensure_directory.call_count, 2)
+
+    def test_full_reconciliation_reapplies_unchanged_resource(self):
+        self.processor.full_reconcile_interval = 0
+        self.processor.begin_cycle()
+        self.processor.process(self.resource)
+        self.processor.begin_cycle()
+        self.processor.process(self.resource)
+
+        self.assertEqual(self.mock_fs.ensure_directory.call_count, 2)
+
+    def test_incomplete_full_cycle_is_not_counted_as_reconciliation(self):
+        self.processor.begin_cycle()
+        self.assertTrue(self.processor.full_reconcile)
+        self.processor.end_cycle(complete=False)
+        self.processor.begin_cycle()
+        self.assertTrue(self.processor.full_reconcile)
+        self.processor.end_cycle()
+
+        self.processor.begin_cycle()
+        self.assertFalse(self.processor.full_reconcile)
+
+    def test_partial_cycle_is_not_counted_as_reconciliation(self):
+        quota_engine = MagicMock()
+        self.processor.quota_engine = quota_engine
+        self.processor.begin_cycle(full=False)
+        self.assertFalse(self.processor.full_reconcile)
+        self.processor.end_cycle()
+
+        self.mock_fs.begin_cycle.assert_not_called()
+        self.mock_fs.end_cycle.assert_not_called()
+        quota_engine.begin_cycle.assert_called_once_with(full=False)
+        self.assertIsNone(self.state.get_meta("last_full_reconcile"))
+        self.processor.begin_cycle()
+        self.assertTrue(self.processor.full_reconcile)
+
+    def test_usage_of_skipped_resources_is_still_tracked(self):
+        usage = MagicMock()
+        self.processor.usage_collector = usage
+        self.processor.begin_cycle()
+        self.processor.process(self.resource)
+        self.processor.end_cycle()
+        self.processor.begin_cycle()
+        self.processor.process(self.resource)
+        self.processor.process(self.resource.model_copy(update={"status": "removing"}))
+
+        self.assertEqual(usage.track.call_count, 2)
+        usage.track.assert_called_with("res-1", "/mnt/test", 2000)
+        usage.forget.assert_called_once_with("res-1")
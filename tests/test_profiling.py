@@ -0,0 +1,169 @@
+import pstats
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from cscs_storage_sync.profiling import CycleProfiler
+
+
+class Client:
+    dispatcher = None
+
+    def _get_page(self, page):
+        return b"page"
+
+    def _parse_page(self, content):
+        return SimpleNamespace(
+            resources=[
+                SimpleNamespace(itemId="a", status="pending"),
+                SimpleNamespace(itemId="b", status="active"),
+            ]
+        )
+
+    def _post_callback(self, url, data=None):
+        pass
+
+
+class Fs:
+    def ensure_directory(self, path, gid, mode):
+        pass
+
+    def apply_quota_limits(self, path, gid, limits):
+        pass
+
+
+class Processor:
+    def __init__(self, fs, client):
+        self.fs = fs
+        self.client = client
+
+    def process(self, resource, force=False):
+        self.fs.ensure_directory("/x", 2000, "775")
+        if resource.status == "pending":
+            self.client._post_callback("http://waldur/approve")
+
+
+class Scheduler:
+    def __init__(self, processor, client):
+        self.processor = processor
+        self.client = client
+        self.cycles = 0
+        self.long_lived = None
+
+    def run_full_cycle(self):
+        self.cycles += 1
+        parsed = self.client._parse_page(self.client._get_page(1))
+        # Resources are processed on a worker thread, as with workers > 1.
+        worker = threading.Thread(
+            target=lambda: [self.processor.process(r) for r in parsed.resources],
+            name="sync_0",
+        )
+        worker.start()
+        worker.join()
+        if self.long_lived is not None:
+            # A pool thread that outlives the cycle, like the callback dispatcher's.
+            self.long_lived.start()
+        # Batched quota enforcement is not tied to a resource.
+        self.processor.fs.apply_quota_limits("/x", 2000, None)
+        return len(parsed.resources)
+
+    def run_lifecycle_cycle(self):
+        return 0
+
+    def run_targeted_cycle(self, item_ids):
+        return 0
+
+    def run_drift_cycle(self, item_ids):
+        return 0
+
+
+class TestCycleProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        client = Client()
+        fs = Fs()
+        processor = Processor(fs, client)
+        self.pipeline = SimpleNamespace(
+            name="capstor",
+            client=client,
+            fs=fs,
+            processor=processor,
+            scheduler=Scheduler(processor, client),
+        )
+        self.profiler = CycleProfiler(self.tmp.name)
+        self.profiler.instrument(self.pipeline)
+
+    def outputs(self, suffix):
+        return sorted(Path(self.tmp.name).glob(f"cycle-capstor-full-*{suffix}"))
+
+    def test_nothing_is_profiled_until_requested(self):
+        self.assertEqual(self.pipeline.scheduler.run_full_cycle(), 2)
+
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+        self.assertNotIn("process", vars(self.pipeline.processor))
+
+    def test_requested_cycle_is_profiled_once(self):
+        self.profiler.request("full")
+        self.pipeline.scheduler.run_lifecycle_cycle()
+        self.assertEqual(self.profiler.requested, "full")
+
+        self.assertEqual(self.pipeline.scheduler.run_full_cycle(), 2)
+        self.assertIsNone(self.profiler.requested)
+
+        [stats_file] = self.outputs(".pstats")
+        functions = {func[2] for func in pstats.Stats(str(stats_file)).stats}
+        # Includes what ran on the worker thread.
+        self.assertIn("run_full_cycle", functions)
+        self.assertIn("process", functions)
+        [alloc] = self.outputs(".alloc.txt")
+        self.assertIn("Peak traced memory", alloc.read_text())
+
+        # The timers are removed again.
+        self.assertNotIn("process", vars(self.pipeline.processor))
+        self.assertNotIn("_get_page", vars(self.pipeline.client))
+        self.pipeline.scheduler.run_full_cycle()
+        self.assertEqual(len(self.outputs(".pstats")), 1)
+
+    def test_threads_outliving_the_cycle_are_not_profiled(self):
+        started = threading.Event()
+        done = threading.Event()
+        hooks = []
+
+        def run():
+            started.set()
+            done.wait(timeout=5)
+            hooks.append(sys.getprofile())
+
+        self.pipeline.scheduler.long_lived = threading.Thread(target=run, name="callback_0")
+        self.profiler.request()
+        self.pipeline.scheduler.run_full_cycle()
+        started.wait(timeout=5)
+        done.set()
+        self.pipeline.scheduler.long_lived.join()
+
+        self.assertEqual(hooks, [None])
+
+    def test_resource_table_attributes_phases(self):
+        self.profiler.request()
+        self.pipeline.scheduler.run_full_cycle()
+
+        [table] = self.outputs(".resources.tsv")
+        lines = [line.split("\t") for line in table.read_text().splitlines()]
+        header = lines[0]
+        rows = {line[0]: dict(zip(header, line, strict=True)) for line in lines[1:]}
+        self.assertEqual(set(rows), {"a", "b", "-"})
+        self.assertEqual(rows["a"]["status"], "pending")
+        self.assertGreater(float(rows["a"]["callback"]), 0)
+        self.assertEqual(float(rows["b"]["callback"]), 0)
+        for item_id in ("a", "b"):
+            self.assertGreater(float(rows[item_id]["ensure_directory"]), 0)
+            self.assertGreater(float(rows[item_id]["fetch"]), 0)
+        self.assertGreater(float(rows["-"]["setquota"]), 0)
+
+    def test_unknown_cycle_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.profiler.request("weekly")
@@ -0,0 +1,389 @@
+import ctypes
+import errno
+import os
+import stat
+import tempfile
+import textwrap
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from cscs_storage_sync.filesystem import FilesystemDriver
+from cscs_storage_sync.models import QuotaItem
+from cscs_storage_sync.quota import (
+    GroupQuota,
+    QuotaEngine,
+    QuotaError,
+    QuotaLimits,
+    compute_quota_limits,
+    merge_limits,
+    parse_lfs_quota,
+)
+from cscs_storage_sync.quota_backend import (
+    GRPQUOTA,
+    LUSTRE_Q_GETQUOTA,
+    LUSTRE_Q_SETQUOTA,
+    QIF_LIMITS,
+    CliQuotaBackend,
+    FakeQuotaBackend,
+    LlapiQuotaBackend,
+    QuotaBackend,
+    _IfQuotactl,
+    build_quota_backend,
+)
+
+LFS_QUOTA_OUTPUT = """\
+Disk quotas for grp proj_a (gid 2000):
+     Filesystem  kbytes   quota   limit   grace   files   quota   limit   grace
+  /mnt/lustre/capstor     512  1073741824  2147483648       -      10       0       0       -
+Disk quotas for grp proj_b (gid 2001):
+     Filesystem  kbytes   quota   limit   grace   files   quota   limit   grace
+/mnt/lustre/a/very/long/filesystem/name
+                 4096*      0  1024     -       3       0       0       -
+"""
+
+# Writes every setquota invocation to $LFS_LOG and serves $LFS_QUOTA_FILE for reads.
+FAKE_LFS = textwrap.dedent(
+    """\
+    #!/bin/sh
+    echo "$@" >> "$LFS_LOG"
+    if [ "$1" = "quota" ]; then
+        cat "$LFS_QUOTA_FILE"
+    fi
+    """
+)
+
+
+class TestParseLfsQuota(unittest.TestCase):
+    def test_parses_group_blocks(self):
+        quotas = parse_lfs_quota(LFS_QUOTA_OUTPUT)
+
+        self.assertEqual(quotas[2000].limits, QuotaLimits(1073741824, 2147483648, 0, 0))
+        self.assertEqual(quotas[2000].space_used, 512)
+        self.assertEqual(quotas[2001].limits, QuotaLimits(0, 1024, 0, 0))
+        self.assertEqual(quotas[2001].space_used, 4096)
+
+
+class TestComputeQuotaLimits(unittest.TestCase):
+    def test_space_units(self):
+        limits = compute_quota_limits(
+            [
+                QuotaItem(type="space", quota=512, unit="GB", enforcementType="soft"),
+                QuotaItem(type="space", quota=1, unit="", enforcementType="hard"),
+                QuotaItem(type="inodes", quota=1000, unit="files", enforcementType="hard"),
+            ]
+        )
+        self.assertEqual(limits, QuotaLimits(512 * 1024**2, 1024**3, 0, 1000))
+
+    def test_unit_mismatch_is_rejected(self):
+        with self.assertRaises(QuotaError):
+            compute_quota_limits(
+                [QuotaItem(type="space", quota=1, unit="inodes", enforcementType="hard")]
+            )
+        with self.assertRaises(QuotaError):
+            compute_quota_limits(
+                [QuotaItem(type="inodes", quota=1, unit="TB", enforcementType="hard")]
+            )
+
+    def test_merge_is_order_independent_and_unlimited_wins(self):
+        a = QuotaLimits(10, 20, 0, 5)
+        b = QuotaLimits(30, 15, 7, 9)
+        self.assertEqual(merge_limits([a, b]), merge_limits([b, a]))
+        self.assertEqual(merge_limits([a, b]), QuotaLimits(30, 20, 0, 9))
+        self.assertEqual(merge_limits([a, b], "sum"), QuotaLimits(40, 35, 0, 14))
+
+
+class TestQuotaEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        bin_dir = Path(self.tmp.name) / "bin"
+        bin_dir.mkdir()
+        lfs = bin_dir / "lfs"
+        lfs.write_text(FAKE_LFS)
+        lfs.chmod(lfs.stat().st_mode | stat.S_IEXEC)
+
+        self.log = Path(self.tmp.name) / "lfs.log"
+        quota_file = Path(self.tmp.name) / "quota.txt"
+        quota_file.write_text(LFS_QUOTA_OUTPUT)
+
+        env = {
+            "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            "LFS_LOG": str(self.log),
+            "LFS_QUOTA_FILE": str(quota_file),
+        }
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.fs = FilesystemDriver("/mnt/lustre")
+        self.engine = QuotaEngine(self.fs, max_workers=2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def lfs_calls(self):
+        return self.log.read_text().splitlines()
+
+    def test_only_differing_groups_are_set(self):
+        # gid 2000 already matches (1 TB soft, 2 TB hard), 2001 and 2002 differ
+        self.engine.stage(
+            "/capstor/a",
+            2000,
+            [
+                QuotaItem(type="space", quota=1, unit="TB", enforcementType="soft"),
+                QuotaItem(type="space", quota=2, unit="TB", enforcementType="hard"),
+            ],
+        )
+        self.engine.stage(
+            "/capstor/b",
+            2001,
+            [QuotaItem(type="space", quota=2, unit="TB", enforcementType="hard")],
+        )
+        self.engine.stage(
+            "/capstor/c",
+            2002,
+            [QuotaItem(type="inodes", quota=100, unit="", enforcementType="hard")],
+        )
+
+        self.assertEqual(self.engine.apply(), set())
+
+        calls = self.lfs_calls()
+        self.assertEqual(calls.count("quota -a -g /mnt/lustre/capstor"), 1)
+        setquotas = sorted(c for c in calls if c.startswith("setquota"))
+        self.assertEqual(len(setquotas), 2)
+        self.assertTrue(setquotas[0].startswith("setquota -g 2001 "))
+        self.assertTrue(setquotas[1].startswith("setquota -g 2002 "))
+
+    def test_failed_setquota_reports_item_ids(self):
+        self.engine.stage(
+            "/capstor/c",
+            2002,
+            [QuotaItem(type="inodes", quota=100, unit="", enforcementType="hard")],
+            item_id="res-c",
+        )
+        with mock.patch.dict(os.environ, {"PATH": "/nonexistent"}):
+            self.assertEqual(self.engine.apply(), {"res-c"})
+
+    def test_resources_sharing_a_gid_are_set_once(self):
+        for name, size in (("a", 1), ("b", 3), ("c", 2)):
+            self.engine.stage(
+                f"/capstor/{name}",
+                2001,
+                [QuotaItem(type="space", quota=size, unit="TB", enforcementType="hard")],
+                item_id=name,
+            )
+
+        self.assertEqual(self.engine.apply(), set())
+
+        setquotas = [c for c in self.lfs_calls() if c.startswith("setquota")]
+        self.assertEqual(
+            setquotas, [f"setquota -g 2001 -b 0 -B {3 * 1024**3} -i 0 -I 0 /mnt/lustre/capstor/a"]
+        )
+
+    def test_applied_limits_are_memoized_between_cycles(self):
+        quotas = [QuotaItem(type="space", quota=3, unit="TB", enforcementType="hard")]
+        self.engine.enforce("/capstor/b", 2001, quotas, item_id="b")
+        # The bulk read is unavailable; the limits set before are still in place.
+        with mock.patch.object(self.fs, "read_group_quotas", return_value={}):
+            self.engine.begin_cycle(full=True)
+            self.engine.stage("/capstor/b", 2001, quotas, item_id="b")
+            self.engine.apply()
+        self.engine.enforce("/capstor/b", 2001, quotas, item_id="b")
+
+        setquotas = [c for c in self.lfs_calls() if c.startswith("setquota")]
+        self.assertEqual(len(setquotas), 1)
+
+    def test_forgotten_resources_no_longer_raise_the_group_limit(self):
+        for name, size in (("a", 1), ("b", 3)):
+            self.engine.stage(
+                f"/capstor/{name}",
+                2001,
+                [QuotaItem(type="space", quota=size, unit="TB", enforcementType="hard")],
+                item_id=name,
+            )
+        self.engine.apply()
+        self.engine.forget("b")
+        self.engine.apply()
+
+        setquotas = [c for c in self.lfs_calls() if c.startswith("setquota")]
+        self.assertEqual(len(setquotas), 2)
+        self.assertIn(f"-B {1024**3} ", setquotas[-1])
+
+
+class FakeQuotactl:
+    """Stands in for llapi_quotactl, backed by a FakeQuotaBackend."""
+
+    def __init__(self, store: FakeQuotaBackend):
+        self.store = store
+        self.calls = []
+
+    def __call__(self, path: bytes, qctl_ptr) -> int:
+        qctl = qctl_ptr.contents
+        self.calls.append((path, qctl.qc_cmd, qctl.qc_type, qctl.qc_id))
+        if qctl.qc_type != GRPQUOTA:
+            return -errno.EINVAL
+        dqblk = qctl.qc_dqblk
+        if qctl.qc_cmd == LUSTRE_Q_SETQUOTA:
+            if dqblk.dqb_valid != QIF_LIMITS:
+                return -errno.EINVAL
+            limits = QuotaLimits(
+                dqblk.dqb_bsoftlimit,
+                dqblk.dqb_bhardlimit,
+                dqblk.dqb_isoftlimit,
+                dqblk.dqb_ihardlimit,
+            )
+            self.store.set_group_limits(Path(os.fsdecode(path)), qctl.qc_id, limits)
+            return 0
+        if qctl.qc_cmd == LUSTRE_Q_GETQUOTA:
+            quota = self.store.get_group_quota(Path(os.fsdecode(path)), qctl.qc_id)
+            dqblk.dqb_bsoftlimit = quota.limits.block_soft
+            dqblk.dqb_bhardlimit = quota.limits.block_hard
+            dqblk.dqb_isoftlimit = quota.limits.inode_soft
+            dqblk.dqb_ihardlimit = quota.limits.inode_hard
+            dqblk.dqb_curspace = quota.space_used * 1024
+            dqblk.dqb_curinodes = quota.inodes_used
+            return 0
+        return -errno.EOPNOTSUPP
+
+
+def stage_all(engine: QuotaEngine):
+    # 2000 already has these limits, 2001 differs
+    engine.stage(
+        "/capstor/a",
+        2000,
+        [
+            QuotaItem(type="space", quota=1, unit="TB", enforcementType="soft"),
+            QuotaItem(type="space", quota=2, unit="TB", enforcementType="hard"),
+        ],
+        item_id="a",
+    )
+    engine.stage(
+        "/capstor/b",
+        2001,
+        [QuotaItem(type="inodes", quota=100, unit="", enforcementType="hard")],
+        item_id="b",
+    )
+
+
+class TestQuotaBackends(unittest.TestCase):
+    def test_llapi_marshals_limits_and_usage(self):
+        store = FakeQuotaBackend()
+        store.groups[Path("/")] = {2000: GroupQuota(QuotaLimits(1, 2, 3, 4), 7, 9)}
+        quotactl = FakeQuotactl(store)
+        backend = LlapiQuotaBackend(quotactl=quotactl)
+
+        backend.set_group_limits(Path("/mnt/lustre/x"), 2001, QuotaLimits(10, 20, 30, 40))
+
+        self.assertEqual(backend.get_group_quota(Path("/mnt/lustre"), 2000).space_used, 7)
+        self.assertEqual(
+            backend.read_group_quotas(Path("/mnt/lustre"), [2000, 2001]),
+            {
+                2000: GroupQuota(QuotaLimits(1, 2, 3, 4), 7, 9),
+                2001: GroupQuota(QuotaLimits(10, 20, 30, 40)),
+            },
+        )
+        self.assertEqual(quotactl.calls[0], (b"/mnt/lustre/x", LUSTRE_Q_SETQUOTA, GRPQUOTA, 2001))
+
+    def test_llapi_errors_raise_oserror(self):
+        backend = LlapiQuotaBackend(quotactl=lambda path, qctl: -errno.EPERM)
+
+        with self.assertRaises(OSError) as ctx:
+            backend.set_group_limits(Path("/mnt/lustre"), 2000, QuotaLimits())
+        self.assertEqual(ctx.exception.errno, errno.EPERM)
+
+    def test_quotactl_struct_layout(self):
+        # 6 u32, obd_dqinfo (24), obd_dqblk (72), obd_type, obd_uuid, pool name
+        self.assertEqual(_IfQuotactl.qc_dqinfo.offset, 24)
+        self.assertEqual(_IfQuotactl.qc_dqblk.offset, 48)
+        self.assertEqual(_IfQuotactl.obd_type.offset, 120)
+        self.assertEqual(ctypes.sizeof(_IfQuotactl), 192)
+
+    def test_fake_backend_is_namespaced_by_mount(self):
+        backend = FakeQuotaBackend(mounts=[Path("/mnt/a"), Path("/mnt/b")])
+        backend.set_group_limits(Path("/mnt/a/x/y"), 2000, QuotaLimits(block_hard=1))
+
+        self.assertEqual(list(backend.read_group_quotas(Path("/mnt/a"))), [2000])
+        self.assertEqual(backend.read_group_quotas(Path("/mnt/b")), {})
+        self.assertEqual(backend.calls["set"], 1)
+
+    def test_backend_must_implement_get_and_set(self):
+        partial = type("Partial", (QuotaBackend,), {"set_group_limits": lambda *args: None})
+        with self.assertRaises(TypeError):
+            partial()
+
+    def test_unknown_backend_is_rejected(self):
+        self.assertIsInstance(build_quota_backend("fake"), FakeQuotaBackend)
+        with self.assertRaises(ValueError):
+            build_quota_backend("nfs")
+
+
+class TestBackendsAgree(unittest.TestCase):
+    """The engine makes the same decisions whichever backend it runs on."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def cli_backend(self):
+        bin_dir = Path(self.tmp.name) / "bin"
+        bin_dir.mkdir()
+        lfs = bin_dir / "lfs"
+        lfs.write_text(FAKE_LFS)
+        lfs.chmod(lfs.stat().st_mode | stat.S_IEXEC)
+        log = Path(self.tmp.name) / "lfs.log"
+        quota_file = Path(self.tmp.name) / "quota.txt"
+        quota_file.write_text(LFS_QUOTA_OUTPUT)
+        env = {
+            "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            "LFS_LOG": str(log),
+            "LFS_QUOTA_FILE": str(quota_file),
+        }
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return CliQuotaBackend(), lambda: [
+            line.split()[2] for line in log.read_text().splitlines() if line.startswith("setquota")
+        ]
+
+    def preset_store(self):
+        # The groups of LFS_QUOTA_OUTPUT: 2000 already at 1 TB soft / 2 TB hard.
+        store = FakeQuotaBackend(mounts=[Path("/mnt/lustre/capstor")])
+        store.set_group_limits(
+            Path("/mnt/lustre/capstor"), 2000, QuotaLimits(1024**3, 2 * 1024**3, 0, 0)
+        )
+        store.set_group_limits(Path("/mnt/lustre/capstor"), 2001, QuotaLimits(0, 1024, 0, 0))
+        store.calls["set"] = 0
+        return store
+
+    def apply(self, backend):
+        engine = QuotaEngine(FilesystemDriver("/mnt/lustre", quota_backend=backend))
+        stage_all(engine)
+        self.assertEqual(engine.apply(), set())
+
+    def test_cli_fake_and_llapi_agree(self):
+        cli, cli_calls = self.cli_backend()
+        self.apply(cli)
+
+        fake = self.preset_store()
+        self.apply(fake)
+
+        store = self.preset_store()
+        quotactl = FakeQuotactl(store)
+        self.apply(LlapiQuotaBackend(quotactl=quotactl))
+        llapi_set = [c[3] for c in quotactl.calls if c[1] == LUSTRE_Q_SETQUOTA]
+
+        self.assertEqual(cli_calls(), ["2001"])
+        self.assertEqual(fake.calls["set"], 1)
+        self.assertEqual(llapi_set, [2001])
+        self.assertEqual(
+            fake.read_group_quotas(Path("/mnt/lustre/capstor")),
+            store.read_group_quotas(Path("/mnt/lustre/capstor")),
+        )
+
+    def test_dry_run_sets_nothing(self):
+        fake = FakeQuotaBackend()
+        fs = FilesystemDriver("/mnt/lustre", dry_run=True, quota_backend=fake)
+
+        fs.apply_quota_limits(Path("/mnt/lustre/capstor/a"), 2000, QuotaLimits(block_hard=1))
+
+        self.assertEqual(fake.calls["set"], 0)
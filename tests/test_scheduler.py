@@ -0,0 +1,125 @@
+import json
+import os
+import stat
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock
+
+from cscs_storage_sync.api_client import IncompleteInventoryError
+from cscs_storage_sync.scheduler import SyncScheduler, TriggerServer
+
+
+def resource(item_id, status):
+    res = MagicMock()
+    res.itemId = item_id
+    res.status = status
+    return res
+
+
+class TestSyncScheduler(unittest.TestCase):
+    def setUp(self):
+        self.client = MagicMock()
+        self.processor = MagicMock()
+        self.processed = []
+
+        def process_all(resources, force=False):
+            batch = [(r.itemId, force) for r in resources]
+            self.processed.extend(batch)
+            return len(batch)
+
+        self.processor.process_all.side_effect = process_all
+        self.scheduler = SyncScheduler(
+            self.client,
+            self.processor,
+            {"sync_interval_seconds": 3600, "lifecycle_poll_interval_seconds": 1},
+        )
+
+    def test_lifecycle_cycle_only_processes_lifecycle_statuses(self):
+        self.client.iter_resources.return_value = iter(
+            [resource("a", "pending"), resource("b", "active"), resource("c", "removing")]
+        )
+
+        self.scheduler.run_lifecycle_cycle()
+
+        params = self.client.iter_resources.call_args.kwargs["params"]
+        self.assertEqual(params, {"status": "pending,updating,removing"})
+        self.assertEqual(self.processed, [("a", False), ("c", False)])
+        self.processor.begin_cycle.assert_called_once_with(full=False)
+        self.processor.end_cycle.assert_called_once_with()
+
+    def test_targeted_cycle_forces_active_resources(self):
+        self.client.iter_resources.side_effect = [
+            iter([resource("a", "pending")]),
+            iter([resource("x", "active"), resource("b", "active")]),
+        ]
+
+        self.scheduler.run_targeted_cycle({"a", "b"})
+
+        self.assertEqual(self.processed, [("a", True), ("b", True)])
+        self.processor.begin_cycle.assert_called_once_with(full=False)
+        self.processor.end_cycle.assert_called_once()
+
+    def test_incomplete_inventory_is_not_treated_as_complete(self):
+        def truncated():
+            yield resource("a", "active")
+            raise IncompleteInventoryError(1, 2, OSError("connection reset"))
+
+        self.client.iter_resources.return_value = truncated()
+
+        self.scheduler.run_full_cycle()
+
+        self.processor.end_cycle.assert_called_once_with(complete=False)
+
+    def test_trigger_endpoint_wakes_scheduler(self):
+        self.client.iter_resources.return_value = iter([])
+        server = TriggerServer(self.scheduler, port=0, token="secret")
+        server.start()
+        self.addCleanup(server.close)
+
+        self.scheduler.run_targeted_cycle = MagicMock(side_effect=lambda ids: self.scheduler.stop())
+        self.scheduler.run_full_cycle = MagicMock()
+        runner = threading.Thread(target=self.scheduler.run)
+        runner.start()
+
+        request = urllib.request.Request(
+            server.address,
+            data=json.dumps({"itemIds": ["res-1"]}).encode(),
+            headers={"Authorization": "Bearer secret"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=5) as resp:
+            self.assertEqual(resp.status, 202)
+
+        runner.join(timeout=5)
+        self.assertFalse(runner.is_alive())
+        self.scheduler.run_targeted_cycle.assert_called_once_with({"res-1"})
+
+    def test_trigger_port_requires_the_token(self):
+        with self.assertRaises(ValueError):
+            TriggerServer(self.scheduler, port=0)
+
+        self.scheduler.trigger = MagicMock()
+        server = TriggerServer(self.scheduler, port=0, token="secret")
+        server.start()
+        self.addCleanup(server.close)
+        for headers in ({}, {"Authorization": "Bearer guess"}):
+            request = urllib.request.Request(server.address, headers=headers, method="POST")
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                urllib.request.urlopen(request, timeout=5)
+            ctx.exception.close()
+            self.assertEqual(ctx.exception.code, 401)
+        self.scheduler.trigger.assert_not_called()
+
+    def test_trigger_socket_is_private(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "sync.sock")
+
+        server = TriggerServer(self.scheduler, socket_path=path)
+        server.start()
+        self.addCleanup(server.close)
+
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
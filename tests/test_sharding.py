@@ -0,0 +1,159 @@
+import os
+import tempfile
+import time
+import unittest
+from collections import Counter
+from unittest.mock import MagicMock
+
+from helpers import resource
+
+from cscs_storage_sync.pipeline import system_config
+from cscs_storage_sync.scheduler import SyncScheduler
+from cscs_storage_sync.sharding import HashRing, ShardMembership, shard_key
+
+
+def project(item_id, path, gid):
+    res = resource(item_id, path)
+    res.target.targetType = "project"
+    res.target.targetItem.unixGid = gid
+    return res
+
+
+class TestHashRing(unittest.TestCase):
+    def test_keys_are_spread_over_nodes(self):
+        ring = HashRing(["a", "b", "c"])
+        owners = Counter(ring.owner(f"/capstor/p{i}") for i in range(3000))
+        self.assertEqual(set(owners), {"a", "b", "c"})
+        self.assertTrue(all(count > 600 for count in owners.values()))
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b"])
+        for i in range(1000):
+            key = f"/capstor/p{i}"
+            if before.owner(key) != "c":
+                self.assertEqual(before.owner(key), after.owner(key))
+
+
+class TestShardMembership(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.a = ShardMembership(self.tmp.name, node="a", lease_seconds=60)
+        self.b = ShardMembership(self.tmp.name, node="b", lease_seconds=60)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_agents_split_resources_without_overlap(self):
+        self.a.heartbeat()
+        self.b.heartbeat()
+        resources = [resource(f"id{i}", f"/capstor/p{i}") for i in range(200)]
+
+        mine = {r.itemId for r in self.a.filter(resources)}
+        theirs = {r.itemId for r in self.b.filter(resources)}
+
+        self.assertFalse(mine & theirs)
+        self.assertEqual(len(mine | theirs), 200)
+        self.assertTrue(mine and theirs)
+
+    def test_projects_sharing_a_gid_stay_on_one_agent(self):
+        self.a.heartbeat()
+        self.b.heartbeat()
+        # Both agents hold some of the GID groups, each group only on one of them.
+        groups = {
+            gid: [project(f"{gid}-{i}", f"/capstor/g{gid}/p{i}", gid) for i in range(20)]
+            for gid in range(5000, 5020)
+        }
+
+        owners = Counter()
+        for members in groups.values():
+            mine = {r.itemId for r in self.a.filter(members)}
+            theirs = {r.itemId for r in self.b.filter(members)}
+            self.assertFalse(mine & theirs)
+            self.assertEqual(len(mine | theirs), 20)
+            self.assertIn(len(mine), (0, 20))
+            owners["a" if mine else "b"] += 1
+        self.assertEqual(set(owners), {"a", "b"})
+
+    def test_gid_groups_are_per_filesystem(self):
+        filesystems = {"/capstor/store/p1": "/capstor", "/iopsstor/store/p1": "/iopsstor"}
+        capstor = project("p1", "/capstor/store/p1", 5000)
+        iopsstor = project("p1", "/iopsstor/store/p1", 5000)
+
+        keys = {shard_key(r, filesystems.get) for r in (capstor, iopsstor)}
+
+        self.assertEqual(keys, {"quota:/capstor:5000", "quota:/iopsstor:5000"})
+
+    def test_expired_lease_leaves_the_ring(self):
+        self.a.heartbeat()
+        self.b.heartbeat()
+        stale = time.time() - 120
+        os.utime(os.path.join(self.tmp.name, "b.lease"), (stale, stale))
+
+        self.assertEqual(self.a.members(), ["a"])
+        self.assertTrue(all(self.a.owns(resource(f"id{i}", f"/p{i}")) for i in range(50)))
+
+    def test_shards_are_handed_over_only_after_release(self):
+        self.a.heartbeat()
+        with self.a.claim() as first:
+            self.assertEqual(len(first.held), self.a.shards)
+            # b joins while a's cycle still touches all shards.
+            self.b.heartbeat()
+            self.a._ring_checked = self.b._ring_checked = float("-inf")
+            with self.b.claim() as blocked:
+                self.assertEqual(blocked.held, frozenset())
+        # Closing the claim releases what the ring moved to b.
+        with self.a.claim() as mine, self.b.claim() as theirs:
+            self.assertFalse(mine.held & theirs.held)
+            self.assertEqual(len(mine.held | theirs.held), self.a.shards)
+            self.assertTrue(theirs.held)
+
+    def test_shards_of_an_expired_lease_can_be_taken(self):
+        self.b.heartbeat()
+        with self.b.claim() as theirs:
+            self.assertEqual(len(theirs.held), self.b.shards)
+        stale = time.time() - 120
+        os.utime(os.path.join(self.tmp.name, "b.lease"), (stale, stale))
+
+        self.a.heartbeat()
+        with self.a.claim() as mine:
+            self.assertEqual(len(mine.held), self.a.shards)
+
+    def test_agent_without_a_fresh_lease_holds_nothing(self):
+        with self.a.claim() as claim:
+            self.assertEqual(claim.held, frozenset())
+
+    def test_scheduler_only_processes_owned_resources(self):
+        self.a.heartbeat()
+        self.b.heartbeat()
+        client = MagicMock()
+        processed = []
+        processor = MagicMock()
+        processor.process_all.side_effect = lambda resources: processed.extend(resources) or 0
+        resources = [resource(f"id{i}", f"/capstor/p{i}") for i in range(100)]
+        client.iter_resources.return_value = iter(resources)
+
+        scheduler = SyncScheduler(client, processor, {}, shard=self.a)
+        scheduler.run_full_cycle()
+
+        self.assertTrue(0 < len(processed) < 100)
+        self.assertTrue(all(self.a.owns(r) for r in processed))
+        # The claim is closed after the cycle.
+        self.assertIsNone(scheduler._claim)
+        self.assertFalse(+self.a._pins)
+
+
+class TestSystemConfig(unittest.TestCase):
+    def test_overrides_and_state_dir(self):
+        config = {
+            "workers": 8,
+            "state_dir": "/var/lib/sync",
+            "storage_systems": {"vast": {"workers": 2}},
+        }
+
+        vast = system_config(config, "vast")
+        capstor = system_config(config, "capstor")
+
+        self.assertEqual(vast["workers"], 2)
+        self.assertEqual(capstor["workers"], 8)
+        self.assertEqual(vast["state_dir"], "/var/lib/sync/vast")
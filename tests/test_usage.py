@@ -0,0 +1,91 @@
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import requests
+
+from cscs_storage_sync.filesystem import FilesystemDriver
+from cscs_storage_sync.quota import GroupQuota, QuotaLimits
+from cscs_storage_sync.quota_backend import FakeQuotaBackend
+from cscs_storage_sync.usage import UsageCollector
+
+CAPSTOR = Path("/mnt/lustre/capstor")
+
+
+class TestUsageCollector(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeQuotaBackend(mounts=[CAPSTOR])
+        self.set_usage(2000, 1000, 10)
+        self.set_usage(2001, 5000, 50)
+        self.fs = FilesystemDriver("/mnt/lustre", quota_backend=self.backend)
+        self.client = MagicMock()
+        self.now = [1000.0]
+        self.collector = UsageCollector(
+            self.fs,
+            self.client,
+            {
+                "usage_report_url": "http://waldur/usage/",
+                "usage_batch_size": 2,
+                "usage_requests_per_second": 0,
+                "usage_report_threshold": 0.1,
+            },
+            clock=lambda: self.now[0],
+        )
+        self.collector.track("a", "/capstor/a", 2000)
+        self.collector.track("b", "/capstor/b", 2000)
+        self.collector.track("c", "/capstor/c", 2001)
+
+    def set_usage(self, gid, space_kb, inodes):
+        self.backend.groups.setdefault(CAPSTOR, {})[gid] = GroupQuota(
+            QuotaLimits(), space_kb, inodes
+        )
+
+    def sent(self):
+        return [
+            item["itemId"]
+            for call in self.client.post.call_args_list
+            for item in call.args[1]["usages"]
+        ]
+
+    def test_usage_is_read_once_per_filesystem_and_batched(self):
+        self.assertEqual(self.collector.report(), 3)
+
+        self.assertEqual(self.backend.calls["read"], 1)
+        self.assertEqual(self.client.post.call_count, 2)
+        first = self.client.post.call_args_list[0].args[1]["usages"][0]
+        self.assertEqual(
+            first,
+            {"itemId": "a", "gid": 2000, "space_used_kb": 1000, "inodes_used": 10, "shared": True},
+        )
+
+    def test_only_changes_beyond_the_threshold_are_sent(self):
+        self.collector.report()
+        self.client.post.reset_mock()
+        self.set_usage(2000, 1050, 10)
+        self.set_usage(2001, 6000, 50)
+
+        self.assertEqual(self.collector.report(), 1)
+        self.assertEqual(self.sent(), ["c"])
+
+        # Unchanged values are still refreshed once they are old.
+        self.client.post.reset_mock()
+        self.now[0] += 86400
+        self.assertEqual(self.collector.report(), 3)
+
+    def test_failed_batches_are_sent_next_round(self):
+        self.client.post.side_effect = [None, requests.ConnectionError("down")]
+        self.assertEqual(self.collector.report(), 2)
+
+        self.client.post.side_effect = None
+        self.client.post.reset_mock()
+        self.assertEqual(self.collector.report(), 1)
+        self.assertEqual(self.sent(), ["c"])
+
+    def test_resources_not_seen_in_a_full_cycle_are_dropped(self):
+        self.collector.begin_cycle(full=True)
+        self.collector.track("a", "/capstor/a", 2000)
+        self.collector.end_cycle(complete=True)
+        self.collector.report()
+
+        self.assertEqual(self.sent(), ["a"])
+        self.assertFalse(self.client.post.call_args.args[1]["usages"][0]["shared"])
@@ -0,0 +1,93 @@
+import threading
+import unittest
+
+from helpers import make_resource
+
+from cscs_storage_sync.executor import OrderedExecutor
+from cscs_storage_sync.workqueue import WorkQueue, tenant_key
+
+
+class TestWorkQueue(unittest.TestCase):
+    def setUp(self):
+        self.now = [0.0]
+        self.waits = []
+        self.queue = WorkQueue(
+            {"lifecycle": 10, "enforcement": 100},
+            on_dequeue=lambda *args: self.waits.append(args),
+            clock=lambda: self.now[0],
+        )
+
+    def put(self, *resources):
+        for res in resources:
+            self.queue.put(res, res.itemId)
+
+    def drain(self):
+        self.queue.close()
+        return list(iter(self.queue.get, None))
+
+    def test_lifecycle_goes_before_enforcement(self):
+        self.put(
+            make_resource("a1"),
+            make_resource("a2"),
+            make_resource("p", status="pending"),
+            make_resource("r", status="removing"),
+        )
+
+        self.assertEqual(self.drain(), ["p", "r", "a1", "a2"])
+
+    def test_tenants_take_turns(self):
+        self.put(*(make_resource(f"big{i}", parent="customer-1") for i in range(3)))
+        self.put(make_resource("small", parent="customer-2"))
+        self.put(make_resource("customer-2", target_type="customer"))
+
+        self.assertEqual(self.drain(), ["big0", "small", "big1", "customer-2", "big2"])
+        self.assertEqual(
+            tenant_key(make_resource("customer-2", target_type="customer")), "customer-2"
+        )
+
+    def test_overdue_class_is_served_oldest_first(self):
+        self.put(make_resource("a1"), make_resource("a2"))
+        self.now[0] = 150
+        self.put(make_resource("p", status="pending"))
+
+        self.assertEqual(self.drain(), ["a1", "a2", "p"])
+        self.assertEqual(self.waits[0], ("enforcement", 150, True))
+        stats = self.queue.stats()
+        self.assertEqual(stats["enforcement"]["missed"], 2)
+        self.assertEqual(stats["lifecycle"]["served"], 1)
+        self.assertEqual(stats["lifecycle"]["max"], 0)
+
+    def test_get_blocks_until_put(self):
+        taken = []
+        worker = threading.Thread(target=lambda: taken.append(self.queue.get()))
+        worker.start()
+        self.put(make_resource("a"))
+        worker.join(timeout=5)
+
+        self.assertEqual(taken, ["a"])
+
+
+class TestPrioritizedExecution(unittest.TestCase):
+    def test_lifecycle_resources_overtake_enforcement_within_the_window(self):
+        order = []
+        started = threading.Event()
+        gate = threading.Event()
+
+        def handler(res):
+            started.set()
+            gate.wait(timeout=5)
+            order.append(res.itemId)
+
+        def resources():
+            yield make_resource("first")
+            started.wait(timeout=5)
+            for i in range(5):
+                yield make_resource(f"a{i}")
+            yield make_resource("p", status="pending")
+            # Everything is queued while "first" is running.
+            gate.set()
+
+        count = OrderedExecutor(handler, workers=1, max_pending=10).run(resources())
+
+        self.assertEqual(count, 7)
+        self.assertEqual(order[:2], ["first", "p"])